@@ -218,7 +218,7 @@ class Collection(BaseCollection):
             if task.due_date != data['start_date']:
                 task.due_date = data['start_date']
                 task._skip_calendar_sync = True
-                task.save(update_fields=['due_date'])
+                task.save(update_fields=['due_date', 'updated_at'])
 
         # Return new item
         new_ical = serialize_event_to_ical(event)
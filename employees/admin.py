@@ -8,9 +8,10 @@ from .models import (
     TaskList, Task, Checklist, ChecklistItem, Comment, EmployeePerformanceRecord,
     ManualKpiEntry, SiteConfiguration,
     JobProfile, KPIBonusTier, DolibarrInstance, DolibarrUserIdentity,
-    SalesRecord, ProductCreationLog, WebhookLog, CommissionBalance,
-    TipoAusencia, SolicitudAusencia, ReciboNomina,
+    SalesRecord, ProductCreationLog, WebhookLog, WebhookArchive, CommissionBalance,
+    TipoAusencia, SolicitudAusencia, ReciboNomina, EnvioDolibarr, CierreNomina, Feriado,
 )
+from .cola_webhooks import ESTADOS_REPROCESABLES, reprocesar
 
 @admin.register(SiteConfiguration)
 class SiteConfigurationAdmin(admin.ModelAdmin):
@@ -178,7 +179,8 @@ class TaskAdmin(admin.ModelAdmin):
         }),
         ('Recurrence', {
             'classes': ('collapse',),
-            'fields': ('is_recurring', 'recurrence_frequency', 'recurrence_end_date'),
+            'fields': ('is_recurring', 'recurrence_frequency', 'recurrence_interval',
+                       'recurrence_byday', 'recurrence_end_date'),
         }),
     )
 
@@ -333,24 +335,43 @@ class CommissionBalanceAdmin(admin.ModelAdmin):
 
 @admin.register(WebhookLog)
 class WebhookLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'received_at', 'instance_name', 'trigger_code', 'status', 'sender_ip', 'short_error')
-    list_filter = ('status', 'received_at')
-    readonly_fields = ('received_at', 'sender_ip', 'payload', 'headers', 'status', 'error_message')
+    list_display = ('id', 'received_at', 'instance_name', 'trigger_code', 'status', 'attempts', 'sender_ip', 'short_error')
+    list_filter = ('status', 'trigger_code', 'received_at')
+    search_fields = ('=professional_id', '=trigger_code')
+    readonly_fields = ('received_at', 'sender_ip', 'payload', 'headers', 'status', 'error_message',
+                       'instance', 'professional_id', 'trigger_code', 'attempts', 'next_attempt_at',
+                       'processed_at')
     date_hierarchy = 'received_at'
+    list_select_related = ('instance',)
+    actions = ['reencolar', 'reprocesar_ahora']
+
+    @admin.action(description='Reencolar (procesar_webhooks los vuelve a aplicar)')
+    def reencolar(self, request, queryset):
+        n = queryset.filter(status__in=['dead', 'error', 'retry', 'throttled'], instance__isnull=False).update(
+            status='queued', attempts=0, next_attempt_at=None)
+        self.message_user(request, f"{n} webhook(s) reencolados.")
+
+    @admin.action(description='Reprocesar ahora (error, throttled o dead)')
+    def reprocesar_ahora(self, request, queryset):
+        resultado = reprocesar(queryset.filter(status__in=ESTADOS_REPROCESABLES))
+        resumen = ', '.join(f"{resultado[estado]} {estado}"
+                            for estado in ('processed', 'error', 'retry', 'dead', 'queued') if resultado.get(estado))
+        mensaje = f"{resultado['reencolados']} webhook(s) reprocesados: {resumen or 'sin cambios'}."
+        if resultado['arrastrados']:
+            mensaje += f" {resultado['arrastrados']} que ya estaban en cola en esas instancias se aplicaron antes."
+        if resultado['sin_instancia']:
+            mensaje += f" {resultado['sin_instancia']} sin instancia verificada (usar replay_webhooks --confiar-encabezados)."
+        self.message_user(request, mensaje)
+
+    def get_queryset(self, request):
+        # La lista no necesita el JSON de cada fila
+        return super().get_queryset(request).defer('payload', 'headers')
 
     @admin.display(description='Instancia')
     def instance_name(self, obj):
-        prof_id = (obj.headers or {}).get('X-Dolibarr-Professional-Id', '')
-        if prof_id:
-            instance = DolibarrInstance.objects.filter(professional_id=prof_id).first()
-            if instance:
-                return instance.name
-            return prof_id
-        return '-'
-
-    @admin.display(description='Evento')
-    def trigger_code(self, obj):
-        return (obj.payload or {}).get('trigger_code', '-')
+        if obj.instance_id:
+            return obj.instance.name
+        return obj.professional_id or '-'
 
     @admin.display(description='Error')
     def short_error(self, obj):
@@ -362,12 +383,33 @@ class WebhookLogAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(WebhookArchive)
+class WebhookArchiveAdmin(admin.ModelAdmin):
+    """Índice de los archivos de archivar_webhooks (solo lectura)."""
+    list_display = ('archivo', 'desde', 'hasta', 'primer_id', 'ultimo_id', 'cantidad', 'bytes')
+    date_hierarchy = 'desde'
+    search_fields = ('archivo',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(TipoAusencia)
 class TipoAusenciaAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'descuenta_saldo', 'es_remunerada', 'activo')
     list_filter = ('activo',)
 
 
+@admin.register(Feriado)
+class FeriadoAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'nombre')
+    date_hierarchy = 'fecha'
+    search_fields = ('nombre',)
+
+
 @admin.register(SolicitudAusencia)
 class SolicitudAusenciaAdmin(admin.ModelAdmin):
     list_display = ('employee', 'tipo', 'fecha_inicio', 'fecha_fin',
@@ -398,3 +440,27 @@ class ReciboNominaAdmin(admin.ModelAdmin):
 
     def has_change_permission(self, request, obj=None):
         return False
+
+
+@admin.register(EnvioDolibarr)
+class EnvioDolibarrAdmin(admin.ModelAdmin):
+    """Historial de envíos de nómina a Dolibarr (solo lectura, se lanzan desde /nomina/)."""
+    list_display = ('year', 'month', 'estado', 'enviados', 'ya_sincronizados', 'sin_mapeo',
+                    'con_error', 'iniciado_por', 'creado', 'terminado')
+    list_filter = ('estado', 'year')
+    readonly_fields = [f.name for f in EnvioDolibarr._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(CierreNomina)
+class CierreNominaAdmin(admin.ModelAdmin):
+    """Historial de cierres de mes (solo lectura, se lanzan desde /nomina/)."""
+    list_display = ('year', 'month', 'estado', 'generados', 'omitidos', 'iniciado_por',
+                    'creado', 'terminado')
+    list_filter = ('estado', 'year')
+    readonly_fields = [f.name for f in CierreNomina._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .api_views import WorkLogViewSet, TaskBoardViewSet, TaskViewSet, kpi_history_api, DolibarrWebhookView
+from .api_views import WorkLogViewSet, TaskBoardViewSet, TaskViewSet, kpi_history_api, payroll_what_if_api, salary_cache_stats_api, webhook_idempotency_stats_api, DolibarrWebhookView, DolibarrWebhookBatchView
 
 router = DefaultRouter()
 router.register(r'worklogs', WorkLogViewSet)
@@ -11,5 +11,9 @@ router.register(r'tasks', TaskViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('employees/<int:employee_id>/kpi-history/', kpi_history_api, name='kpi_history_api'),
+    path('payroll/what-if/', payroll_what_if_api, name='payroll_what_if_api'),
+    path('payroll/cache-stats/', salary_cache_stats_api, name='salary_cache_stats_api'),
+    path('webhook/idempotency-stats/', webhook_idempotency_stats_api, name='webhook_idempotency_stats_api'),
     path('webhook/dolibarr/', DolibarrWebhookView.as_view(), name='dolibarr_webhook'),
+    path('webhook/dolibarr/batch/', DolibarrWebhookBatchView.as_view(), name='dolibarr_webhook_batch'),
 ]
@@ -5,26 +5,33 @@ from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.throttling import AnonRateThrottle
-from .models import WorkLog, TaskBoard, Task, EmployeePerformanceRecord, Employee, DolibarrInstance, DolibarrUserIdentity, SalesRecord, WebhookLog, ProductCreationLog
-from .serializers import WorkLogSerializer, TaskBoardSerializer, TaskSerializer
-from datetime import date, datetime, timedelta
+from .models import WorkLog, TaskBoard, Task, EmployeePerformanceRecord, Employee, DolibarrUserIdentity, SalesRecord, WebhookLog, ProductCreationLog
+from .serializers import WorkLogSerializer, TaskBoardSerializer, TaskSerializer, BOARD_PREFETCH, board_document
+from . import cambios_tablero, idempotencia_webhooks, identidades, limite_webhooks
+from .payroll import invalidate_salary_cache, salary_cache_stats
+from .recurrentes import crear_primera_instancia
+from .resumen_mensual import refresh_summaries, summary_keys
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
 from collections import defaultdict
 from dateutil.relativedelta import relativedelta
 from django.db import transaction, IntegrityError
 from django.db.models import Q
 from django.utils import timezone
-import hashlib
 import hmac
 import json
 import logging
+import math
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
 class WebhookRateThrottle(AnonRateThrottle):
-    """Rate limiter for webhook endpoints. Applied manually AFTER logging,
-    not via throttle_classes, to ensure all requests are logged."""
+    """Per-IP rate limiter for webhook requests that don't come from a
+    verified instance (those use the shared token bucket, limite_webhooks).
+    Applied manually AFTER logging, not via throttle_classes, to ensure all
+    requests are logged."""
     rate = '300/min'
 
 class WorkLogViewSet(viewsets.ModelViewSet):
@@ -48,6 +55,30 @@ class WorkLogViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("No employee profile linked to this user.")
         serializer.save(employee=user.employee)
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_file(self, request):
+        """
+        Bulk upsert of WorkLogs from a time-clock export (multipart 'file',
+        CSV or XLSX). Superuser only. Returns counts and the rejected rows.
+        """
+        if not request.user.is_superuser:
+            return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "'file' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        from .importacion import ImportacionError, importar_worklogs, leer_filas
+        try:
+            result = importar_worklogs(leer_filas(upload, upload.name))
+        except ImportacionError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'processed': result['procesadas'],
+            'created': result['creadas'],
+            'updated': result['actualizadas'],
+            'rejected': [{'row': row, 'error': error} for row, error in result['rechazadas']],
+        })
+
 class TaskBoardViewSet(viewsets.ReadOnlyModelViewSet):
     """A viewset for viewing task boards."""
     queryset = TaskBoard.objects.all()
@@ -59,9 +90,15 @@ class TaskBoardViewSet(viewsets.ReadOnlyModelViewSet):
         """
         user = self.request.user
         if hasattr(user, 'employee'):
-            return TaskBoard.objects.filter(employee=user.employee)
+            return TaskBoard.objects.filter(employee=user.employee).prefetch_related(*BOARD_PREFETCH)
         return TaskBoard.objects.none()
 
+    @action(detail=True, methods=['get'])
+    def flat(self, request, pk=None):
+        """The board as a normalized document (lists, tasks and checklists
+        keyed by id), loaded with a fixed set of queries."""
+        return Response(board_document(self.get_object()))
+
 class TaskViewSet(viewsets.ModelViewSet):
     """A viewset for viewing and editing tasks."""
     queryset = Task.objects.all()
@@ -72,40 +109,12 @@ class TaskViewSet(viewsets.ModelViewSet):
         This view should return a list of all the tasks
         for the currently authenticated user, excluding recurring templates.
         If the user is a superuser, it should return all tasks (excluding templates).
-        Before returning, it checks for and generates any overdue recurring task instances.
+        Read-only: due recurring instances are created by the
+        `materializar_recurrentes` command (recurrentes.py), not here.
         """
         user = self.request.user
         employee_id = self.request.query_params.get('employee_id')
 
-        # Determine the base set of employees to check tasks for
-        employees_to_check = []
-        if user.is_superuser:
-            if employee_id:
-                # Superuser is viewing a specific employee's board
-                try:
-                    employees_to_check = [Employee.objects.get(pk=employee_id)]
-                except Employee.DoesNotExist:
-                    return Task.objects.none() # Return empty if employee not found
-            else:
-                # Superuser is viewing their own board or a general view
-                 employees_to_check = Employee.objects.filter(Q(end_date__isnull=True) | Q(end_date__gte=date.today()))
-        elif hasattr(user, 'employee'):
-            # Regular employee viewing their own board
-            employees_to_check = [user.employee]
-
-
-        # Generate recurring tasks that are due for the determined employees
-        if employees_to_check:
-             for employee in employees_to_check:
-                parent_tasks = Task.objects.filter(
-                    assigned_to=employee,
-                    is_recurring=True,
-                    recurrence_end_date__gte=timezone.localtime(timezone.now()).date()
-                )
-                for parent in parent_tasks:
-                    self.generate_missing_tasks(parent)
-
-
         # Filter the final queryset based on user permissions and employee_id
         base_queryset = Task.objects.filter(is_recurring=False)
         if user.is_superuser:
@@ -116,68 +125,6 @@ class TaskViewSet(viewsets.ModelViewSet):
             return base_queryset.filter(assigned_to=user.employee)
         return Task.objects.none()
 
-    def generate_missing_tasks(self, parent_task):
-        """
-        Generates instances for a recurring task that are due but not yet created.
-        This process is idempotent; it will not create duplicate tasks for the same day.
-        """
-        last_instance = Task.objects.filter(parent_task=parent_task).order_by('-due_date').first()
-
-        # Determine the date to start generating tasks from.
-        if last_instance:
-            start_date = timezone.localtime(last_instance.due_date).date()
-        else:
-            # If no instances exist, start from the parent's due date. To ensure the first
-            # task is created by the loop, we set the start date to the day before.
-            start_date = timezone.localtime(parent_task.due_date).date() - timedelta(days=1)
-
-        # Determine the time from the parent task's due date (localized to avoid UTC drift)
-        due_time = timezone.localtime(parent_task.due_date).time()
-
-        # Loop to generate missing tasks until today.
-        next_date = start_date
-        while True:
-            # Calculate the next theoretical due date.
-            if parent_task.recurrence_frequency == 'daily':
-                next_date += timedelta(days=1)
-            elif parent_task.recurrence_frequency == 'weekly':
-                next_date += timedelta(weeks=1)
-            elif parent_task.recurrence_frequency == 'monthly':
-                next_date += relativedelta(months=1)
-            elif parent_task.recurrence_frequency == 'yearly':
-                next_date += relativedelta(years=1)
-            else:
-                break  # Should not happen
-
-            # Stop if the next date is in the future or after the end date.
-            # Use LOCAL date to match start_date/due_time above; comparing against
-            # the UTC date would generate an extra "tomorrow" instance when the
-            # view runs near UTC midnight (TIME_ZONE is UTC-6).
-            hoy_local = timezone.localtime(timezone.now()).date()
-            if next_date > hoy_local or (parent_task.recurrence_end_date and next_date > parent_task.recurrence_end_date):
-                break
-
-            # Combine date and time to get the final due datetime.
-            # This requires making the naive datetime object timezone-aware.
-            from datetime import datetime
-            naive_datetime = datetime.combine(next_date, due_time)
-            due_datetime = timezone.make_aware(naive_datetime)
-
-            # Idempotency check: only create the task if one for that day doesn't exist.
-            if not Task.objects.filter(parent_task=parent_task, due_date__date=due_datetime.date()).exists():
-                Task.objects.create(
-                    parent_task=parent_task,
-                    list=parent_task.list,
-                    assigned_to=parent_task.assigned_to,
-                    created_by=parent_task.created_by,
-                    kpi=parent_task.kpi,
-                    title=f"{parent_task.title} - {next_date.strftime('%Y-%m-%d')}",
-                    description=parent_task.description,
-                    order=parent_task.order,
-                    due_date=due_datetime,
-                    is_recurring=False
-                )
-
     def create(self, request, *args, **kwargs):
         """
         Overrides the create method to handle recurring tasks.
@@ -200,26 +147,37 @@ class TaskViewSet(viewsets.ModelViewSet):
             with transaction.atomic():
                 # 1. Create the parent "template" task
                 parent_task = serializer.save(created_by=request.user)
-                # 2. Generate the first visible task instance
-                if parent_task.due_date and parent_task.recurrence_end_date and parent_task.due_date.date() <= parent_task.recurrence_end_date:
-                    Task.objects.create(
-                        parent_task=parent_task,
-                        list=parent_task.list,
-                        assigned_to=parent_task.assigned_to,
-                        created_by=request.user,
-                        kpi=parent_task.kpi,
-                        title=f"{parent_task.title} - {parent_task.due_date.strftime('%Y-%m-%d')}",
-                        description=parent_task.description,
-                        order=parent_task.order,
-                        due_date=parent_task.due_date,
-                        is_recurring=False  # Child tasks are not recurring themselves
-                    )
+                # 2. Generate the first visible task instance (recurrence engine)
+                crear_primera_instancia(parent_task)
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Board delta sync: tasks, checklists and comments changed since the
+        `since` cursor, plus the ids deleted meanwhile (cambios_tablero.py).
+        Without `since` it returns every visible task and starts a cursor.
+        """
+        since = request.query_params.get('since')
+        try:
+            desde = cambios_tablero.leer_cursor(since) if since else None
+        except (ValueError, OverflowError, OSError):
+            return Response({'error': 'Invalid since cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        employee_id = request.query_params.get('employee_id')
+        if user.is_superuser:
+            employee_ids = [employee_id] if employee_id else None
+        elif hasattr(user, 'employee'):
+            employee_ids = [user.employee.pk]
+        else:
+            employee_ids = []
+        return Response(cambios_tablero.cambios(self.get_queryset(), employee_ids, desde))
+
     @action(detail=True, methods=['post'])
     def move(self, request, pk=None):
         """Move a task to a new list and/or new order."""
@@ -278,16 +236,11 @@ class TaskViewSet(viewsets.ModelViewSet):
             if hecho_list:
                 task.list = hecho_list
 
+            # The save signals refresh the month summary and invalidate the
+            # employee's cached salary; performance records are only
+            # committed by the month close.
             task.save()
 
-            # Recalculate bonus for the affected employee
-            try:
-                employee = task.assigned_to
-                today = timezone.now().date()
-                employee.calculate_performance_bonus(today.year, today.month)
-            except Employee.DoesNotExist:
-                pass
-
         return Response({'status': 'task marked as complete', 'task': self.get_serializer(task).data})
 
     @action(detail=True, methods=['post'])
@@ -313,16 +266,9 @@ class TaskViewSet(viewsets.ModelViewSet):
             # but we should still save the status change.
             pass
 
+        # Summary and salary cache are refreshed by the save signals
         task.save()
 
-        # Recalculate bonus for the affected employee
-        try:
-            employee = task.assigned_to
-            today = timezone.now().date()
-            employee.calculate_performance_bonus(today.year, today.month)
-        except Employee.DoesNotExist:
-            pass
-
         return Response({'status': 'task marked as unfulfilled'})
 
 @api_view(['GET'])
@@ -360,6 +306,94 @@ def kpi_history_api(request, employee_id):
 
     return Response(kpi_data)
 
+WHAT_IF_FIELDS = ('performance_bonus', 'commission_amount', 'total_salary')
+
+
+def _parse_overrides(raw, field):
+    """{int: Decimal} from a JSON object of id -> number; raises ValueError."""
+    if raw in (None, ''):
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError(f"'{field}' must be an object of id -> value")
+    parsed = {}
+    for key, value in raw.items():
+        try:
+            parsed[int(key)] = Decimal(str(value))
+        except (InvalidOperation, ValueError, TypeError):
+            raise ValueError(f"Invalid value in '{field}': {key!r} -> {value!r}")
+    return parsed
+
+
+@api_view(['POST'])
+def payroll_what_if_api(request):
+    """
+    Simulates the whole company's payroll for a month with alternate
+    commission percentages ({employee_id: pct}) and/or KPI targets
+    ({kpi_id: target}) and returns it next to the current rules.
+    Nothing is written: both runs are side-effect-free simulations.
+    """
+    if not request.user.is_superuser:
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+
+    from .payroll import what_if
+    data = request.data
+    today = timezone.now().date()
+    try:
+        year = int(data.get('year', today.year))
+        month = int(data.get('month', today.month))
+        if not 1 <= month <= 12:
+            raise ValueError("'month' must be between 1 and 12")
+        commission_percentages = _parse_overrides(
+            data.get('commission_percentages'), 'commission_percentages')
+        kpi_targets = _parse_overrides(data.get('kpi_targets'), 'kpi_targets')
+    except (ValueError, TypeError) as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    employees = list(Employee.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=date(year, month, 1))).order_by('name'))
+    current, scenario = what_if(year, month, commission_percentages, kpi_targets, employees)
+
+    rows = []
+    totals = {'current': Decimal('0.00'), 'scenario': Decimal('0.00')}
+    for employee in employees:
+        before, after = current[employee.pk], scenario[employee.pk]
+        if before is None:
+            continue  # no salary configured
+        totals['current'] += before['total_salary']
+        totals['scenario'] += after['total_salary']
+        rows.append({
+            'employee_id': employee.pk,
+            'name': employee.name,
+            'current': {f: str(round(before[f], 2)) for f in WHAT_IF_FIELDS},
+            'scenario': {f: str(round(after[f], 2)) for f in WHAT_IF_FIELDS},
+            'difference': str(round(after['total_salary'] - before['total_salary'], 2)),
+        })
+
+    return Response({
+        'year': year,
+        'month': month,
+        'employees': rows,
+        'totals': {
+            'current': str(round(totals['current'], 2)),
+            'scenario': str(round(totals['scenario'], 2)),
+            'difference': str(round(totals['scenario'] - totals['current'], 2)),
+        },
+    })
+
+@api_view(['GET'])
+def salary_cache_stats_api(request):
+    """Hit/miss counters of the salary breakdown cache (superuser only)."""
+    if not request.user.is_superuser:
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+    return Response(salary_cache_stats())
+
+@api_view(['GET'])
+def webhook_idempotency_stats_api(request):
+    """Hit rate of the webhook idempotency index (superuser only)."""
+    if not request.user.is_superuser:
+        return Response({"error": "Forbidden"}, status=status.HTTP_403_FORBIDDEN)
+    return Response(idempotencia_webhooks.estadisticas())
+
 class DolibarrWebhookView(APIView):
     """
     Endpoint to receive webhooks from Dolibarr.
@@ -378,46 +412,29 @@ class DolibarrWebhookView(APIView):
 
         professional_id = request.headers.get('X-Dolibarr-Professional-ID')
         signature = request.headers.get('X-Dolibarr-Signature')
+        ingest_only = getattr(settings, 'DOLIBARR_WEBHOOK_ASYNC', False)
 
-        # 2. Log reception immediately — BEFORE throttle check so no data is lost
-        log = WebhookLog.objects.create(
+        # 2. Log reception immediately — BEFORE throttle check so no data is lost.
+        # In ingest mode the log is saved once, with its final status, so the
+        # Dolibarr trigger only waits for a single INSERT.
+        log = WebhookLog(
             sender_ip=self.get_client_ip(request),
             headers=dict(request.headers),
             payload=request.data
         )
+        if not ingest_only:
+            log.save()
 
         # 3. Manual throttle check AFTER logging
-        throttle = WebhookRateThrottle()
-        if not throttle.allow_request(request, self):
-            log.status = 'throttled'
-            log.error_message = 'Rate limit exceeded (logged for retry)'
-            log.save()
-            wait = throttle.wait()
-            return Response(
-                {'error': 'Rate limit exceeded', 'retry_after': int(wait or 60)},
-                status=status.HTTP_429_TOO_MANY_REQUESTS,
-                headers={'Retry-After': str(int(wait or 60))}
-            )
+        sender, wait = self.check_rate_limit(request)
+        if wait is not None:
+            return self.throttled_response(log, sender, wait)
 
         try:
-            # 3. Authenticate Instance
-            if not professional_id or not signature:
-                raise ValueError("Missing authentication headers: X-Dolibarr-Professional-ID and X-Dolibarr-Signature required")
-
-            try:
-                instance = DolibarrInstance.objects.get(professional_id=professional_id)
-            except DolibarrInstance.DoesNotExist:
-                raise ValueError(f"Unknown Dolibarr instance: professional_id={professional_id}")
-
-            # 4. Validate HMAC-SHA256 signature
-            computed_signature = hmac.new(
-                key=instance.api_secret.encode('utf-8'),
-                msg=request.body,
-                digestmod=hashlib.sha256
-            ).hexdigest()
-
-            if not hmac.compare_digest(computed_signature, signature):
-                raise ValueError("Invalid HMAC signature")
+            # 3. Authenticate Instance and validate the HMAC-SHA256 signature:
+            # check_rate_limit already did it; re-run only to get the error
+            instance = sender or self.authenticate_instance(professional_id, signature, request.body)
+            log.instance = instance
 
             # 5. Process Event
             payload = request.data
@@ -433,20 +450,30 @@ class DolibarrWebhookView(APIView):
                     'instance': instance.name,
                     'timestamp': timezone.now().isoformat(),
                 })
-            elif event_type == 'BILL_VALIDATE':
-                self.process_bill_validate(payload, instance)
-            elif event_type == 'PROPAL_VALIDATE':
-                self.process_proforma(payload, instance)
-            elif event_type == 'ORDER_VALIDATE':
-                self.process_order(payload, instance)
-            elif event_type == 'PAYMENT_CUSTOMER_CREATE':
-                self.process_payment(payload, instance)
-            elif event_type == 'PRODUCT_CREATE':
-                self.process_product_creation(payload, instance)
-            else:
-                logger.warning("Unknown trigger_code received: %s from instance %s", event_type, instance.name)
+
+            # Exact redelivery of an event already applied: acknowledge it
+            # without touching the sales tables.
+            if idempotencia_webhooks.ya_vistos(instance, [payload]):
+                log.status = 'processed'
+                log.processed_at = timezone.now()
+                log.error_message = 'Duplicate event ignored (already applied)'
+                log.save()
+                return Response({'status': 'already_processed'}, status=status.HTTP_200_OK)
+
+            if ingest_only:
+                # Signature verified: queue it for `procesar_webhooks`
+                log.status = 'queued'
+                log.save()
+                return Response({'status': 'queued', 'log_id': log.pk},
+                                status=status.HTTP_202_ACCEPTED)
+
+            # The sale and its monthly summary (commission ledger) commit together
+            with transaction.atomic():
+                if self.handle_event(payload, instance):
+                    idempotencia_webhooks.registrar(instance, [payload])
 
             log.status = 'processed'
+            log.processed_at = timezone.now()
             log.save()
             return Response({'status': 'ok'})
 
@@ -471,6 +498,81 @@ class DolibarrWebhookView(APIView):
             logger.exception("Unexpected error processing webhook")
             return Response({'error': 'Internal processing error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def check_rate_limit(self, request):
+        """Return (instance, wait): wait is None if the request may go on.
+
+        Signed requests spend a token from their instance's bucket, shared
+        by all workers; anything else (missing or bad signature) falls back
+        to the per-IP WebhookRateThrottle."""
+        try:
+            instance = self.authenticate_instance(
+                request.headers.get('X-Dolibarr-Professional-ID'),
+                request.headers.get('X-Dolibarr-Signature'),
+                request.body,
+            )
+        except ValueError:
+            throttle = WebhookRateThrottle()
+            if throttle.allow_request(request, self):
+                return None, None
+            return None, throttle.wait() or 60
+        allowed, wait = limite_webhooks.consumir(instance.pk)
+        return instance, None if allowed else wait
+
+    def throttled_response(self, log, instance, wait):
+        """Save `log` as 'throttled' and answer 429 with the sender's queue
+        depth for backpressure. A verified log keeps its instance, so
+        `replay_webhooks` can requeue it without trusting the stored headers."""
+        log.instance = instance
+        log.status = 'throttled'
+        log.error_message = 'Rate limit exceeded (logged for retry)'
+        log.save()
+        retry_after = max(1, math.ceil(wait))
+        return Response(
+            {'error': 'Rate limit exceeded', 'retry_after': retry_after,
+             'queue_depth': limite_webhooks.profundidad_cola(instance)},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(retry_after)}
+        )
+
+    @staticmethod
+    def authenticate_instance(professional_id, signature, body):
+        """Return the DolibarrInstance whose secret signed `body`; raises
+        ValueError otherwise."""
+        if not professional_id or not signature:
+            raise ValueError("Missing authentication headers: X-Dolibarr-Professional-ID and X-Dolibarr-Signature required")
+
+        instance, hmac_base = identidades.instance_for(professional_id)
+        if instance is None:
+            raise ValueError(f"Unknown Dolibarr instance: professional_id={professional_id}")
+
+        computed_signature = identidades.signature_for(hmac_base, body)
+
+        if not hmac.compare_digest(computed_signature, signature):
+            raise ValueError("Invalid HMAC signature")
+        return instance
+
+    def handle_event(self, payload, instance):
+        """Apply one verified event. Shared by the synchronous path and the
+        `procesar_webhooks` worker.
+
+        Returns True if the event wrote something. Events skipped without a
+        write (unmapped employee, rejected invoice, unknown payment...) must
+        not enter the idempotency index: a redelivery, e.g. after the admin
+        maps the employee, has to be applied."""
+        event_type = payload.get('trigger_code')
+        if event_type == 'BILL_VALIDATE':
+            return self.process_bill_validate(payload, instance)
+        elif event_type == 'PROPAL_VALIDATE':
+            return self.process_proforma(payload, instance)
+        elif event_type == 'ORDER_VALIDATE':
+            return self.process_order(payload, instance)
+        elif event_type == 'PAYMENT_CUSTOMER_CREATE':
+            return self.process_payment(payload, instance)
+        elif event_type == 'PRODUCT_CREATE':
+            return self.process_product_creation(payload, instance)
+        logger.warning("Unknown trigger_code received: %s from instance %s", event_type, instance.name)
+        return False
+
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
@@ -481,19 +583,69 @@ class DolibarrWebhookView(APIView):
 
     def _resolve_employee(self, instance, dolibarr_user_id):
         """Resolve a Dolibarr user ID to a local Employee. Returns None if not mapped."""
-        try:
-            identity = DolibarrUserIdentity.objects.get(
-                dolibarr_instance=instance,
-                dolibarr_user_id=dolibarr_user_id
-            )
-            return identity.employee
-        except DolibarrUserIdentity.DoesNotExist:
+        employee = self._find_employee(instance, dolibarr_user_id)
+        if employee is None:
             logger.warning(
                 "Employee not mapped for dolibarr_user_id=%s in instance '%s'. "
                 "Admin should create a DolibarrUserIdentity mapping.",
                 dolibarr_user_id, instance.name
             )
-            return None
+        return employee
+
+    # Storage hooks used by the process_* handlers. They hit the database
+    # (identities through the per-process cache in identidades.py);
+    # WebhookBatchProcessor overrides them to work on preloaded
+    # rows and write everything in bulk at the end of the batch.
+
+    def _find_employee(self, instance, dolibarr_user_id):
+        return identidades.employee_for(instance, dolibarr_user_id)
+
+    def _find_sale(self, instance, dolibarr_id, status):
+        return SalesRecord.objects.filter(
+            dolibarr_instance=instance,
+            dolibarr_id=dolibarr_id,
+            status=status,
+        ).first()
+
+    def _save_sale(self, instance, dolibarr_id, status, defaults):
+        return SalesRecord.objects.update_or_create(
+            dolibarr_instance=instance,
+            dolibarr_id=dolibarr_id,
+            status=status,
+            defaults=defaults,
+        )
+
+    def _sku_seen(self, instance, product_ref, event_date):
+        return ProductCreationLog.objects.filter(
+            dolibarr_instance=instance,
+            product_ref=product_ref,
+            created_at__year=event_date.year,
+            created_at__month=event_date.month,
+        ).exists()
+
+    def _log_product(self, **fields):
+        return ProductCreationLog.objects.create(**fields)
+
+    def _mark_paid(self, instance, invoice_ids, payment_date):
+        """Set payment_date on the unpaid invoices; returns how many."""
+        updated = 0
+        keys = set()
+        for validated_id in invoice_ids:
+            unpaid = SalesRecord.objects.filter(
+                dolibarr_instance=instance,
+                dolibarr_id=validated_id,
+                status='invoiced',
+                payment_date__isnull=True,
+            )
+            # .update() does not fire signals: refresh the monthly summaries
+            # of the invoice month and the payment month explicitly.
+            for employee_id, invoice_date in unpaid.values_list('employee_id', 'date'):
+                keys.add((employee_id, invoice_date.year, invoice_date.month))
+                keys.add((employee_id, payment_date.year, payment_date.month))
+            updated += unpaid.update(payment_date=payment_date)
+        refresh_summaries(keys)
+        invalidate_salary_cache(*(key[0] for key in keys))
+        return updated
 
     @staticmethod
     def _parse_event_date(obj):
@@ -552,13 +704,13 @@ class DolibarrWebhookView(APIView):
         # Validate inputs
         dolibarr_id = self._validate_int(obj.get('id'), 'dolibarr_id')
         if not dolibarr_id:
-            return
+            return False
         dolibarr_user_id = self._validate_int(obj.get('fk_user_author'), 'fk_user_author')
         if not dolibarr_user_id:
-            return
+            return False
         amount = self._validate_amount(obj.get('total_ht', 0), 'total_ht')
         if amount is None:
-            return
+            return False
 
         event_date = self._parse_event_date(obj)
         bill_type = self._validate_int(obj.get('type', 0), 'type', allow_zero=True) or 0
@@ -573,34 +725,24 @@ class DolibarrWebhookView(APIView):
             original_invoice = None
 
             if fk_facture_source:
-                original_invoice = SalesRecord.objects.filter(
-                    dolibarr_instance=instance,
-                    dolibarr_id=fk_facture_source,
-                    status='invoiced',
-                ).first()
+                original_invoice = self._find_sale(instance, fk_facture_source, 'invoiced')
             if not original_invoice and origin_proforma_id:
-                original_invoice = SalesRecord.objects.filter(
-                    dolibarr_instance=instance,
-                    dolibarr_id=origin_proforma_id,
-                    status='invoiced',
-                ).first()
+                original_invoice = self._find_sale(instance, origin_proforma_id, 'invoiced')
 
             if original_invoice:
                 target_employee = original_invoice.employee
             else:
                 target_employee = self._resolve_employee(instance, dolibarr_user_id)
                 if not target_employee:
-                    return
+                    return False
                 logger.warning(
                     "Credit note %s: could not find original invoice, "
                     "attributing to issuer %s", dolibarr_ref, target_employee.name
                 )
 
             # Credit notes must be negative
-            record, created = SalesRecord.objects.update_or_create(
-                dolibarr_instance=instance,
-                dolibarr_id=dolibarr_id,
-                status='credit_note',
+            record, created = self._save_sale(
+                instance, dolibarr_id, 'credit_note',
                 defaults={
                     'employee': target_employee,
                     'dolibarr_ref': dolibarr_ref,
@@ -618,41 +760,33 @@ class DolibarrWebhookView(APIView):
             # --- REGULAR INVOICE ---
             employee = self._resolve_employee(instance, dolibarr_user_id)
             if not employee:
-                return
+                return False
 
             # Invoice must have originated from a proforma or order by the same employee
             origin_validated = False
 
             # Check proforma ownership
             if origin_proforma_id:
-                proforma_record = SalesRecord.objects.filter(
-                    dolibarr_instance=instance,
-                    dolibarr_id=origin_proforma_id,
-                    status='proforma',
-                ).first()
+                proforma_record = self._find_sale(instance, origin_proforma_id, 'proforma')
                 if proforma_record:
                     if proforma_record.employee_id != employee.pk:
                         logger.warning(
                             "Invoice %s by %s rejected: proforma belongs to %s",
                             dolibarr_ref, employee.name, proforma_record.employee.name
                         )
-                        return
+                        return False
                     origin_validated = True
 
             # Check order ownership (Pedido → Factura flow)
             if not origin_validated and origin_order_id:
-                order_record = SalesRecord.objects.filter(
-                    dolibarr_instance=instance,
-                    dolibarr_id=origin_order_id,
-                    status='order',
-                ).first()
+                order_record = self._find_sale(instance, origin_order_id, 'order')
                 if order_record:
                     if order_record.employee_id != employee.pk:
                         logger.warning(
                             "Invoice %s by %s rejected: order belongs to %s",
                             dolibarr_ref, employee.name, order_record.employee.name
                         )
-                        return
+                        return False
                     origin_validated = True
 
             # Reject invoices without proforma or order (not a valid workflow)
@@ -662,19 +796,17 @@ class DolibarrWebhookView(APIView):
                     "Direct invoices are not allowed.",
                     dolibarr_ref, employee.name
                 )
-                return
+                return False
 
             # Invoice amount must be positive
             if amount < 0:
                 logger.warning(
                     "Invoice %s rejected: negative amount %s", dolibarr_ref, amount
                 )
-                return
+                return False
 
-            record, created = SalesRecord.objects.update_or_create(
-                dolibarr_instance=instance,
-                dolibarr_id=dolibarr_id,
-                status='invoiced',
+            record, created = self._save_sale(
+                instance, dolibarr_id, 'invoiced',
                 defaults={
                     'employee': employee,
                     'dolibarr_ref': dolibarr_ref,
@@ -689,6 +821,7 @@ class DolibarrWebhookView(APIView):
                     "Invoice re-validated: dolibarr_id=%s ref=%s amount=%s",
                     dolibarr_id, dolibarr_ref, amount,
                 )
+        return True
 
     def process_proforma(self, payload, instance):
         """Process PROPAL_VALIDATE events."""
@@ -696,20 +829,18 @@ class DolibarrWebhookView(APIView):
         dolibarr_id = self._validate_int(obj.get('id'), 'dolibarr_id')
         dolibarr_user_id = self._validate_int(obj.get('fk_user_author'), 'fk_user_author')
         if not dolibarr_id or not dolibarr_user_id:
-            return
+            return False
 
         employee = self._resolve_employee(instance, dolibarr_user_id)
         if not employee:
-            return
+            return False
 
         amount = self._validate_amount(obj.get('total_ht', 0), 'total_ht')
         if amount is None:
-            return
+            return False
 
-        record, created = SalesRecord.objects.update_or_create(
-            dolibarr_instance=instance,
-            dolibarr_id=dolibarr_id,
-            status='proforma',
+        record, created = self._save_sale(
+            instance, dolibarr_id, 'proforma',
             defaults={
                 'employee': employee,
                 'dolibarr_ref': str(obj.get('ref', ''))[:100],
@@ -722,6 +853,7 @@ class DolibarrWebhookView(APIView):
                 "Proforma re-validated: dolibarr_id=%s ref=%s amount=%s",
                 dolibarr_id, record.dolibarr_ref, amount,
             )
+        return True
 
     def process_order(self, payload, instance):
         """Process ORDER_VALIDATE events (pedido validated)."""
@@ -729,36 +861,30 @@ class DolibarrWebhookView(APIView):
         dolibarr_id = self._validate_int(obj.get('id'), 'dolibarr_id')
         dolibarr_user_id = self._validate_int(obj.get('fk_user_author'), 'fk_user_author')
         if not dolibarr_id or not dolibarr_user_id:
-            return
+            return False
 
         employee = self._resolve_employee(instance, dolibarr_user_id)
         if not employee:
-            return
+            return False
 
         amount = self._validate_amount(obj.get('total_ht', 0), 'total_ht')
         if amount is None:
-            return
+            return False
 
         origin_proforma_id = self._validate_int(obj.get('fk_propal'), 'fk_propal')
 
         # Same-user validation: if order has a proforma, must be same employee
         if origin_proforma_id:
-            proforma_record = SalesRecord.objects.filter(
-                dolibarr_instance=instance,
-                dolibarr_id=origin_proforma_id,
-                status='proforma',
-            ).first()
+            proforma_record = self._find_sale(instance, origin_proforma_id, 'proforma')
             if proforma_record and proforma_record.employee_id != employee.pk:
                 logger.warning(
                     "Order %s by %s rejected: proforma belongs to %s",
                     obj.get('ref'), employee.name, proforma_record.employee.name
                 )
-                return
+                return False
 
-        record, created = SalesRecord.objects.update_or_create(
-            dolibarr_instance=instance,
-            dolibarr_id=dolibarr_id,
-            status='order',
+        record, created = self._save_sale(
+            instance, dolibarr_id, 'order',
             defaults={
                 'employee': employee,
                 'dolibarr_ref': str(obj.get('ref', ''))[:100],
@@ -772,6 +898,7 @@ class DolibarrWebhookView(APIView):
                 "Order re-validated: dolibarr_id=%s ref=%s amount=%s",
                 dolibarr_id, record.dolibarr_ref, amount,
             )
+        return True
 
     def process_product_creation(self, payload, instance):
         """
@@ -782,16 +909,16 @@ class DolibarrWebhookView(APIView):
         dolibarr_user_id = self._validate_int(obj.get('fk_user_author'), 'fk_user_author')
         dolibarr_product_id = self._validate_int(obj.get('id'), 'dolibarr_product_id')
         if not dolibarr_user_id or not dolibarr_product_id:
-            return
+            return False
 
         employee = self._resolve_employee(instance, dolibarr_user_id)
         if not employee:
-            return
+            return False
 
         product_ref = str(obj.get('ref', '')).strip()[:255]
         if not product_ref:
             logger.warning("Product creation rejected: empty product_ref")
-            return
+            return False
 
         # Use Dolibarr event date, not Django receipt time (avoids month-boundary errors)
         event_date = self._parse_event_date(obj)
@@ -800,14 +927,9 @@ class DolibarrWebhookView(APIView):
         )
 
         # Anti-fraud: check for same SKU created this month in this instance
-        duplicate_sku = ProductCreationLog.objects.filter(
-            dolibarr_instance=instance,
-            product_ref=product_ref,
-            created_at__year=event_date.year,
-            created_at__month=event_date.month,
-        ).exists()
+        duplicate_sku = self._sku_seen(instance, product_ref, event_date)
 
-        log_entry = ProductCreationLog.objects.create(
+        self._log_product(
             employee=employee,
             dolibarr_instance=instance,
             dolibarr_product_id=dolibarr_product_id,
@@ -819,9 +941,10 @@ class DolibarrWebhookView(APIView):
         if duplicate_sku:
             logger.warning(
                 "Suspect duplicate product creation: SKU '%s' already exists this month "
-                "in instance '%s'. Log ID: %s",
-                product_ref, instance.name, log_entry.pk
+                "in instance '%s'. Dolibarr product ID: %s",
+                product_ref, instance.name, dolibarr_product_id
             )
+        return True
 
     def process_payment(self, payload, instance):
         """
@@ -834,7 +957,7 @@ class DolibarrWebhookView(APIView):
 
         if not isinstance(invoice_ids, list):
             logger.warning("invoice_ids is not a list: %s", type(invoice_ids))
-            return
+            return False
 
         today = timezone.now().date()
         payment_date = today
@@ -850,20 +973,265 @@ class DolibarrWebhookView(APIView):
             except (ValueError, TypeError):
                 pass  # keep today as default
 
-        updated = 0
-        for inv_id in invoice_ids:
-            validated_id = self._validate_int(inv_id, 'invoice_id')
-            if not validated_id:
-                continue
-            count = SalesRecord.objects.filter(
-                dolibarr_instance=instance,
-                dolibarr_id=validated_id,
-                status='invoiced',
-                payment_date__isnull=True,
-            ).update(payment_date=payment_date)
-            updated += count
+        validated_ids = [
+            validated_id for validated_id in
+            (self._validate_int(inv_id, 'invoice_id') for inv_id in invoice_ids)
+            if validated_id
+        ]
+        updated = self._mark_paid(instance, validated_ids, payment_date)
 
         logger.info(
             "Payment processed: %d invoice(s) marked as paid in instance '%s'",
             updated, instance.name
         )
+        return updated > 0
+
+
+WEBHOOK_BATCH_MAX_EVENTS = 1000
+
+
+class WebhookBatchProcessor(DolibarrWebhookView):
+    """
+    Runs the process_* handlers over a batch of events of one instance
+    without a query per event: identities, the SalesRecords the events
+    touch or reference and the relevant ProductCreationLogs are loaded up
+    front, the handlers read and write that in-memory state (so an event can
+    depend on an earlier one in the same batch), and flush() writes the
+    result with bulk upserts.
+    """
+    SALE_FIELDS = ['employee', 'dolibarr_ref', 'origin_proforma_id', 'origin_order_id',
+                   'amount_untaxed', 'date', 'payment_date']
+
+    def __init__(self, instance, events, **kwargs):
+        super().__init__(**kwargs)
+        self.instance = instance
+        self._dirty = {}            # (dolibarr_id, status) -> updated fields
+        self._before = {}           # (dolibarr_id, status) -> summary keys as stored
+        self._paid = defaultdict(set)  # payment_date -> invoice dolibarr_ids
+        self._products = []
+
+        sale_ids, product_ids, product_refs = set(), set(), set()
+        for event in events:
+            obj = event.get('object') if isinstance(event, dict) else None
+            if not isinstance(obj, dict):
+                continue
+            refs = [obj.get(f) for f in ('id', 'fk_propal', 'fk_commande', 'fk_facture_source')]
+            if isinstance(obj.get('invoice_ids'), list):
+                refs.extend(obj['invoice_ids'])
+            sale_ids.update(self._quiet_ints(refs))
+            if event.get('trigger_code') == 'PRODUCT_CREATE':
+                product_ids.update(self._quiet_ints([obj.get('id')]))
+                product_refs.add(str(obj.get('ref', '')).strip()[:255])
+
+        self.employees = {
+            identity.dolibarr_user_id: identity.employee
+            for identity in DolibarrUserIdentity.objects.filter(
+                dolibarr_instance=instance).select_related('employee')
+        }
+        self.sales = {
+            (record.dolibarr_id, record.status): record
+            for record in SalesRecord.objects.filter(
+                dolibarr_instance=instance, dolibarr_id__in=sale_ids).select_related('employee')
+        }
+        self.product_ids = set()
+        self.skus = set()
+        if product_ids or product_refs:
+            for product_id, ref, created_at in ProductCreationLog.objects.filter(
+                    Q(dolibarr_product_id__in=product_ids) | Q(product_ref__in=product_refs),
+                    dolibarr_instance=instance,
+            ).values_list('dolibarr_product_id', 'product_ref', 'created_at'):
+                self.product_ids.add(product_id)
+                created_at = timezone.localtime(created_at)
+                self.skus.add((ref, created_at.year, created_at.month))
+
+    @staticmethod
+    def _quiet_ints(values):
+        ints = set()
+        for value in values:
+            try:
+                ints.add(int(value))
+            except (TypeError, ValueError):
+                pass
+        return ints
+
+    def _find_employee(self, instance, dolibarr_user_id):
+        return self.employees.get(dolibarr_user_id)
+
+    def _find_sale(self, instance, dolibarr_id, status):
+        return self.sales.get((dolibarr_id, status))
+
+    def _touch(self, key, fields):
+        """Mark a sale for the flush, remembering the months it fed before
+        this batch changed it."""
+        record = self.sales[key]
+        if key not in self._before:
+            self._before[key] = summary_keys(record) if record.pk else set()
+        self._dirty.setdefault(key, set()).update(fields)
+
+    def _save_sale(self, instance, dolibarr_id, status, defaults):
+        key = (dolibarr_id, status)
+        record = self.sales.get(key)
+        created = record is None
+        if created:
+            record = self.sales[key] = SalesRecord(
+                dolibarr_instance=instance, dolibarr_id=dolibarr_id, status=status)
+        self._touch(key, defaults)
+        for field, value in defaults.items():
+            setattr(record, field, value)
+        return record, created
+
+    def _sku_seen(self, instance, product_ref, event_date):
+        return (product_ref, event_date.year, event_date.month) in self.skus
+
+    def _log_product(self, **fields):
+        if fields['dolibarr_product_id'] in self.product_ids:
+            raise IntegrityError(
+                f"ProductCreationLog already exists for dolibarr_product_id={fields['dolibarr_product_id']}")
+        entry = ProductCreationLog(**fields)
+        created_at = timezone.localtime(entry.created_at)
+        self.product_ids.add(entry.dolibarr_product_id)
+        self.skus.add((entry.product_ref, created_at.year, created_at.month))
+        self._products.append(entry)
+        return entry
+
+    def _mark_paid(self, instance, invoice_ids, payment_date):
+        updated = 0
+        for dolibarr_id in invoice_ids:
+            key = (dolibarr_id, 'invoiced')
+            record = self.sales.get(key)
+            if record is None or record.payment_date is not None:
+                continue
+            self._touch(key, ())
+            record.payment_date = payment_date
+            self._paid[payment_date].add(dolibarr_id)
+            updated += 1
+        return updated
+
+    def flush(self):
+        """Write the batch: one upsert per set of updated fields, one UPDATE
+        per payment date, one INSERT of product logs; then refresh the
+        monthly summaries and salary cache the signals would have."""
+        groups = defaultdict(list)
+        keys, employee_ids = set(), set()
+        for (dolibarr_id, estado), fields in self._dirty.items():
+            record = self.sales[(dolibarr_id, estado)]
+            keys |= summary_keys(record) | self._before[(dolibarr_id, estado)]
+            if not fields:
+                continue  # only paid: handled by the UPDATE below
+            groups[tuple(sorted(fields))].append(SalesRecord(
+                dolibarr_instance=self.instance, dolibarr_id=dolibarr_id, status=estado,
+                **{field: getattr(record, field) for field in self.SALE_FIELDS}))
+        for fields, records in groups.items():
+            SalesRecord.objects.bulk_create(
+                records, update_conflicts=True,
+                unique_fields=['dolibarr_instance', 'dolibarr_id', 'status'],
+                update_fields=list(fields),
+            )
+        for payment_date, dolibarr_ids in self._paid.items():
+            SalesRecord.objects.filter(
+                dolibarr_instance=self.instance, dolibarr_id__in=dolibarr_ids,
+                status='invoiced', payment_date__isnull=True,
+            ).update(payment_date=payment_date)
+        ProductCreationLog.objects.bulk_create(self._products)
+        for entry in self._products:
+            keys |= summary_keys(entry)
+
+        refresh_summaries(keys)
+        employee_ids.update(key[0] for key in keys)
+        invalidate_salary_cache(*employee_ids)
+
+
+class DolibarrWebhookBatchView(DolibarrWebhookView):
+    """
+    Signed batch endpoint for Dolibarr's retry queue: one request carries
+    {"events": [{"event_id": ..., "trigger_code": ..., "object": {...}}, ...]}
+    signed as a whole with the same headers as the single-event webhook.
+
+    The batch counts once against the webhook throttle and is applied in a
+    single transaction with bulk upserts (WebhookBatchProcessor). Events are
+    applied in order and each gets its own result, so the sender can drop
+    the acknowledged rows ('processed' / 'already_processed') and keep the
+    'error' ones. Always synchronous, also with DOLIBARR_WEBHOOK_ASYNC: the
+    sender is a background queue, not a user waiting.
+    """
+
+    def post(self, request):
+        log = WebhookLog.objects.create(
+            sender_ip=self.get_client_ip(request),
+            headers=dict(request.headers),
+            payload=request.data
+        )
+
+        sender, wait = self.check_rate_limit(request)
+        if wait is not None:
+            return self.throttled_response(log, sender, wait)
+
+        try:
+            # Authenticated by check_rate_limit; re-run only to get the error
+            instance = sender or self.authenticate_instance(
+                request.headers.get('X-Dolibarr-Professional-ID'),
+                request.headers.get('X-Dolibarr-Signature'),
+                request.body,
+            )
+            log.instance = instance
+            events = request.data.get('events') if isinstance(request.data, dict) else None
+            if not isinstance(events, list):
+                raise ValueError("'events' must be a list")
+            if len(events) > WEBHOOK_BATCH_MAX_EVENTS:
+                raise ValueError(f"Too many events: {len(events)} (max {WEBHOOK_BATCH_MAX_EVENTS})")
+
+            with transaction.atomic():
+                results = self.process_batch(instance, events)
+        except ValueError as e:
+            log.status = 'error'
+            log.error_message = str(e)
+            log.save()
+            logger.warning("Webhook batch validation error: %s", e)
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            log.status = 'error'
+            log.error_message = str(e)
+            log.save()
+            logger.exception("Unexpected error processing webhook batch")
+            return Response({'error': 'Internal processing error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        failed = [r for r in results if r['status'] == 'error']
+        log.status = 'processed'
+        log.processed_at = timezone.now()
+        log.error_message = '; '.join(
+            f"event {r['event_id'] if r['event_id'] is not None else r['index']}: {r['error']}"
+            for r in failed)
+        log.save()
+        logger.info("Webhook batch from '%s': %d event(s), %d with errors",
+                    instance.name, len(results), len(failed))
+        return Response({'status': 'ok', 'results': results})
+
+    def process_batch(self, instance, events):
+        seen = idempotencia_webhooks.ya_vistos(instance, events)
+        processor = WebhookBatchProcessor(instance, events)
+        results, applied = [], []
+        for index, event in enumerate(events):
+            result = {'index': index,
+                      'event_id': event.get('event_id') if isinstance(event, dict) else None,
+                      'status': 'processed'}
+            if index in seen:
+                result['status'] = 'already_processed'
+                results.append(result)
+                continue
+            try:
+                if not isinstance(event, dict):
+                    raise ValueError("Event must be an object")
+                if (event.get('trigger_code') != 'TEST_CONNECTION'
+                        and processor.handle_event(event, instance)):
+                    applied.append(event)
+            except ValueError as e:
+                result.update(status='error', error=str(e))
+            except IntegrityError:
+                result['status'] = 'already_processed'
+            except Exception:
+                logger.exception("Unexpected error processing batch event %s", result['event_id'])
+                result.update(status='error', error='Internal processing error')
+            results.append(result)
+        processor.flush()
+        idempotencia_webhooks.registrar(instance, applied)
+        return results
@@ -0,0 +1,139 @@
+"""
+Retención de WebhookLog: la tabla guarda solo los webhooks recientes.
+
+- Compactar: a los 'processed' con más de WEBHOOK_LOG_COMPACTAR_DIAS se les
+  vacían los headers (firma, user agent...). La instancia y el evento siguen
+  en las columnas professional_id y trigger_code.
+- Archivar: los que tienen más de WEBHOOK_LOG_RETENCION_DIAS y no están
+  pendientes en la cola se escriben en archivos JSONL comprimidos con gzip
+  dentro de WEBHOOK_ARCHIVE_DIR y se borran de la tabla. Cada archivo queda
+  registrado en WebhookArchive (rango de ids y fechas, instancias y eventos)
+  para encontrarlo después con `buscar_archivados`.
+
+El archivo se escribe primero como .tmp y se renombra dentro de la misma
+transacción que crea su WebhookArchive y borra los logs: si algo falla, los
+logs siguen en la tabla y el .tmp se descarta.
+"""
+import gzip
+import json
+import os
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cola_webhooks import ESTADOS_PENDIENTES
+from .models import WebhookArchive, WebhookLog
+
+TAM_ARCHIVO = 5000
+CAMPOS = (
+    'id', 'received_at', 'sender_ip', 'status', 'error_message', 'instance_id',
+    'professional_id', 'trigger_code', 'attempts', 'next_attempt_at', 'processed_at',
+    'payload', 'headers',
+)
+
+
+def _directorio():
+    return Path(settings.WEBHOOK_ARCHIVE_DIR)
+
+
+def compactar(dias=None):
+    """Vacía los headers de los logs procesados hace más de `dias` días.
+    Devuelve cuántos logs cambió."""
+    if dias is None:
+        dias = settings.WEBHOOK_LOG_COMPACTAR_DIAS
+    limite = timezone.now() - timedelta(days=dias)
+    return WebhookLog.objects.filter(
+        status='processed', received_at__lt=limite,
+    ).exclude(headers={}).update(headers={})
+
+
+def _escribir(filas, directorio):
+    primero, ultimo = filas[0], filas[-1]
+    nombre = f"webhooks-{primero['received_at']:%Y%m%d}-{primero['id']}.jsonl.gz"
+    destino = directorio / nombre
+    temporal = directorio / (nombre + '.tmp')
+    with gzip.open(temporal, 'wt', encoding='utf-8') as salida:
+        for fila in filas:
+            salida.write(json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False))
+            salida.write('\n')
+    try:
+        with transaction.atomic():
+            WebhookArchive.objects.create(
+                archivo=nombre, primer_id=primero['id'], ultimo_id=ultimo['id'],
+                desde=min(f['received_at'] for f in filas),
+                hasta=max(f['received_at'] for f in filas),
+                cantidad=len(filas), bytes=temporal.stat().st_size,
+                professional_ids=sorted({f['professional_id'] for f in filas} - {''}),
+                trigger_codes=dict(Counter(f['trigger_code'] for f in filas)),
+            )
+            WebhookLog.objects.filter(pk__in=[f['id'] for f in filas]).delete()
+            os.replace(temporal, destino)
+    finally:
+        if temporal.exists():
+            temporal.unlink()
+
+
+def archivar(dias=None, tam_archivo=TAM_ARCHIVO):
+    """Mueve a archivos los logs recibidos hace más de `dias` días (salvo
+    los pendientes de la cola), `tam_archivo` por archivo, en orden de id.
+    Devuelve {'archivos', 'logs'}."""
+    if dias is None:
+        dias = settings.WEBHOOK_LOG_RETENCION_DIAS
+    directorio = _directorio()
+    directorio.mkdir(parents=True, exist_ok=True)
+    viejos = WebhookLog.objects.filter(
+        received_at__lt=timezone.now() - timedelta(days=dias),
+    ).exclude(status__in=ESTADOS_PENDIENTES).order_by('pk')
+
+    resultado = {'archivos': 0, 'logs': 0}
+    ultimo_id = 0
+    while True:
+        filas = list(viejos.filter(pk__gt=ultimo_id).values(*CAMPOS)[:tam_archivo])
+        if not filas:
+            return resultado
+        _escribir(filas, directorio)
+        resultado['archivos'] += 1
+        resultado['logs'] += len(filas)
+        ultimo_id = filas[-1]['id']
+
+
+def leer_archivo(archivo):
+    """Genera los logs (dicts) guardados en un WebhookArchive."""
+    with gzip.open(_directorio() / archivo.archivo, 'rt', encoding='utf-8') as entrada:
+        for linea in entrada:
+            yield json.loads(linea)
+
+
+def buscar_archivados(log_id=None, professional_id=None, trigger_code=None,
+                      desde=None, hasta=None):
+    """Logs archivados que cumplen todos los filtros dados. El índice decide
+    qué archivos abrir; `desde`/`hasta` son datetimes de received_at."""
+    archivos = WebhookArchive.objects.all()
+    if log_id is not None:
+        archivos = archivos.filter(primer_id__lte=log_id, ultimo_id__gte=log_id)
+    if desde:
+        archivos = archivos.filter(hasta__gte=desde)
+    if hasta:
+        archivos = archivos.filter(desde__lte=hasta)
+    for archivo in archivos:
+        if professional_id and professional_id not in archivo.professional_ids:
+            continue
+        if trigger_code and trigger_code not in archivo.trigger_codes:
+            continue
+        for log in leer_archivo(archivo):
+            if log_id is not None and log['id'] != log_id:
+                continue
+            if professional_id and log['professional_id'] != professional_id:
+                continue
+            if trigger_code and log['trigger_code'] != trigger_code:
+                continue
+            recibido = parse_datetime(log['received_at'])
+            if (desde and recibido < desde) or (hasta and recibido > hasta):
+                continue
+            yield log
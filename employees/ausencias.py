@@ -10,11 +10,12 @@ Se usa un servicio explícito (no signals) para mantener el control
 transaccional: o se aprueba con todos sus efectos o no se aprueba.
 """
 import logging
-from datetime import timedelta, datetime, time
+from datetime import datetime, time
 
 from django.db import transaction
 from django.utils import timezone
 
+from .calendario import business_calendar
 from .emails import send_html_mail
 from .models import WorkLog
 
@@ -37,11 +38,7 @@ def _notificar_decision(solicitud):
 
 
 def _dias_habiles_de(solicitud):
-    dia = solicitud.fecha_inicio
-    while dia <= solicitud.fecha_fin:
-        if dia.weekday() < 5:
-            yield dia
-        dia += timedelta(days=1)
+    return business_calendar().business_days(solicitud.fecha_inicio, solicitud.fecha_fin)
 
 
 def _sync_evento_calendario(solicitud):
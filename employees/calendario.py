@@ -0,0 +1,104 @@
+"""
+Calendario de días hábiles (lunes a viernes, menos los Feriado cargados).
+
+Por cada año se precalcula una sola vez la lista de días hábiles y la suma
+acumulada por día del año, así contar los días hábiles entre dos fechas es
+una resta de prefijos y enumerarlos es un slice, sin recorrer día por día.
+Lo usan el conteo de SolicitudAusencia.dias_habiles, los WorkLogs de las
+ausencias aprobadas y las horas base de la nómina con base 'daily'.
+
+El calendario vive en memoria del proceso y se reconstruye cuando cambia el
+token CacheVersion 'feriados', que signals.py renueva al guardar o borrar un
+Feriado.
+"""
+import threading
+from datetime import date, timedelta
+
+from .models import CacheVersion, Feriado
+
+VERSION_KEY = 'feriados'
+
+
+class BusinessCalendar:
+    def __init__(self, holidays=()):
+        self.holidays = frozenset(holidays)
+        self._years = {}
+        self._lock = threading.Lock()
+
+    def _year(self, year):
+        """(prefijo, días): prefijo[i] = días hábiles del año antes del día
+        ordinal i (0 = 1 de enero); días = fechas hábiles del año en orden."""
+        table = self._years.get(year)
+        if table is None:
+            first = date(year, 1, 1)
+            length = (date(year + 1, 1, 1) - first).days
+            prefix = [0] * (length + 1)
+            days = []
+            for i in range(length):
+                day = first + timedelta(days=i)
+                if day.weekday() < 5 and day not in self.holidays:
+                    days.append(day)
+                prefix[i + 1] = len(days)
+            table = (prefix, tuple(days))
+            with self._lock:
+                self._years.setdefault(year, table)
+        return table
+
+    def _hasta(self, day):
+        """Días hábiles del año de `day` anteriores a `day`."""
+        return self._year(day.year)[0][day.timetuple().tm_yday - 1]
+
+    def is_business_day(self, day):
+        prefix = self._year(day.year)[0]
+        i = day.timetuple().tm_yday
+        return prefix[i] != prefix[i - 1]
+
+    def count(self, inicio, fin):
+        """Días hábiles en [inicio, fin], ambos inclusive (0 si fin < inicio)."""
+        if fin < inicio:
+            return 0
+        fin = fin + timedelta(days=1)
+        total = -self._hasta(inicio)
+        for year in range(inicio.year, fin.year):
+            total += len(self._year(year)[1])
+        return total + self._hasta(fin)
+
+    def business_days(self, inicio, fin):
+        """Fechas hábiles en [inicio, fin], en orden."""
+        if fin < inicio:
+            return []
+        days = []
+        for year in range(inicio.year, fin.year + 1):
+            prefix, year_days = self._year(year)
+            start = self._hasta(inicio) if year == inicio.year else 0
+            end = (prefix[fin.timetuple().tm_yday] if year == fin.year
+                   else len(year_days))
+            days.extend(year_days[start:end])
+        return days
+
+    def month_count(self, year, month):
+        """Días hábiles del mes."""
+        inicio = date(year, month, 1)
+        fin = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return self.count(inicio, fin - timedelta(days=1))
+
+
+_lock = threading.Lock()
+_calendar = None
+_version = None
+
+
+def business_calendar():
+    """Calendario vigente: el del proceso si su versión coincide con la de
+    la base, o uno recién cargado."""
+    global _calendar, _version
+    version = CacheVersion.current(VERSION_KEY)
+    with _lock:
+        if _calendar is None or _version != version:
+            _calendar = BusinessCalendar(Feriado.objects.values_list('fecha', flat=True))
+            _version = version
+        return _calendar
+
+
+def invalidate():
+    CacheVersion.bump(VERSION_KEY)
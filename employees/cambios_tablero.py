@@ -0,0 +1,192 @@
+"""
+Sincronización incremental del tablero de tareas (GET /api/tasks/changes/).
+
+El tablero recargaba la página completa después de cada acción. Ahora las
+tareas, checklists, ítems y comentarios llevan `updated_at` (auto_now) y sus
+borrados dejan un TaskTombstone, así el cliente pide solo lo que cambió
+desde su cursor y recibe un cursor nuevo.
+
+El cursor es el instante del servidor al responder, en microsegundos. Se
+relee SOLAPAMIENTO hacia atrás: una transacción que guardó antes del cursor
+pero terminó después no se pierde, y recibir dos veces un mismo cambio no
+afecta (el cliente reemplaza por id). Los TaskTombstone duran
+TABLERO_BORRADOS_DIAS. Si el cursor es más viejo, la respuesta trae
+`reset` y el cliente debe recargar todo.
+
+`flujo` es la versión push (SSE, /board/<id>/events/). La base es el único
+canal que comparten los workers de gunicorn, así que cada conexión consulta
+cada TABLERO_SSE_INTERVALO segundos las tareas del tablero con updated_at
+reciente y las lápidas nuevas. Son dos consultas por índice y solo ven lo
+ya confirmado. Emite task.created, task.completed, task.updated (movidas y
+demás cambios) y task.deleted, cada una con el cursor como `id`. La conexión
+solo guarda el cursor y lo enviado dentro del solapamiento, y se corta a los
+TABLERO_SSE_SEGUNDOS, antes del timeout de un worker sync. EventSource
+reconecta solo y sigue desde Last-Event-ID.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Model, Q
+from django.utils import timezone
+
+from .models import Checklist, ChecklistItem, Comment, Employee, Task, TaskBoard, TaskList, TaskTombstone
+from .serializers import ChecklistItemSerializer, FlatTaskSerializer
+
+SOLAPAMIENTO = timedelta(seconds=2)
+TIPOS = {Task: 'task', Checklist: 'checklist', ChecklistItem: 'item', Comment: 'comment'}
+# Si el borrado viene en cascada desde uno de estos modelos, no deja lápida
+# propia (la del padre alcanza, o el tablero entero ya no existe).
+PADRES = {
+    Task: (Employee, TaskBoard, TaskList),
+    Checklist: (Task, Employee, TaskBoard, TaskList),
+    ChecklistItem: (Checklist, Task, Employee, TaskBoard, TaskList),
+    Comment: (Task, Employee, TaskBoard, TaskList),
+}
+
+
+def _sse(evento=None, datos=None, cursor=None):
+    lineas = []
+    if evento:
+        lineas.append(f'event: {evento}')
+    if cursor:
+        lineas.append(f'id: {cursor}')
+    if datos is not None:
+        lineas.append(f'data: {json.dumps(datos, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lineas) + '\n\n'
+
+
+def _retencion():
+    return timedelta(days=getattr(settings, 'TABLERO_BORRADOS_DIAS', 30))
+
+
+def cursor_actual():
+    return str(int(timezone.now().timestamp() * 1_000_000))
+
+
+def leer_cursor(texto):
+    """Cursor -> datetime aware. ValueError si no es válido."""
+    micros = int(texto)
+    if micros < 0:
+        raise ValueError(texto)
+    return datetime.fromtimestamp(micros / 1_000_000, dt_timezone.utc)
+
+
+def _modelo_origen(origin):
+    if isinstance(origin, Model):
+        return type(origin)
+    return getattr(origin, 'model', None)
+
+
+def registrar_borrado(instance, origin=None):
+    """Deja el TaskTombstone de un objeto del tablero recién borrado (post_delete)."""
+    modelo = type(instance)
+    origen = _modelo_origen(origin)
+    if origen is not modelo and origen in PADRES[modelo]:
+        return
+    if modelo is Task:
+        task_id, employee_id = instance.pk, instance.assigned_to_id
+    else:
+        filtro = ({'checklists__pk': instance.checklist_id} if modelo is ChecklistItem
+                  else {'pk': instance.task_id})
+        task_id, employee_id = Task.objects.filter(**filtro).values_list(
+            'pk', 'assigned_to_id').first() or (None, None)
+    TaskTombstone.objects.create(kind=TIPOS[modelo], object_id=instance.pk,
+                                 task_id=task_id, employee_id=employee_id)
+
+
+def purgar_borrados():
+    """Borra las lápidas más viejas que la retención. Devuelve cuántas."""
+    borradas, _ = TaskTombstone.objects.filter(deleted_at__lt=timezone.now() - _retencion()).delete()
+    return borradas
+
+
+def cambios(tareas, employee_ids, desde):
+    """Cambios del tablero desde `desde` (datetime o None = todo), con la
+    misma forma que board_document. `tareas` es el queryset visible para el
+    usuario (sin plantillas) y `employee_ids` los empleados cuyos borrados
+    ve (None = todos). Un número fijo de consultas, cambie lo que cambie."""
+    ahora = timezone.now()
+    if desde is not None and desde < ahora - _retencion():
+        return {'cursor': cursor_actual(), 'reset': True}
+
+    checklists = Checklist.objects.filter(task__in=tareas)
+    comentarios = Comment.objects.filter(task__in=tareas)
+    borrados = TaskTombstone.objects.all()
+    if employee_ids is not None:
+        borrados = borrados.filter(employee_id__in=employee_ids)
+    if desde is not None:
+        limite = desde - SOLAPAMIENTO
+        tareas = tareas.filter(updated_at__gte=limite)
+        checklists = checklists.filter(
+            Q(updated_at__gte=limite) | Q(items__updated_at__gte=limite)).distinct()
+        comentarios = comentarios.filter(updated_at__gte=limite)
+        borrados = borrados.filter(deleted_at__gte=limite)
+    else:
+        borrados = borrados.none()
+
+    eliminados = {tipo: [] for tipo in TIPOS.values()}
+    for tipo, object_id in borrados.values_list('kind', 'object_id'):
+        eliminados[tipo].append(object_id)
+    return {
+        'cursor': str(int(ahora.timestamp() * 1_000_000)),
+        'reset': False,
+        'tasks': FlatTaskSerializer(tareas.prefetch_related('checklists'), many=True).data,
+        'checklists': [
+            {'id': c.pk, 'title': c.title, 'task': c.task_id,
+             'items': ChecklistItemSerializer(c.items.all(), many=True).data}
+            for c in checklists.prefetch_related('items')
+        ],
+        'comments': list(comentarios.values('id', 'task', 'user', 'text', 'created_at', 'updated_at')),
+        'deleted': {'tasks': eliminados['task'], 'checklists': eliminados['checklist'],
+                    'items': eliminados['item'], 'comments': eliminados['comment']},
+    }
+
+
+def _tipo_de_evento(tarea, limite):
+    if tarea.created_at >= limite:
+        return 'task.created'
+    if tarea.status == 'completed' and tarea.completed_at and tarea.completed_at >= limite:
+        return 'task.completed'
+    return 'task.updated'
+
+
+def flujo(tareas, employee_ids, desde, segundos=None, intervalo=None, dormir=time.sleep):
+    """Generador de eventos SSE con los cambios de `tareas` desde `desde`
+    hasta cumplir `segundos`. `employee_ids` como en cambios()."""
+    segundos = getattr(settings, 'TABLERO_SSE_SEGUNDOS', 25) if segundos is None else segundos
+    intervalo = getattr(settings, 'TABLERO_SSE_INTERVALO', 2) if intervalo is None else intervalo
+    yield f'retry: {int(intervalo * 1000)}\n\n'
+    if desde < timezone.now() - _retencion():
+        yield _sse('reset', {}, cursor_actual())
+        return
+
+    enviados = {}  # (tipo, pk) -> updated_at/deleted_at, solo dentro del solapamiento
+    borrados = TaskTombstone.objects.filter(kind='task')
+    if employee_ids is not None:
+        borrados = borrados.filter(employee_id__in=employee_ids)
+    fin = time.monotonic() + segundos
+    while True:
+        ahora = timezone.now()
+        limite = desde - SOLAPAMIENTO
+        enviados = {clave: marca for clave, marca in enviados.items() if marca >= limite}
+        for tarea in tareas.filter(updated_at__gte=limite).order_by('updated_at').prefetch_related('checklists'):
+            if enviados.get(('task', tarea.pk)) == tarea.updated_at:
+                continue
+            enviados['task', tarea.pk] = tarea.updated_at
+            yield _sse(_tipo_de_evento(tarea, limite), FlatTaskSerializer(tarea).data)
+        for pk, object_id, deleted_at in borrados.filter(deleted_at__gte=limite).values_list(
+                'pk', 'object_id', 'deleted_at'):
+            if ('deleted', pk) not in enviados:
+                enviados['deleted', pk] = deleted_at
+                yield _sse('task.deleted', {'id': object_id})
+        desde = ahora
+        # Sin datos no se despacha evento, pero el navegador guarda el id
+        # para la reconexión
+        yield _sse(cursor=str(int(ahora.timestamp() * 1_000_000)))
+        if time.monotonic() >= fin:
+            return
+        dormir(intervalo)
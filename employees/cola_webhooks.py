@@ -0,0 +1,238 @@
+"""
+Cola de ingesta de webhooks de Dolibarr (modo DOLIBARR_WEBHOOK_ASYNC).
+
+El webhook solo verifica la firma y guarda el WebhookLog como 'queued'; este
+módulo, llamado por `procesar_webhooks`, aplica los eventos con la misma
+lógica del modo síncrono (DolibarrWebhookView.handle_event).
+
+Los eventos de una instancia se aplican en orden de llegada: si uno falla
+queda en 'retry' con next_attempt_at (espera exponencial) y los posteriores
+de esa instancia esperan detrás, así un pago nunca se aplica antes que su
+factura. Tras WEBHOOK_MAX_INTENTOS fallos el evento pasa a 'dead' y la cola
+de la instancia sigue. Un ValueError (payload inválido) o un IntegrityError
+(evento duplicado) no se reintentan, igual que en el modo síncrono.
+
+Cada instancia se drena dentro de una transacción que bloquea su fila
+(select_for_update con skip_locked), así varios workers pueden correr a la
+vez sin aplicar dos veces ni desordenar los eventos de una misma instancia.
+
+`reprocesar` (comando `replay_webhooks` y acción del admin) vuelve a encolar
+webhooks en error, throttled o dead y drena la cola de sus instancias: los
+upserts por (instancia, dolibarr_id, status) hacen que reaplicar un evento
+ya aplicado no duplique ventas.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import idempotencia_webhooks
+from .models import DolibarrInstance, WebhookLog
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_PENDIENTES = ('queued', 'retry')
+ESTADOS_REPROCESABLES = ('error', 'throttled', 'dead')
+TAM_LOTE_WEBHOOKS = 500
+ESPERA_BASE = timedelta(seconds=30)
+ESPERA_MAXIMA = timedelta(hours=1)
+
+
+def _max_intentos():
+    return getattr(settings, 'WEBHOOK_MAX_INTENTOS', 5)
+
+
+def _espera(intentos):
+    """30 s, 1 min, 2 min... hasta una hora."""
+    return min(ESPERA_BASE * (2 ** (intentos - 1)), ESPERA_MAXIMA)
+
+
+def _aplicar(log, instance, vista, resultado):
+    """Aplica un evento y deja el log en su estado final. Devuelve False si
+    quedó en 'retry' (la cola de la instancia debe esperar)."""
+    log.attempts += 1
+    try:
+        with transaction.atomic():
+            eventos = log.payload.get('events') if isinstance(log.payload, dict) else None
+            if isinstance(eventos, list):
+                # Lote de /webhook/dolibarr/batch/: los errores son por evento
+                fallidos = [r for r in vista.process_batch(instance, eventos)
+                            if r['status'] == 'error']
+                log.error_message = '; '.join(
+                    f"event {r['event_id'] if r['event_id'] is not None else r['index']}: {r['error']}"
+                    for r in fallidos)
+            else:
+                if vista.handle_event(log.payload, instance):
+                    idempotencia_webhooks.registrar(instance, [log.payload])
+                log.error_message = ''
+        log.status = 'processed'
+    except ValueError as exc:
+        log.status = 'error'
+        log.error_message = str(exc)
+    except IntegrityError as exc:
+        log.status = 'processed'
+        log.error_message = f'Duplicate event ignored: {exc}'
+    except Exception as exc:
+        log.error_message = str(exc)
+        if log.attempts >= _max_intentos():
+            log.status = 'dead'
+            logger.error("Webhook #%s descartado tras %s intentos: %s", log.pk, log.attempts, exc)
+        else:
+            log.status = 'retry'
+            log.next_attempt_at = timezone.now() + _espera(log.attempts)
+            logger.warning("Webhook #%s falló (intento %s), se reintenta: %s",
+                           log.pk, log.attempts, exc)
+
+    if log.status != 'retry':
+        log.next_attempt_at = None
+        log.processed_at = timezone.now()
+    log.save(update_fields=['status', 'error_message', 'attempts',
+                            'next_attempt_at', 'processed_at'])
+    resultado[log.status] = resultado.get(log.status, 0) + 1
+    return log.status != 'retry'
+
+
+@transaction.atomic
+def _drenar_instancia(instance_id, tam_lote, resultado):
+    instance = DolibarrInstance.objects.select_for_update(skip_locked=True).filter(
+        pk=instance_id).first()
+    if instance is None:
+        return  # otro worker la está drenando
+
+    from .api_views import DolibarrWebhookBatchView
+    vista = DolibarrWebhookBatchView()
+    ahora = timezone.now()
+    pendientes = WebhookLog.objects.filter(
+        instance=instance, status__in=ESTADOS_PENDIENTES).order_by('pk')[:tam_lote]
+    for log in pendientes:
+        if log.next_attempt_at and log.next_attempt_at > ahora:
+            break  # el primero de la cola aún espera su reintento
+        if not _aplicar(log, instance, vista, resultado):
+            break
+
+
+def _drenar_en_hilo(instance_id, tam_lote):
+    """Cada hilo del pool abre su propia conexión: se cierra al terminar."""
+    resultado = {}
+    try:
+        _drenar_instancia(instance_id, tam_lote, resultado)
+    finally:
+        connections.close_all()
+    return resultado
+
+
+def procesar_pendientes(tam_lote=TAM_LOTE_WEBHOOKS, workers=1, instance_ids=None):
+    """Drena los webhooks en cola de cada instancia (hasta `tam_lote` por
+    instancia), o solo de `instance_ids`. Con workers > 1 las instancias se
+    drenan en paralelo, cada una en su hilo (en SQLite se ignora, como en el
+    cierre de mes). Devuelve {estado final: cantidad}."""
+    if workers > 1 and connection.vendor == 'sqlite':
+        workers = 1
+    resultado = {}
+    pendientes = WebhookLog.objects.filter(status__in=ESTADOS_PENDIENTES, instance__isnull=False)
+    if instance_ids is not None:
+        pendientes = pendientes.filter(instance_id__in=instance_ids)
+    instancias = sorted(set(pendientes.values_list('instance_id', flat=True)))
+    if workers <= 1:
+        for instance_id in instancias:
+            _drenar_instancia(instance_id, tam_lote, resultado)
+        return resultado
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for parcial in pool.map(lambda pk: _drenar_en_hilo(pk, tam_lote), instancias):
+            for estado, n in parcial.items():
+                resultado[estado] = resultado.get(estado, 0) + n
+    return resultado
+
+
+def reprocesables(estados=ESTADOS_REPROCESABLES, instance=None, trigger_code=None,
+                  desde=None, hasta=None):
+    """WebhookLogs a reprocesar, en orden de llegada. `desde`/`hasta` son
+    fechas (inclusive) de received_at. `trigger_code` filtra por la columna
+    indexada ('BATCH' para los lotes)."""
+    logs = WebhookLog.objects.filter(status__in=estados)
+    if instance is not None:
+        logs = logs.filter(instance=instance)
+    if trigger_code:
+        logs = logs.filter(trigger_code=trigger_code)
+    if desde:
+        logs = logs.filter(received_at__date__gte=desde)
+    if hasta:
+        logs = logs.filter(received_at__date__lte=hasta)
+    return logs.order_by('pk')
+
+
+def reencolar(logs, confiar_encabezados=False):
+    """Pasa los logs a 'queued'. Solo los que tienen instancia verificada
+    por HMAC; con confiar_encabezados, los anteriores a la cola (sin
+    instancia) la toman del encabezado X-Dolibarr-Professional-ID guardado
+    (columna professional_id).
+    Devuelve (reencolados, sin_instancia)."""
+    if confiar_encabezados:
+        for instance_id, professional_id in DolibarrInstance.objects.values_list('pk', 'professional_id'):
+            logs.filter(instance__isnull=True, professional_id=professional_id).update(
+                instance_id=instance_id)
+    sin_instancia = logs.filter(instance__isnull=True).count()
+    reencolados = logs.filter(instance__isnull=False).update(
+        status='queued', attempts=0, next_attempt_at=None)
+    return reencolados, sin_instancia
+
+
+def _estados(ids):
+    """{estado: cantidad} de los WebhookLog `ids` (en tandas, por el límite
+    de parámetros de SQLite)."""
+    estados = {}
+    for i in range(0, len(ids), 500):
+        for estado, n in WebhookLog.objects.filter(pk__in=ids[i:i + 500]).values_list(
+                'status').annotate(n=Count('pk')).order_by():
+            estados[estado] = estados.get(estado, 0) + n
+    return estados
+
+
+def reprocesar(logs, workers=1, tam_lote=TAM_LOTE_WEBHOOKS, confiar_encabezados=False,
+               progreso=None):
+    """Reencola `logs` y drena la cola de sus instancias hasta que no quede
+    nada aplicable (un evento que vuelve a fallar queda en 'retry' para
+    `procesar_webhooks`). Para respetar el orden de llegada, los webhooks que
+    ya estaban en cola en esas instancias se aplican antes: se informan
+    aparte como 'arrastrados'. Las demás instancias no se tocan.
+    `progreso(hechos, total, segundos)` se llama tras cada pasada y cuenta
+    solo los reencolados.
+
+    Devuelve {estado: cantidad} de los reencolados ('queued' si quedaron
+    detrás de un reintento), más 'reencolados', 'sin_instancia',
+    'arrastrados' y 'segundos'."""
+    inicio = time.monotonic()
+    candidatos = list(logs.values_list('pk', flat=True))
+    reencolados, sin_instancia = reencolar(logs, confiar_encabezados)
+    # Los candidatos con instancia quedaron 'queued'; los otros no cambiaron
+    ids, instancias = [], set()
+    for i in range(0, len(candidatos), 500):
+        for pk, instance_id in WebhookLog.objects.filter(
+                pk__in=candidatos[i:i + 500], status='queued').values_list('pk', 'instance_id'):
+            ids.append(pk)
+            instancias.add(instance_id)
+
+    total, finales = len(ids), 0
+    while ids:
+        pasada = procesar_pendientes(tam_lote, workers, instance_ids=instancias)
+        if not pasada:
+            break
+        finales += sum(n for estado, n in pasada.items() if estado != 'retry')
+        estados = _estados(ids)
+        if progreso:
+            progreso(total - sum(estados.get(e, 0) for e in ESTADOS_PENDIENTES), total,
+                     time.monotonic() - inicio)
+        if not estados.get('queued'):
+            break
+    resultado = _estados(ids)
+    hechos = total - sum(resultado.get(e, 0) for e in ESTADOS_PENDIENTES)
+    resultado.update(reencolados=reencolados, sin_instancia=sin_instancia,
+                     arrastrados=finales - hechos, segundos=time.monotonic() - inicio)
+    logger.info("Replay de webhooks: %s", resultado)
+    return resultado
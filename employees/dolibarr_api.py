@@ -1,38 +1,123 @@
 """
-Cliente saliente hacia la API REST de Dolibarr (módulo nativo de salarios).
+Cliente saliente hacia la API REST de Dolibarr: salarios (push de nómina) y
+lectura de presupuestos, pedidos, facturas y pagos (sincronizar_dolibarr).
 
 Transporte puro: recibe los objetos ya cargados, arma la petición y la envía.
 No toca el ORM más allá de leer los datos que recibe ni usa messages; ante
-cualquier problema lanza una excepción y el llamador (nomina.py) decide.
+cualquier problema lanza una excepción y el llamador (nomina.py,
+sincronizacion.py) decide.
+
+Para envíos masivos el llamador abre un `cliente(instancia)` y lo comparte
+entre hilos: httpx reutiliza las conexiones TCP/TLS en vez de abrir una por
+recibo. Los reintentos solo cubren fallos en que Dolibarr seguro no creó el
+salario (no se pudo conectar, 429, 502-504): un POST que pudo llegar (timeout
+de lectura, 500 de validación) no se repite para no duplicar el registro.
 """
 import calendar
 import logging
+import time
 from datetime import datetime
 
 import httpx
 
 logger = logging.getLogger(__name__)
 
-TIMEOUT = 15.0  # el push es interactivo desde la vista de cierre de nómina
+TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+REINTENTOS = 3
+ESPERA_BASE = 0.5  # segundos; se duplica en cada reintento
+ESTADOS_REINTENTABLES = {429, 502, 503, 504}
+ERRORES_REINTENTABLES = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+TAM_PAGINA = 100
 
 
 class DolibarrApiError(Exception):
     """La API de Dolibarr respondió con error (HTTP != 2xx o cuerpo inesperado)."""
 
 
-def crear_salario(recibo, instancia, dolibarr_user_id):
+def cliente(instancia, max_conexiones=8):
+    """httpx.Client para una instancia, compartible entre hilos: lleva la URL
+    base de su API y el DOLAPIKEY, así cada petición solo pasa la ruta
+    ('salaries', 'invoices/12/payments'). Usar como context manager para
+    cerrar las conexiones al terminar."""
+    return httpx.Client(
+        base_url=instancia.api_base_url.rstrip('/') + '/api/index.php/',
+        headers={
+            'DOLAPIKEY': instancia.api_key,
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        },
+        timeout=TIMEOUT,
+        limits=httpx.Limits(max_connections=max_conexiones,
+                            max_keepalive_connections=max_conexiones),
+    )
+
+
+def _pedir(http, metodo, url, idempotente=False, **kwargs):
+    """Petición con reintentos y espera exponencial (ver docstring del
+    módulo). Las lecturas (`idempotente`) también se reintentan ante timeouts
+    y cualquier 5xx."""
+    errores = httpx.TransportError if idempotente else ERRORES_REINTENTABLES
+    for intento in range(1, REINTENTOS + 1):
+        try:
+            resp = getattr(http, metodo)(url, timeout=TIMEOUT, **kwargs)
+        except errores as exc:
+            if intento == REINTENTOS:
+                raise
+            logger.info("Dolibarr sin conexión (%s), reintento %s: %s", url, intento, exc)
+        else:
+            reintentable = (resp.status_code in ESTADOS_REINTENTABLES
+                            or (idempotente and resp.status_code >= 500))
+            if not reintentable or intento == REINTENTOS:
+                return resp
+            logger.info("Dolibarr respondió %s (%s), reintento %s", resp.status_code, url, intento)
+        time.sleep(ESPERA_BASE * 2 ** (intento - 1))
+
+
+def _lista(resp):
+    """Cuerpo JSON de una lectura: lista vacía si Dolibarr responde 404
+    (así indica "sin resultados")."""
+    if resp.status_code == 404:
+        return []
+    if not (200 <= resp.status_code < 300):
+        raise DolibarrApiError(f"HTTP {resp.status_code}: {resp.text[:500]}")
+    try:
+        data = resp.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, list):
+        raise DolibarrApiError(f"Respuesta inesperada de Dolibarr: {resp.text[:500]}")
+    return data
+
+
+def listar(http, recurso, modificado_desde=None, pagina=0, limite=None):
+    """Una página de `recurso` ('proposals', 'orders', 'invoices') ordenada
+    por fecha de modificación (t.tms), desde `modificado_desde` (datetime
+    UTC, inclusive). Devuelve [] pasada la última página. `http` es el
+    cliente(instancia)."""
+    params = {'sortfield': 't.tms', 'sortorder': 'ASC', 'limit': limite or TAM_PAGINA,
+              'page': pagina}
+    if modificado_desde:
+        params['sqlfilters'] = f"(t.tms:>=:'{modificado_desde:%Y-%m-%d %H:%M:%S}')"
+    return _lista(_pedir(http, 'get', recurso, idempotente=True, params=params))
+
+
+def pagos_factura(http, invoice_id):
+    """Pagos de una factura: [{'date': 'AAAA-MM-DD HH:MM:SS', 'amount': ...}]."""
+    return _lista(_pedir(http, 'get', f'invoices/{invoice_id}/payments', idempotente=True))
+
+
+def crear_salario(recibo, instancia, dolibarr_user_id, http=None):
     """Crea el registro de salario del mes en Dolibarr para un ReciboNomina.
 
     Solo el registro contable, SIN pago (paye=0): el pago se asienta a mano en
     Dolibarr al hacer la transferencia real. Devuelve el id (int, rowid de
     llx_salary). Lanza DolibarrApiError o httpx.HTTPError; el llamador captura.
+    `http` es el cliente(instancia) compartido del lote; sin él se abre uno
+    para esta sola petición.
     """
-    url = instancia.api_base_url.rstrip('/') + '/api/index.php/salaries'
-    headers = {
-        'DOLAPIKEY': instancia.api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-    }
+    if http is None:
+        with cliente(instancia, max_conexiones=1) as http:
+            return crear_salario(recibo, instancia, dolibarr_user_id, http)
 
     # Dolibarr espera timestamps Unix para el período del salario.
     ultimo_dia = calendar.monthrange(recibo.year, recibo.month)[1]
@@ -48,7 +133,7 @@ def crear_salario(recibo, instancia, dolibarr_user_id):
         'paye': 0,                     # NO pagado: registro sin pago asociado
     }
 
-    resp = httpx.post(url, json=payload, headers=headers, timeout=TIMEOUT)
+    resp = _pedir(http, 'post', 'salaries', json=payload)
     if not (200 <= resp.status_code < 300):
         # 403 = el usuario del DOLAPIKEY no tiene permiso "salaries → write";
         # 500 = Dolibarr devuelve un array de errores de validación.
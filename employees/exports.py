@@ -8,13 +8,12 @@ import io
 from datetime import date
 from decimal import Decimal, InvalidOperation
 
-from django.db.models import Q
-
 from openpyxl import Workbook
 from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
 from openpyxl.utils import get_column_letter
 
-from .models import Employee, ReciboNomina
+from .models import ReciboNomina
+from .payroll import active_employees, calculate_salaries
 
 AZUL = "1E3A5F"
 GRIS_CLARO = "EEF2F7"
@@ -101,11 +100,10 @@ def _filas_desde_recibos(recibos):
 
 
 def _filas_en_vivo(year, month):
-    primero = date(year, month, 1)
-    activos = Employee.objects.filter(
-        Q(end_date__isnull=True) | Q(end_date__gte=primero)).order_by('name')
+    activos = list(active_employees(year, month))
+    salarios = calculate_salaries(year, month, activos)
     for employee in activos:
-        salary = employee.calculate_salary(year, month)
+        salary = salarios[employee.pk]
         if salary is None:
             continue
         yield [
@@ -0,0 +1,118 @@
+"""
+Índice de idempotencia de los eventos de webhook de Dolibarr.
+
+Dolibarr reenvía el mismo evento cuando no recibe la respuesta a tiempo.
+Antes el duplicado se detectaba recién con el IntegrityError del
+update_or_create, después de resolver empleado, presupuesto y pedido. Ahora
+cada evento aplicado deja una entrada en WebhookEventoVisto con clave
+(instancia, trigger_code, id del objeto, hash del payload) y el webhook la
+consulta justo después de verificar la firma: un reenvío idéntico se
+responde 'already_processed' sin tocar SalesRecord.
+
+El hash es SHA-256 del evento en JSON canónico (sin `event_id`, que la cola
+de reintentos de Dolibarr puede renumerar), así un evento con cambios nunca
+se confunde con uno visto. Solo se registran los eventos que escribieron
+algo (handle_event devuelve True): uno que falló o que se descartó sin
+escribir, por ejemplo con el empleado aún sin mapear, se vuelve a procesar
+si llega otra vez.
+
+La ventana es deslizante: cada reenvío renueva `visto` y la entrada vence
+tras WEBHOOK_IDEMPOTENCIA_HORAS sin verlo. `purgar` (archivar_webhooks)
+borra las vencidas. Los aciertos y fallos se cuentan en la caché, como los
+de cached_salary (por proceso con la caché local, globales con una
+compartida).
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import WebhookEventoVisto
+
+STATS_KEYS = {'hits': 'webhook_idempotencia:hits', 'misses': 'webhook_idempotencia:misses'}
+
+
+def _ventana():
+    return timedelta(hours=getattr(settings, 'WEBHOOK_IDEMPOTENCIA_HORAS', 24))
+
+
+def _count(kind, n):
+    if not n:
+        return
+    key = STATS_KEYS[kind]
+    try:
+        cache.incr(key, n)
+    except ValueError:
+        if not cache.add(key, n, timeout=None):
+            cache.incr(key, n)
+
+
+def huella(evento):
+    """(trigger_code, object_id, payload_hash) de un evento, o None si no
+    tiene la forma de un evento de Dolibarr."""
+    if not isinstance(evento, dict) or not isinstance(evento.get('object'), dict):
+        return None
+    contenido = {k: v for k, v in evento.items() if k != 'event_id'}
+    canonico = json.dumps(contenido, sort_keys=True, separators=(',', ':'), default=str)
+    return (
+        str(evento.get('trigger_code', ''))[:64],
+        str(evento['object'].get('id', ''))[:64],
+        hashlib.sha256(canonico.encode('utf-8')).hexdigest(),
+    )
+
+
+def ya_vistos(instance, eventos):
+    """Índices de `eventos` ya aplicados dentro de la ventana. Renueva la
+    ventana de los encontrados. Una consulta (más un UPDATE si hay)."""
+    huellas = {i: h for i, h in enumerate(map(huella, eventos)) if h}
+    if not huellas:
+        return set()
+    ahora = timezone.now()
+    encontrados = {
+        (trigger_code, object_id, payload_hash): pk
+        for pk, trigger_code, object_id, payload_hash in WebhookEventoVisto.objects.filter(
+            instance=instance, visto__gte=ahora - _ventana(),
+            payload_hash__in={h[2] for h in huellas.values()},
+        ).values_list('pk', 'trigger_code', 'object_id', 'payload_hash')
+    }
+    vistos = {i for i, h in huellas.items() if h in encontrados}
+    if vistos:
+        WebhookEventoVisto.objects.filter(pk__in=[encontrados[huellas[i]] for i in vistos]).update(
+            visto=ahora)
+    _count('hits', len(vistos))
+    _count('misses', len(huellas) - len(vistos))
+    return vistos
+
+
+def registrar(instance, eventos):
+    """Anota `eventos` como aplicados (un upsert)."""
+    ahora = timezone.now()
+    entradas = {h: WebhookEventoVisto(instance=instance, trigger_code=h[0], object_id=h[1],
+                                      payload_hash=h[2], visto=ahora)
+                for h in map(huella, eventos) if h}
+    if entradas:
+        WebhookEventoVisto.objects.bulk_create(
+            entradas.values(), update_conflicts=True, update_fields=['visto'],
+            unique_fields=['instance', 'trigger_code', 'object_id', 'payload_hash'])
+
+
+def purgar():
+    """Borra las entradas vencidas. Devuelve cuántas."""
+    borrados, _ = WebhookEventoVisto.objects.filter(
+        visto__lt=timezone.now() - _ventana()).delete()
+    return borrados
+
+
+def estadisticas():
+    hits = cache.get(STATS_KEYS['hits'], 0)
+    misses = cache.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+        'entries': WebhookEventoVisto.objects.count(),
+    }
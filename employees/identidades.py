@@ -0,0 +1,112 @@
+"""
+Caché por proceso de la resolución de instancias e identidades de Dolibarr.
+
+Cada webhook resuelve la instancia por professional_id (y verifica su firma)
+y el empleado por (instancia, dolibarr_user_id). Las dos búsquedas quedan en
+LRU en memoria del proceso: la instancia junto con un HMAC-SHA256 ya
+inicializado con su secreto (cada firma parte de una copia) y el empleado
+de cada identidad, incluida la ausencia de mapeo.
+
+Las entradas valen mientras coincida el token de versión guardado en la caché
+de Django y no pase DOLIBARR_LOOKUP_CACHE_TTL:
+signals.py renueva el token al guardar o borrar DolibarrInstance,
+DolibarrUserIdentity o Employee. Dentro de una transacción (el webhook
+aplica cada evento en una, y la cola drena cada instancia en otra) la
+entrada se guarda recién al confirmarla: un rollback la descarta, y si la
+propia transacción renovó el token la entrada nace vencida.
+"""
+import copy
+import hashlib
+import hmac
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import DolibarrInstance, DolibarrUserIdentity
+
+VERSION_KEY = 'dolibarr:identidades'
+MAX_INSTANCIAS = 64
+MAX_IDENTIDADES = 4096
+
+_lock = threading.Lock()
+_instancias = OrderedDict()   # professional_id -> (instancia, hmac base, token, vence)
+_identidades = OrderedDict()  # (instance_id, dolibarr_user_id) -> (empleado, token, vence)
+
+
+def _token():
+    """Token vigente, creándolo si la caché no tiene uno."""
+    token = cache.get(VERSION_KEY)
+    if token is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        token = cache.get(VERSION_KEY)
+    return token
+
+
+def _vigente(lru, clave, token):
+    with _lock:
+        entrada = lru.get(clave)
+        if entrada and entrada[-2] == token and entrada[-1] > time.monotonic():
+            lru.move_to_end(clave)
+            return entrada
+    return None
+
+
+def _guardar(lru, clave, valor, maximo):
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _guardar(lru, clave, valor, maximo))
+        return
+    vence = time.monotonic() + getattr(settings, 'DOLIBARR_LOOKUP_CACHE_TTL', 60)
+    with _lock:
+        lru[clave] = valor + (vence,)
+        lru.move_to_end(clave)
+        while len(lru) > maximo:
+            lru.popitem(last=False)
+
+
+def instance_for(professional_id):
+    """(DolibarrInstance, hmac base con su secreto) o (None, None) si no
+    existe. La instancia es una copia: el llamador puede modificarla."""
+    token = _token()
+    entrada = _vigente(_instancias, professional_id, token)
+    if entrada is None:
+        instance = DolibarrInstance.objects.filter(professional_id=professional_id).first()
+        if instance is None:
+            return None, None
+        base = hmac.new(instance.api_secret.encode('utf-8'), digestmod=hashlib.sha256)
+        entrada = (instance, base, token)
+        _guardar(_instancias, professional_id, entrada, MAX_INSTANCIAS)
+    return copy.copy(entrada[0]), entrada[1]
+
+
+def signature_for(base, body):
+    """Firma HMAC-SHA256 (hex) de `body` con el secreto ya cargado en `base`."""
+    mac = base.copy()
+    mac.update(body)
+    return mac.hexdigest()
+
+
+def employee_for(instance, dolibarr_user_id):
+    """Empleado mapeado a (instance, dolibarr_user_id) o None (copia)."""
+    clave = (instance.pk, dolibarr_user_id)
+    token = _token()
+    entrada = _vigente(_identidades, clave, token)
+    if entrada is None:
+        identity = DolibarrUserIdentity.objects.filter(
+            dolibarr_instance=instance, dolibarr_user_id=dolibarr_user_id,
+        ).select_related('employee').first()
+        entrada = (identity.employee if identity else None, token)
+        _guardar(_identidades, clave, entrada, MAX_IDENTIDADES)
+    return copy.copy(entrada[0])
+
+
+def invalidate():
+    """Descarta las entradas de este proceso y renueva el token para el resto."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    with _lock:
+        _instancias.clear()
+        _identidades.clear()
@@ -0,0 +1,195 @@
+"""
+Importación masiva de WorkLogs desde exportaciones del reloj de marcación.
+
+Lee CSV o XLSX fila a fila (sin cargar el archivo entero), valida por lotes
+y guarda cada lote con un upsert sobre (employee, date): el día que ya
+existe se actualiza con las horas del archivo, el que falta se crea. Los
+empleados se resuelven por email o id con un único mapa armado en una
+consulta.
+
+El upsert no dispara signals, así que al final de cada lote se recalculan
+los resúmenes mensuales tocados y se invalida la caché de salario de esos
+empleados (lo mismo que hacen los receivers de WorkLog).
+
+Columnas reconocidas (encabezado en la primera fila, sin importar
+mayúsculas): empleado/employee/email/employee_id, fecha/date,
+horas/hours_worked y, opcional, horas_extra/overtime_hours.
+"""
+import csv
+import io
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Employee, WorkLog
+from .payroll import invalidate_salary_cache
+from .resumen_mensual import refresh_summaries
+
+TAM_LOTE_IMPORTACION = 1000
+MAX_HORAS = Decimal('99.99')  # WorkLog: max_digits=4, decimal_places=2
+
+COLUMNAS = {
+    'empleado': 'employee', 'employee': 'employee', 'email': 'employee',
+    'employee_id': 'employee', 'id_empleado': 'employee',
+    'fecha': 'date', 'date': 'date',
+    'horas': 'hours_worked', 'hours_worked': 'hours_worked', 'hours': 'hours_worked',
+    'horas_extra': 'overtime_hours', 'overtime_hours': 'overtime_hours',
+    'overtime': 'overtime_hours',
+}
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+
+class ImportacionError(ValueError):
+    """El archivo no se puede leer (formato o encabezados)."""
+
+
+def _filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    muestra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    try:
+        yield from csv.reader(texto, dialecto)
+    finally:
+        texto.detach()  # el archivo es de quien lo abrió
+
+
+def _filas_xlsx(archivo):
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from libro.active.iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def leer_filas(archivo, nombre):
+    """Genera (número de fila, {campo: valor}) de un archivo binario CSV o
+    XLSX (según la extensión de `nombre`). Las filas vacías se saltan."""
+    if nombre.lower().endswith('.xlsx'):
+        filas = _filas_xlsx(archivo)
+    elif nombre.lower().endswith(('.csv', '.txt')):
+        filas = _filas_csv(archivo)
+    else:
+        raise ImportacionError(f"Formato no soportado: {nombre} (usar CSV o XLSX).")
+
+    encabezado = next(filas, None)
+    if not encabezado:
+        raise ImportacionError("El archivo está vacío.")
+    campos = [COLUMNAS.get(str(c or '').strip().lower()) for c in encabezado]
+    faltan = {'employee', 'date', 'hours_worked'} - set(campos)
+    if faltan:
+        raise ImportacionError(f"Faltan columnas: {', '.join(sorted(faltan))}.")
+
+    for numero, valores in enumerate(filas, start=2):
+        if not any(v not in (None, '') for v in valores):
+            continue
+        yield numero, {c: v for c, v in zip(campos, valores) if c}
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = str(valor or '').strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"fecha inválida: {valor!r}")
+
+
+def _horas(valor, campo):
+    if valor in (None, ''):
+        return Decimal('0')
+    try:
+        horas = Decimal(str(valor).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"{campo} inválido: {valor!r}")
+    if not Decimal('0') <= horas <= MAX_HORAS:
+        raise ValueError(f"{campo} fuera de rango: {horas}")
+    return horas.quantize(Decimal('0.01'))
+
+
+def _mapa_empleados():
+    """{email en minúsculas o id como texto: employee_id}."""
+    mapa = {}
+    for pk, email in Employee.objects.values_list('pk', 'email'):
+        mapa[str(pk)] = pk
+        if email:
+            mapa[email.strip().lower()] = pk
+    return mapa
+
+
+def _validar(fila, empleados):
+    clave = fila.get('employee')
+    if isinstance(clave, float) and clave.is_integer():
+        clave = int(clave)  # ids numéricos en XLSX
+    employee_id = empleados.get(str(clave or '').strip().lower())
+    if employee_id is None:
+        raise ValueError(f"empleado desconocido: {fila.get('employee')!r}")
+    if fila.get('hours_worked') in (None, ''):
+        raise ValueError("faltan las horas")
+    return WorkLog(
+        employee_id=employee_id, date=_fecha(fila.get('date')),
+        hours_worked=_horas(fila.get('hours_worked'), 'horas'),
+        overtime_hours=_horas(fila.get('overtime_hours'), 'horas extra'),
+    )
+
+
+@transaction.atomic
+def _guardar_lote(logs):
+    """Upsert de un lote {(employee_id, fecha): WorkLog}. Devuelve cuántos
+    días eran nuevos."""
+    ids = {employee_id for employee_id, _ in logs}
+    fechas = [dia for _, dia in logs]
+    existentes = set(WorkLog.objects.filter(
+        employee_id__in=ids, date__range=(min(fechas), max(fechas)),
+    ).values_list('employee_id', 'date'))
+    WorkLog.objects.bulk_create(
+        logs.values(), update_conflicts=True,
+        unique_fields=['employee', 'date'],
+        update_fields=['hours_worked', 'overtime_hours'],
+    )
+    refresh_summaries({(employee_id, dia.year, dia.month) for employee_id, dia in logs})
+    invalidate_salary_cache(*ids)
+    return len(logs.keys() - existentes)
+
+
+def importar_worklogs(filas, tam_lote=TAM_LOTE_IMPORTACION):
+    """Importa las filas de `leer_filas`. Cada lote se guarda en su propia
+    transacción; una fila inválida se rechaza sin frenar al resto. Si un
+    mismo empleado y día se repite, gana la última fila.
+
+    Devuelve {'procesadas', 'creadas', 'actualizadas', 'rechazadas'}, con
+    'rechazadas' como lista de (número de fila, motivo)."""
+    empleados = _mapa_empleados()
+    resultado = {'procesadas': 0, 'creadas': 0, 'actualizadas': 0, 'rechazadas': []}
+    lote = {}
+
+    def guardar():
+        creadas = _guardar_lote(lote)
+        resultado['creadas'] += creadas
+        resultado['actualizadas'] += len(lote) - creadas
+        lote.clear()
+
+    for numero, fila in filas:
+        resultado['procesadas'] += 1
+        try:
+            log = _validar(fila, empleados)
+        except ValueError as exc:
+            resultado['rechazadas'].append((numero, str(exc)))
+            continue
+        lote[(log.employee_id, log.date)] = log
+        if len(lote) >= tam_lote:
+            guardar()
+    if lote:
+        guardar()
+    return resultado
@@ -0,0 +1,107 @@
+"""
+Límite de tasa del webhook de Dolibarr por instancia, compartido entre workers.
+
+El throttle de DRF (WebhookRateThrottle) guarda su historial en la caché por
+defecto, que con gunicorn es local a cada proceso: el límite real era
+300/min por worker y las ráfagas pasaban enteras. Aquí cada DolibarrInstance
+tiene una cubeta de tokens en la base (WebhookTokenBucket) con capacidad
+WEBHOOK_BUCKET_CAPACIDAD que se rellena a WEBHOOK_BUCKET_TASA tokens por
+segundo.
+
+`consumir` recarga y descuenta en un solo UPDATE condicionado (la fila queda
+bloqueada mientras tanto), así dos workers nunca gastan el mismo token y el
+camino normal cuesta una sola consulta por clave primaria. Solo cuando se
+rechaza (o la cubeta aún no existe) hace falta una segunda consulta.
+
+Con WEBHOOK_BUCKET_CACHE (alias de una caché compartida entre workers, Redis
+o Memcached en CACHES) el límite no toca la base: cada instancia cuenta sus
+peticiones en ventanas fijas de CAPACIDAD / TASA segundos con un incr
+atómico, y admite hasta CAPACIDAD por ventana (la misma tasa media; en el
+borde de dos ventanas la ráfaga puede llegar al doble). No usar con la caché
+en memoria por defecto: es local a cada worker.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
+
+from .cola_webhooks import ESTADOS_PENDIENTES
+from .models import WebhookLog, WebhookTokenBucket
+
+
+def _capacidad():
+    return float(getattr(settings, 'WEBHOOK_BUCKET_CAPACIDAD', 60))
+
+
+def _tasa():
+    return float(getattr(settings, 'WEBHOOK_BUCKET_TASA', 5.0))
+
+
+def consumir(instance_id, ahora=None):
+    """Intenta gastar un token de la cubeta de la instancia. Devuelve
+    (permitido, espera): `espera` son los segundos hasta el próximo token
+    (0 si se permitió)."""
+    ahora = time.time() if ahora is None else ahora
+    alias = getattr(settings, 'WEBHOOK_BUCKET_CACHE', None)
+    if alias:
+        return _consumir_en_cache(caches[alias], instance_id, ahora)
+    capacidad, tasa = _capacidad(), _tasa()
+    recarga = Least(
+        Value(capacidad),
+        F('tokens') + (Value(ahora) - F('actualizado')) * Value(tasa),
+        output_field=FloatField(),
+    )
+    if WebhookTokenBucket.objects.filter(
+        GreaterThanOrEqual(recarga, 1), pk=instance_id,
+    ).update(tokens=recarga - 1, actualizado=ahora):
+        return True, 0.0
+
+    cubeta = WebhookTokenBucket.objects.filter(pk=instance_id).values_list(
+        'tokens', 'actualizado').first()
+    if cubeta is None:
+        try:
+            with transaction.atomic():
+                WebhookTokenBucket.objects.create(
+                    instance_id=instance_id, tokens=max(capacidad - 1, 0), actualizado=ahora)
+        except IntegrityError:
+            return consumir(instance_id, ahora)  # otro worker la creó a la vez
+        if capacidad >= 1:
+            return True, 0.0
+        cubeta = (0.0, ahora)
+
+    tokens, actualizado = cubeta
+    disponibles = min(capacidad, tokens + (ahora - actualizado) * tasa)
+    return False, (1 - disponibles) / tasa if tasa > 0 else 60.0
+
+
+def _consumir_en_cache(cache, instance_id, ahora):
+    """Ventana fija con contador en la caché compartida: un incr por
+    petición, sin consultas a la base."""
+    capacidad, tasa = _capacidad(), _tasa()
+    if capacidad < 1 or tasa <= 0:
+        return False, 1 / tasa if tasa > 0 else 60.0
+    ventana = capacidad / tasa
+    numero = int(ahora // ventana)
+    clave = f'webhook_limite:{instance_id}:{numero}'
+    expira = math.ceil(ventana) + 1
+    try:
+        usados = cache.incr(clave)
+    except ValueError:
+        # Primera petición de la ventana (o la clave acaba de expirar)
+        usados = 1 if cache.add(clave, 1, expira) else cache.incr(clave)
+    if usados <= capacidad:
+        return True, 0.0
+    return False, (numero + 1) * ventana - ahora
+
+
+def profundidad_cola(instance=None):
+    """Webhooks en cola (queued/retry) de la instancia, o de todas."""
+    logs = WebhookLog.objects.filter(status__in=ESTADOS_PENDIENTES)
+    if instance is not None:
+        logs = logs.filter(instance=instance)
+    return logs.count()
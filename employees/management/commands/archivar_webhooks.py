@@ -0,0 +1,47 @@
+"""
+Compacta y archiva los WebhookLog viejos (ver employees/archivo_webhooks.py)
+y purga el índice de idempotencia vencido (employees/idempotencia_webhooks.py).
+
+Uso:
+    python manage.py archivar_webhooks                 # plazos de settings (cron diario)
+    python manage.py archivar_webhooks --dias 30 --dias-compactar 3
+    python manage.py archivar_webhooks --buscar 12345  # muestra un log archivado
+"""
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.archivo_webhooks import TAM_ARCHIVO, archivar, buscar_archivados, compactar
+from employees.idempotencia_webhooks import purgar
+
+
+class Command(BaseCommand):
+    help = "Vacía headers de webhooks procesados y mueve los viejos a archivos .jsonl.gz."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=settings.WEBHOOK_LOG_RETENCION_DIAS,
+                            help='Archivar los recibidos hace más de N días '
+                                 f'(default: {settings.WEBHOOK_LOG_RETENCION_DIAS})')
+        parser.add_argument('--dias-compactar', type=int, default=settings.WEBHOOK_LOG_COMPACTAR_DIAS,
+                            help='Vaciar headers de los procesados hace más de N días '
+                                 f'(default: {settings.WEBHOOK_LOG_COMPACTAR_DIAS})')
+        parser.add_argument('--lote', type=int, default=TAM_ARCHIVO,
+                            help=f'Webhooks por archivo (default: {TAM_ARCHIVO})')
+        parser.add_argument('--buscar', type=int, metavar='ID',
+                            help='No archivar: imprimir el log archivado con ese id')
+
+    def handle(self, *args, **options):
+        if options['buscar'] is not None:
+            logs = list(buscar_archivados(log_id=options['buscar']))
+            if not logs:
+                raise CommandError(f"No hay ningún webhook archivado con id {options['buscar']}.")
+            self.stdout.write(json.dumps(logs[0], indent=2, ensure_ascii=False))
+            return
+
+        compactados = compactar(options['dias_compactar'])
+        resultado = archivar(options['dias'], options['lote'])
+        vencidos = purgar()
+        self.stdout.write(self.style.SUCCESS(
+            f"Webhooks: {compactados} compactados, {resultado['logs']} archivados "
+            f"en {resultado['archivos']} archivo(s), {vencidos} entradas de idempotencia vencidas."))
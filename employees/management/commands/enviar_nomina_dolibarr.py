@@ -19,6 +19,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--year', type=int, help='Año del período (default: mes anterior)')
         parser.add_argument('--month', type=int, help='Mes del período (default: mes anterior)')
+        parser.add_argument('--workers', type=int,
+                            help='Recibos enviados a la vez (default: DOLIBARR_PUSH_WORKERS)')
 
     def handle(self, *args, **options):
         if options['year'] and options['month']:
@@ -27,7 +29,7 @@ class Command(BaseCommand):
             anterior = date.today().replace(day=1) - relativedelta(months=1)
             year, month = anterior.year, anterior.month
 
-        resultado = enviar_recibos_dolibarr(year, month)
+        resultado = enviar_recibos_dolibarr(year, month, workers=options['workers'])
 
         self.stdout.write(self.style.SUCCESS(
             f"{len(resultado['enviados'])} recibos enviados a Dolibarr para {month:02d}/{year}."))
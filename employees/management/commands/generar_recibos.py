@@ -4,13 +4,14 @@ Genera los recibos de nómina (snapshots) de un período.
 Uso:
     python manage.py generar_recibos                 # mes anterior (cierre)
     python manage.py generar_recibos --year 2026 --month 6
+    python manage.py generar_recibos --workers 4 --lote 100
 """
 from datetime import date
 
 from dateutil.relativedelta import relativedelta
 from django.core.management.base import BaseCommand
 
-from employees.nomina import generar_recibos_mes
+from employees.nomina import TAM_LOTE_CIERRE, generar_recibos_mes
 
 
 class Command(BaseCommand):
@@ -19,6 +20,10 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--year', type=int, help='Año del período (default: mes anterior)')
         parser.add_argument('--month', type=int, help='Mes del período (default: mes anterior)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Hilos en paralelo (default: 1; con SQLite dejar en 1)')
+        parser.add_argument('--lote', type=int, default=TAM_LOTE_CIERRE,
+                            help=f'Empleados por transacción (default: {TAM_LOTE_CIERRE})')
 
     def handle(self, *args, **options):
         if options['year'] and options['month']:
@@ -27,7 +32,12 @@ class Command(BaseCommand):
             anterior = date.today().replace(day=1) - relativedelta(months=1)
             year, month = anterior.year, anterior.month
 
-        generados, omitidos = generar_recibos_mes(year, month)
+        def progreso(hechos, total):
+            self.stdout.write(f"  {hechos}/{total} empleados procesados")
+
+        generados, omitidos = generar_recibos_mes(
+            year, month, workers=options['workers'], tam_lote=options['lote'],
+            progreso=progreso)
 
         self.stdout.write(self.style.SUCCESS(
             f"{len(generados)} recibos generados para {month:02d}/{year}."))
@@ -0,0 +1,36 @@
+"""
+Importa WorkLogs desde una exportación del reloj de marcación (CSV o XLSX).
+
+Uso:
+    python manage.py importar_marcaciones marcaciones_junio.xlsx
+    python manage.py importar_marcaciones marcaciones.csv --lote 5000
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.importacion import (
+    TAM_LOTE_IMPORTACION, ImportacionError, importar_worklogs, leer_filas,
+)
+
+
+class Command(BaseCommand):
+    help = "Importa horas trabajadas (WorkLog) desde un archivo CSV o XLSX del reloj de marcación."
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo CSV o XLSX')
+        parser.add_argument('--lote', type=int, default=TAM_LOTE_IMPORTACION,
+                            help=f'Filas por transacción (default: {TAM_LOTE_IMPORTACION})')
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        try:
+            with open(ruta, 'rb') as archivo:
+                resultado = importar_worklogs(leer_filas(archivo, ruta), tam_lote=options['lote'])
+        except (OSError, ImportacionError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['procesadas']} filas: {resultado['creadas']} días creados, "
+            f"{resultado['actualizadas']} actualizados, "
+            f"{len(resultado['rechazadas'])} rechazadas."))
+        for numero, motivo in resultado['rechazadas']:
+            self.stdout.write(self.style.WARNING(f"Fila {numero}: {motivo}"))
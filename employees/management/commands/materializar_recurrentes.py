@@ -0,0 +1,29 @@
+"""
+Crea las instancias que faltan de las tareas recurrentes (ver
+employees/recurrentes.py). El listado de tareas ya no las genera: este
+comando va en cron (ver scripts/crontab.example). De paso purga los
+borrados vencidos del tablero (TaskTombstone, ver cambios_tablero.py).
+
+Uso:
+    python manage.py materializar_recurrentes                # hasta hoy (+ horizonte de settings)
+    python manage.py materializar_recurrentes --horizonte 7  # una semana por delante
+"""
+from django.core.management.base import BaseCommand
+
+from employees.cambios_tablero import purgar_borrados
+from employees.recurrentes import materializar
+
+
+class Command(BaseCommand):
+    help = "Expande las plantillas de tareas recurrentes hasta el horizonte configurado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizonte', type=int,
+                            help='Días por delante de hoy a materializar '
+                                 '(default: TAREAS_RECURRENTES_HORIZONTE_DIAS)')
+
+    def handle(self, *args, **options):
+        creadas = materializar(options['horizonte'])
+        purgados = purgar_borrados()
+        self.stdout.write(self.style.SUCCESS(
+            f"{creadas} tareas recurrentes creadas, {purgados} borrados del tablero purgados."))
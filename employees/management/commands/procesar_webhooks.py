@@ -0,0 +1,37 @@
+"""
+Aplica los webhooks de Dolibarr encolados (modo DOLIBARR_WEBHOOK_ASYNC).
+
+Uso:
+    python manage.py procesar_webhooks                 # una pasada (cron)
+    python manage.py procesar_webhooks --continuo      # worker permanente
+    python manage.py procesar_webhooks --continuo --intervalo 2 --lote 200
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from employees.cola_webhooks import TAM_LOTE_WEBHOOKS, procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Procesa en orden, por instancia, los webhooks de Dolibarr pendientes de la cola."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAM_LOTE_WEBHOOKS,
+                            help=f'Eventos por instancia y pasada (default: {TAM_LOTE_WEBHOOKS})')
+        parser.add_argument('--continuo', action='store_true',
+                            help='No terminar: volver a revisar la cola cada --intervalo segundos')
+        parser.add_argument('--intervalo', type=float, default=5,
+                            help='Segundos entre pasadas con --continuo (default: 5)')
+
+    def handle(self, *args, **options):
+        while True:
+            resultado = procesar_pendientes(options['lote'])
+            if resultado or options['verbosity'] > 1:
+                resumen = ', '.join(f"{n} {estado}" for estado, n in sorted(resultado.items()))
+                self.stdout.write(self.style.SUCCESS(
+                    f"Webhooks: {resumen or 'ninguno pendiente'}."))
+            if not options['continuo']:
+                return
+            if not resultado:
+                time.sleep(options['intervalo'])
@@ -0,0 +1,28 @@
+"""
+Regenera la tabla de resúmenes mensuales (EmployeeMonthSummary) desde
+WorkLog, SalesRecord, Task y ManualKpiEntry.
+
+Uso:
+    python manage.py reconstruir_resumenes                     # todo el histórico
+    python manage.py reconstruir_resumenes --year 2026 --month 6
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.resumen_mensual import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los resúmenes mensuales por empleado desde los registros fuente."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Año a reconstruir (requiere --month)')
+        parser.add_argument('--month', type=int, help='Mes a reconstruir (requiere --year)')
+
+    def handle(self, *args, **options):
+        year, month = options['year'], options['month']
+        if bool(year) != bool(month):
+            raise CommandError("--year y --month van juntos.")
+
+        meses, filas = rebuild_summaries(year, month)
+        self.stdout.write(self.style.SUCCESS(
+            f"{filas} resúmenes reconstruidos en {meses} mes(es)."))
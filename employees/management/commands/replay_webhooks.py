@@ -0,0 +1,82 @@
+"""
+Reprocesa en masa webhooks de Dolibarr que quedaron en error, throttled o
+dead (por ejemplo tras una ráfaga que superó el límite de tasa o una caída).
+
+Uso:
+    python manage.py replay_webhooks                          # todos los reprocesables
+    python manage.py replay_webhooks --estado throttled --desde 2024-06-01
+    python manage.py replay_webhooks --instancia PROF-001 --trigger BILL_VALIDATE
+    python manage.py replay_webhooks --workers 4 --lote 1000
+    python manage.py replay_webhooks --confiar-encabezados    # logs previos a la cola
+
+Solo se reencolan los logs con instancia verificada por firma. Los guardados
+antes de que el webhook registrara la instancia se pueden recuperar con
+--confiar-encabezados, que la toma del encabezado X-Dolibarr-Professional-ID
+guardado (sin firma que la respalde: usar solo con logs de origen conocido).
+
+Los webhooks que ya estaban en cola en las mismas instancias se aplican
+antes que los reencolados (orden de llegada) y se informan aparte; las
+demás instancias no se drenan.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.cola_webhooks import (
+    ESTADOS_REPROCESABLES, TAM_LOTE_WEBHOOKS, reprocesables, reprocesar,
+)
+from employees.models import DolibarrInstance
+
+
+class Command(BaseCommand):
+    help = "Reencola y aplica webhooks de Dolibarr en error, throttled o dead."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estado', action='append', choices=ESTADOS_REPROCESABLES,
+                            help='Estado a reprocesar; repetible (default: todos)')
+        parser.add_argument('--instancia', help='professional_id de la instancia')
+        parser.add_argument('--trigger', help='trigger_code del evento (ej. BILL_VALIDATE; BATCH para los lotes)')
+        parser.add_argument('--desde', type=date.fromisoformat, help='Recibidos desde (AAAA-MM-DD)')
+        parser.add_argument('--hasta', type=date.fromisoformat, help='Recibidos hasta (AAAA-MM-DD)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Instancias drenadas en paralelo (default: 1; en SQLite siempre 1)')
+        parser.add_argument('--lote', type=int, default=TAM_LOTE_WEBHOOKS,
+                            help=f'Eventos por instancia y pasada (default: {TAM_LOTE_WEBHOOKS})')
+        parser.add_argument('--confiar-encabezados', action='store_true',
+                            help='Tomar la instancia del encabezado guardado si el log no la tiene')
+
+    def handle(self, *args, **options):
+        instance = None
+        if options['instancia']:
+            instance = DolibarrInstance.objects.filter(professional_id=options['instancia']).first()
+            if instance is None:
+                raise CommandError(f"No existe la instancia {options['instancia']!r}.")
+
+        logs = reprocesables(
+            estados=options['estado'] or ESTADOS_REPROCESABLES, instance=instance,
+            trigger_code=options['trigger'], desde=options['desde'], hasta=options['hasta'],
+        )
+
+        def progreso(hechos, total, segundos):
+            if options['verbosity'] > 0:
+                self.stdout.write(f"  {hechos}/{total} eventos ({hechos / max(segundos, 1e-6):.0f}/s)")
+
+        resultado = reprocesar(
+            logs, workers=options['workers'], tam_lote=options['lote'],
+            confiar_encabezados=options['confiar_encabezados'], progreso=progreso,
+        )
+        aplicados = sum(n for estado, n in resultado.items()
+                        if estado in ('processed', 'error', 'dead'))
+        resumen = ', '.join(f"{resultado[estado]} {estado}"
+                            for estado in ('processed', 'error', 'retry', 'dead', 'queued') if resultado.get(estado))
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['reencolados']} webhooks reencolados: {resumen or 'sin cambios'} "
+            f"en {resultado['segundos']:.1f} s ({aplicados / max(resultado['segundos'], 1e-6):.0f}/s)."))
+        if resultado['arrastrados']:
+            self.stdout.write(
+                f"{resultado['arrastrados']} webhooks que ya estaban en cola en esas instancias "
+                "se aplicaron antes (orden de llegada).")
+        if resultado['sin_instancia']:
+            self.stdout.write(self.style.WARNING(
+                f"{resultado['sin_instancia']} sin instancia verificada: no se reencolaron "
+                "(ver --confiar-encabezados)."))
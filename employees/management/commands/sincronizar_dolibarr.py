@@ -0,0 +1,56 @@
+"""
+Reconciliación por API de presupuestos, pedidos, facturas y pagos de
+Dolibarr contra SalesRecord (por si se perdieron webhooks).
+
+Uso:
+    python manage.py sincronizar_dolibarr                     # desde el último cursor (cron)
+    python manage.py sincronizar_dolibarr --instancia PROF1
+    python manage.py sincronizar_dolibarr --desde 2024-01-01  # relee desde esa fecha
+
+Requiere api_base_url y api_key en la instancia; el usuario del DOLAPIKEY
+necesita permiso de lectura de presupuestos, pedidos y facturas.
+"""
+from datetime import date, datetime, time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from employees.dolibarr_api import DolibarrApiError
+from employees.sincronizacion import instancias_con_api, sincronizar_instancia
+
+
+class Command(BaseCommand):
+    help = "Trae de la API de Dolibarr los cambios de ventas y los aplica con las reglas del webhook."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instancia', help='professional_id de la instancia (default: todas con API)')
+        parser.add_argument('--desde', type=date.fromisoformat,
+                            help='Ignorar el cursor y releer lo modificado desde esta fecha (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        instancias = instancias_con_api()
+        if options['instancia']:
+            instancias = instancias.filter(professional_id=options['instancia'])
+            if not instancias:
+                raise CommandError(f"No hay una instancia con API y professional_id {options['instancia']!r}.")
+        desde = None
+        if options['desde']:
+            desde = timezone.make_aware(datetime.combine(options['desde'], time.min))
+
+        fallidas = 0
+        for instance in instancias:
+            try:
+                resultado = sincronizar_instancia(instance, desde)
+            except (DolibarrApiError, httpx.HTTPError) as exc:
+                fallidas += 1
+                self.stdout.write(self.style.ERROR(f"{instance.name}: {exc}"))
+                continue
+            resumen = ', '.join(
+                f"{recurso} {r['leidos']} leídos/{r['aplicados']} aplicados"
+                + (f"/{r['errores']} rechazados" if r['errores'] else '')
+                for recurso, r in resultado.items())
+            pagos = sum(r['pagos'] for r in resultado.values())
+            self.stdout.write(self.style.SUCCESS(f"{instance.name}: {resumen}; {pagos} pagos."))
+        if fallidas:
+            raise CommandError(f"{fallidas} instancia(s) no se pudieron sincronizar.")
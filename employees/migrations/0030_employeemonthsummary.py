@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:19
+
+import datetime
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0029_dolibarrinstance_api_base_url_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeMonthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('hours_worked', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('overtime_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('proforma_count', models.PositiveIntegerField(default=0)),
+                ('proforma_invoice_count', models.PositiveIntegerField(default=0)),
+                ('confirmed_invoiced', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('confirmed_count', models.PositiveIntegerField(default=0)),
+                ('provisional_invoiced', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('provisional_count', models.PositiveIntegerField(default=0)),
+                ('credit_notes_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('credit_note_count', models.PositiveIntegerField(default=0)),
+                ('tasks_completed', models.PositiveIntegerField(default=0)),
+                ('tasks_completed_with_due_date', models.PositiveIntegerField(default=0)),
+                ('tasks_completed_on_time', models.PositiveIntegerField(default=0)),
+                ('tasks_completed_duration', models.DurationField(default=datetime.timedelta(0), help_text='Suma de (completed_at - created_at) de las tareas completadas.')),
+                ('manual_errors', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text="Suma de ManualKpiEntry de KPIs 'count_lt' (factor de calidad del IPAC).", max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_summaries', to='employees.employee')),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual',
+                'verbose_name_plural': 'Resúmenes mensuales',
+                'ordering': ['-year', '-month'],
+                'unique_together': {('employee', 'year', 'month')},
+            },
+        ),
+    ]
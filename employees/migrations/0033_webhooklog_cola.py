@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0032_feriado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooklog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='instance',
+            field=models.ForeignKey(blank=True, help_text='Instancia autenticada por HMAC.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='webhook_logs', to='employees.dolibarrinstance'),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(fields=['status', 'instance'], name='webhooklog_cola_idx'),
+        ),
+    ]
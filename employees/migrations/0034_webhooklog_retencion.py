@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+def copiar_campos(apps, schema_editor):
+    """Llena trigger_code y professional_id de los logs existentes (mismo
+    criterio que WebhookLog.save)."""
+    WebhookLog = apps.get_model('employees', 'WebhookLog')
+    lote = []
+    for log in WebhookLog.objects.only('payload', 'headers').iterator(chunk_size=2000):
+        payload = log.payload if isinstance(log.payload, dict) else {}
+        headers = log.headers if isinstance(log.headers, dict) else {}
+        codigo = 'BATCH' if 'events' in payload else payload.get('trigger_code')
+        log.trigger_code = str(codigo or '')[:64]
+        log.professional_id = str(headers.get('X-Dolibarr-Professional-Id') or '')[:64]
+        lote.append(log)
+        if len(lote) >= 2000:
+            WebhookLog.objects.bulk_update(lote, ['trigger_code', 'professional_id'])
+            lote = []
+    WebhookLog.objects.bulk_update(lote, ['trigger_code', 'professional_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0033_webhooklog_cola'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(help_text='Relativo a WEBHOOK_ARCHIVE_DIR.', max_length=255, unique=True)),
+                ('primer_id', models.BigIntegerField()),
+                ('ultimo_id', models.BigIntegerField()),
+                ('desde', models.DateTimeField(help_text='received_at del log más antiguo.')),
+                ('hasta', models.DateTimeField(help_text='received_at del log más reciente.')),
+                ('cantidad', models.PositiveIntegerField()),
+                ('bytes', models.PositiveBigIntegerField()),
+                ('professional_ids', models.JSONField(default=list)),
+                ('trigger_codes', models.JSONField(default=dict, help_text='{trigger_code: cantidad}')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['primer_id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='professional_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='trigger_code',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(fields=['received_at'], name='webhooklog_recibido_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookarchive',
+            index=models.Index(fields=['desde', 'hasta'], name='webhookarchive_fechas_idx'),
+        ),
+        migrations.RunPython(copiar_campos, migrations.RunPython.noop),
+    ]
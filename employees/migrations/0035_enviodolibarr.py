@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('employees', '0034_webhooklog_retencion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvioDolibarr',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_CURSO', 'En curso'), ('TERMINADO', 'Terminado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0, help_text='Recibos a enviar en este envío.')),
+                ('hechos', models.PositiveIntegerField(default=0)),
+                ('enviados', models.PositiveIntegerField(default=0)),
+                ('ya_sincronizados', models.PositiveIntegerField(default=0)),
+                ('sin_mapeo', models.PositiveIntegerField(default=0)),
+                ('con_error', models.PositiveIntegerField(default=0)),
+                ('detalle', models.TextField(blank=True, help_text='Empleados omitidos o error que detuvo el envío.')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('iniciado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Envío a Dolibarr',
+                'verbose_name_plural': 'Envíos a Dolibarr',
+                'ordering': ['-creado'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0035_enviodolibarr'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CursorDolibarr',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(help_text='proposals, orders o invoices', max_length=20)),
+                ('modificado_hasta', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('dolibarr_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cursores', to='employees.dolibarrinstance')),
+            ],
+            options={
+                'verbose_name': 'Cursor de sincronización Dolibarr',
+                'verbose_name_plural': 'Cursores de sincronización Dolibarr',
+                'unique_together': {('dolibarr_instance', 'recurso')},
+            },
+        ),
+    ]
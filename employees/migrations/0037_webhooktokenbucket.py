@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0036_cursordolibarr'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookTokenBucket',
+            fields=[
+                ('instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='webhook_bucket', serialize=False, to='employees.dolibarrinstance')),
+                ('tokens', models.FloatField()),
+                ('actualizado', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0037_webhooktokenbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEventoVisto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigger_code', models.CharField(max_length=64)),
+                ('object_id', models.CharField(max_length=64)),
+                ('payload_hash', models.CharField(max_length=64)),
+                ('visto', models.DateTimeField(db_index=True)),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eventos_vistos', to='employees.dolibarrinstance')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='webhookeventovisto',
+            constraint=models.UniqueConstraint(fields=('instance', 'trigger_code', 'object_id', 'payload_hash'), name='webhook_evento_visto_unico'),
+        ),
+    ]
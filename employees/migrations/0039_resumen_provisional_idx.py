@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0038_webhookeventovisto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employeemonthsummary',
+            index=models.Index(condition=models.Q(('provisional_count__gt', 0)), fields=['employee'], name='resumen_provisional_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:26
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0039_resumen_provisional_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='recurrence_byday',
+            field=models.CharField(blank=True, help_text='Días de la semana en formato RRULE (p. ej. MO,WE,FR). Vacío: el día de due_date.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='recurrence_interval',
+            field=models.PositiveSmallIntegerField(default=1, help_text="Cada cuántos periodos se repite (2 = cada dos semanas con 'weekly').", validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
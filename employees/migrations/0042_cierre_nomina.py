@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('employees', '0041_tablero_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreNomina',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_CURSO', 'En curso'), ('TERMINADO', 'Terminado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0, help_text='Empleados activos del período.')),
+                ('hechos', models.PositiveIntegerField(default=0)),
+                ('generados', models.PositiveIntegerField(default=0)),
+                ('omitidos', models.PositiveIntegerField(default=0)),
+                ('detalle', models.TextField(blank=True, help_text='Empleados omitidos o error que detuvo el cierre.')),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('iniciado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Cierre de nómina',
+                'verbose_name_plural': 'Cierres de nómina',
+                'ordering': ['-creado'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0042_cierre_nomina'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employeemonthsummary',
+            name='kpi_stats',
+            field=models.JSONField(blank=True, default=dict, help_text="Por KPI: tareas con vencimiento en el mes (due) y en 'Hecho' (done), completadas en el mes (completed) y suma de ManualKpiEntry (manual)."),
+        ),
+        migrations.AddField(
+            model_name='employeemonthsummary',
+            name='products_created',
+            field=models.PositiveIntegerField(default=0, help_text='Productos creados en el mes, sin los marcados como duplicado.'),
+        ),
+    ]
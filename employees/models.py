@@ -3,11 +3,14 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import date, timedelta
 from decimal import Decimal
-from django.db.models import F, Avg, Sum
+from django.db.models import Sum
 from django.db.models.functions import Coalesce
 import hashlib
 import hmac
 from django.utils import timezone
+import uuid
+
+from . import singletons
 
 class JobProfile(models.Model):
     """Defines a job role and the KPIs associated with it."""
@@ -39,6 +42,24 @@ class DolibarrInstance(models.Model):
         """True si la instancia tiene URL y clave para enviar nómina."""
         return bool(self.api_base_url and self.api_key)
 
+class CursorDolibarr(models.Model):
+    """Hasta dónde leyó sincronizar_dolibarr cada recurso de una instancia:
+    fecha de modificación (tms) del último objeto aplicado."""
+    dolibarr_instance = models.ForeignKey(DolibarrInstance, on_delete=models.CASCADE,
+                                          related_name='cursores')
+    recurso = models.CharField(max_length=20, help_text="proposals, orders o invoices")
+    modificado_hasta = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('dolibarr_instance', 'recurso')
+        verbose_name = "Cursor de sincronización Dolibarr"
+        verbose_name_plural = "Cursores de sincronización Dolibarr"
+
+    def __str__(self):
+        return f"{self.dolibarr_instance.name} / {self.recurso}: {self.modificado_hasta}"
+
+
 class DolibarrUserIdentity(models.Model):
     """Links a local Employee to a user in a specific Dolibarr instance."""
     employee = models.ForeignKey('Employee', on_delete=models.CASCADE, related_name='dolibarr_identities')
@@ -100,62 +121,12 @@ class Employee(models.Model):
         """
         Calculates the Quality-Adjusted Productivity Index (IPAC) for a given month.
         IPAC = (Completed Tasks * On-time Factor * Quality Factor) / Avg. Execution Time (in hours)
+
+        Computed with a single conditional-aggregate query (payroll.ipac_scores),
+        the same one the batch engine and the dashboard use.
         """
-        # 1. Get all tasks completed in the given month and year
-        completed_tasks = Task.objects.filter(
-            assigned_to=self,
-            completed_at__year=year,
-            completed_at__month=month
-        )
-        num_completed_tasks = completed_tasks.count()
-
-        if num_completed_tasks == 0:
-            return Decimal('0.00')
-
-        # 2. On-time Factor (considers tasks with a due date)
-        tasks_with_due_date = completed_tasks.exclude(due_date__isnull=True)
-        num_tasks_with_due_date = tasks_with_due_date.count()
-        if num_tasks_with_due_date > 0:
-            on_time_count = tasks_with_due_date.filter(completed_at__date__lte=F('due_date')).count()
-            on_time_factor = Decimal(on_time_count) / Decimal(num_tasks_with_due_date)
-        else:
-            on_time_factor = Decimal('1.0') # Assume 100% if no due dates are set
-
-        # 3. Quality Factor (based on manually logged errors)
-        # This assumes that any KPI measured as 'count_lt' (less is better) is an error-tracking KPI.
-        error_kpis = KPI.objects.filter(measurement_type='count_lt')
-        num_errors = ManualKpiEntry.objects.filter(
-            employee=self,
-            kpi__in=error_kpis,
-            date__year=year,
-            date__month=month
-        ).aggregate(total_errors=Coalesce(Sum('value'), Decimal('0')))['total_errors']
-
-        error_rate = Decimal(num_errors) / Decimal(num_completed_tasks)
-        quality_factor = max(Decimal('0.0'), Decimal('1.0') - error_rate)
-
-        # 4. Average Execution Time (in hours)
-        avg_duration = completed_tasks.aggregate(
-            avg_duration=Avg(F('completed_at') - F('created_at'))
-        )['avg_duration']
-
-        if not avg_duration:
-            avg_duration = timedelta(hours=1) # Fallback to 1 hour to prevent errors
-
-        avg_execution_hours = Decimal(avg_duration.total_seconds()) / Decimal('3600')
-
-        # Prevent division by zero or extremely small denominators
-        MIN_AVG_HOURS = Decimal('0.01') # ~36 seconds
-        if avg_execution_hours < MIN_AVG_HOURS:
-            avg_execution_hours = MIN_AVG_HOURS
-
-        # 5. Final IPAC Calculation
-        # The formula provided is: (Tareas Completadas × Puntualidad % × (100% - % Errores)) / Tiempo Promedio
-        # To make the scale reasonable, we use factors (0-1) and the raw number of tasks.
-        numerator = Decimal(num_completed_tasks) * on_time_factor * quality_factor
-        ipac_score = numerator / avg_execution_hours
-
-        return ipac_score.quantize(Decimal('0.01'))
+        from .payroll import ipac_scores
+        return ipac_scores(year, month, [self.pk])[self.pk]
 
     def calculate_commissions(self, year, month):
         """
@@ -169,308 +140,44 @@ class Employee(models.Model):
           not the user who issued the credit note.
 
         Commission = confirmed_net * commission_percentage / 100
+
+        Implemented in payroll.PayrollBatch, shared with the batch engine.
+        Totals come from the EmployeeMonthSummary ledger (one row for the
+        month plus the months with unpaid invoices) instead of aggregating
+        the SalesRecord history, the same source calculate_salary and the
+        month close use.
+        Commits the advanced CommissionBalance; use PayrollBatch directly for
+        a side-effect-free simulation.
         """
-        zero = Decimal('0.00')
-        pct = self.commission_percentage
-
-        if pct <= 0:
-            return {
-                'commission_amount': zero,
-                'confirmed_invoiced': zero,
-                'confirmed_count': 0,
-                'provisional_invoiced': zero,
-                'provisional_count': 0,
-                'credit_notes_amount': zero,
-                'credit_note_count': 0,
-                'net_confirmed': zero,
-                'commission_percentage': zero,
-            }
-
-        my_sales = self.sales_records
-
-        # Confirmed: invoices paid this month
-        confirmed = my_sales.filter(
-            status='invoiced',
-            payment_date__year=year,
-            payment_date__month=month,
-        )
-        confirmed_invoiced = confirmed.aggregate(
-            total=Sum('amount_untaxed')
-        )['total'] or zero
-
-        # Provisional: invoices not yet paid (all months, still pending)
-        provisional = my_sales.filter(
-            status='invoiced',
-            payment_date__isnull=True,
-        )
-        provisional_invoiced = provisional.aggregate(
-            total=Sum('amount_untaxed')
-        )['total'] or zero
-
-        # Negative: credit notes in this month (already stored as negative)
-        credit_notes = my_sales.filter(
-            status='credit_note',
-            date__year=year,
-            date__month=month,
-        )
-        credit_notes_amount = credit_notes.aggregate(
-            total=Sum('amount_untaxed')
-        )['total'] or zero  # negative value
-
-        # Net confirmed = paid invoices + credit notes (credit notes are negative)
-        net_confirmed = confirmed_invoiced + credit_notes_amount
-
-        # Raw commission before clawback
-        raw_commission = (net_confirmed * pct / Decimal('100')).quantize(Decimal('0.01'))
-
-        # Apply clawback: use running balance to recover past debts
-        bal, _ = CommissionBalance.objects.get_or_create(employee=self)
-
-        last_computed = (bal.last_computed_year, bal.last_computed_month)
-        requested = (year, month)
-
-        if requested == last_computed:
-            # Same month recalculation (new invoices arrived): use pre-month snapshot
-            carry_forward = bal.pre_month_balance
-            adjusted = raw_commission + carry_forward
-            commission_amount = max(zero, adjusted)
-            remaining_debt = min(zero, adjusted)
-            bal.balance = remaining_debt
-            bal.save()
-        elif requested > last_computed:
-            # New month (forward): snapshot and advance
-            carry_forward = bal.balance
-            bal.pre_month_balance = bal.balance
-            adjusted = raw_commission + carry_forward
-            commission_amount = max(zero, adjusted)
-            remaining_debt = min(zero, adjusted)
-            bal.balance = remaining_debt
-            bal.last_computed_year = year
-            bal.last_computed_month = month
-            bal.save()
-        else:
-            # Past month query: read-only, do NOT modify balance
-            carry_forward = zero
-            commission_amount = max(zero, raw_commission)
-            remaining_debt = zero
-
-        return {
-            'commission_amount': commission_amount,
-            'raw_commission': raw_commission,
-            'carry_forward_applied': carry_forward,
-            'remaining_debt': remaining_debt,
-            'confirmed_invoiced': confirmed_invoiced,
-            'confirmed_count': confirmed.count(),
-            'provisional_invoiced': provisional_invoiced,
-            'provisional_count': provisional.count(),
-            'credit_notes_amount': abs(credit_notes_amount),
-            'credit_note_count': credit_notes.count(),
-            'net_confirmed': net_confirmed,
-            'commission_percentage': pct,
-        }
+        from .payroll import PayrollBatch
+        batch = PayrollBatch(year, month, [self])
+        result = batch.commissions()[self.pk]
+        batch.commit()
+        return result
 
     def calculate_performance_bonus(self, year, month):
         """
         Calculates the total performance bonus for a given employee, year, and month.
         It also creates EmployeePerformanceRecord entries for each KPI.
+        Implemented in payroll.PayrollBatch, shared with the batch engine.
         """
-        total_bonus = Decimal('0.00')
-        
-        # Determine eligible KPIs based on profile
-        # Employees without a profile assigned get NO KPIs evaluated (no bonuses)
-        if not self.profile:
-            return Decimal('0.00')
-        eligible_kpis = self.profile.kpis.all()
-
-        # Use the last day of the month for the record date
-        import calendar
-        last_day = calendar.monthrange(year, month)[1]
-        record_date = date(year, month, last_day)
-
-        for kpi in eligible_kpis:
-            target_met = False
-            actual_value = 0
-
-            # --- Evaluate KPI based on internal_code or measurement_type ---
-            
-            if kpi.internal_code == 'SALES_EFFECTIVENESS':
-                # (Invoices with proforma / Total proformas) * 100
-                # Only counts proforma→invoice flow, not direct orders
-                sales_records = self.sales_records.filter(
-                    date__year=year,
-                    date__month=month
-                )
-                total_proformas = sales_records.filter(status='proforma').count()
-
-                if total_proformas >= kpi.min_volume_threshold and total_proformas > 0:
-                    invoices_count = sales_records.filter(
-                        status='invoiced',
-                        origin_proforma_id__isnull=False
-                    ).count()
-                    actual_value = (Decimal(invoices_count) / Decimal(total_proformas)) * 100
-                else:
-                    actual_value = 0
-
-            elif kpi.internal_code == 'PRODUCT_CREATION':
-                # Count unique products created this month, excluding duplicates
-                actual_value = ProductCreationLog.objects.filter(
-                    employee=self,
-                    created_at__year=year,
-                    created_at__month=month,
-                    is_suspect_duplicate=False,
-                ).count()
-
-            elif kpi.measurement_type == 'percentage':
-                # e.g., "Productividad General"
-                tasks = Task.objects.filter(assigned_to=self, kpi=kpi, due_date__year=year, due_date__month=month)
-                total_tasks = tasks.count()
-                if total_tasks > 0:
-                    completed_tasks = tasks.filter(completed_at__isnull=False, list__name__iexact="Hecho").count()
-                    actual_value = (completed_tasks / total_tasks) * 100
-                else:
-                    # If no tasks assigned, is it 100% or 0%? Defaulting to 0 effectively or handling elsewhere.
-                    actual_value = 0
-
-            elif kpi.measurement_type == 'count_lt':
-                # e.g., "Calidad Administrativa" (fewer than X errors)
-                # No entries = 0 errors = target met (employee is perfect)
-                entries = ManualKpiEntry.objects.filter(employee=self, kpi=kpi, date__year=year, date__month=month)
-                actual_value = sum(entry.value for entry in entries)
-
-            elif kpi.measurement_type == 'count_gt':
-                # e.g., "Gestión Comercial Pública" (more than X offers)
-                actual_value = Task.objects.filter(
-                    assigned_to=self,
-                    kpi=kpi,
-                    completed_at__year=year,
-                    completed_at__month=month
-                ).count()
-
-            elif kpi.measurement_type == 'composite_ipac':
-                # This KPI is calculated by its own complex method
-                actual_value = self.calculate_ipac(year, month)
-
-            # --- Check Target and Bonus ---
-            
-            bonus_amount_for_kpi = Decimal('0.00')
-
-            # 1. Check Standard Target using BonusRule
-            if kpi.measurement_type == 'count_lt':
-                if actual_value < kpi.target_value:
-                    target_met = True
-            else:
-                if actual_value >= kpi.target_value:
-                    target_met = True
-
-            rule = BonusRule.objects.filter(kpi=kpi).first()
-            if rule and target_met:
-                bonus_amount_for_kpi = rule.bonus_amount
-
-            # 2. Check Tiered Bonuses (Overrides standard if higher)
-            # For count_lt ("fewer is better") a tier is reached when the value
-            # is at or below the threshold; otherwise when it is at or above.
-            for tier in kpi.tiers.all():
-                if kpi.measurement_type == 'count_lt':
-                    tier_reached = actual_value <= tier.threshold
-                else:
-                    tier_reached = actual_value >= tier.threshold
-                if tier_reached and tier.bonus_amount > bonus_amount_for_kpi:
-                    bonus_amount_for_kpi = tier.bonus_amount
-                    target_met = True
-
-            total_bonus += bonus_amount_for_kpi
-
-            EmployeePerformanceRecord.objects.update_or_create(
-                employee=self,
-                kpi=kpi,
-                date=record_date,
-                defaults={
-                    'actual_value': actual_value,
-                    'target_met': target_met,
-                    'bonus_awarded': bonus_amount_for_kpi
-                }
-            )
-
-        return total_bonus
+        from .payroll import PayrollBatch
+        batch = PayrollBatch(year, month, [self])
+        total = batch.performance_bonuses()[self.pk]
+        batch.commit()
+        return total
 
     def calculate_salary(self, year, month):
         """
         Calculates the final salary for a given month and year, including base pay,
         overtime, and performance bonus.
-        Returns a dictionary with a detailed breakdown of the salary.
+        Returns a dictionary with a detailed breakdown of the salary, or None
+        if the employee has no salary effective for that month.
+        Commits performance records and commission balances (month close);
+        see payroll.calculate_salaries for the batch and simulation forms.
         """
-        # Find the salary effective on the first day of the target month
-        target_date = date(year, month, 1)
-        salary_record = self.salaries.filter(
-            effective_date__lte=target_date
-        ).first()  # ordered by -effective_date, so first() = most recent
-        if not salary_record:
-            return None
-        base_salary = salary_record.base_amount
-
-        # 1. Calculate pay from worked hours and overtime
-        work_logs = WorkLog.objects.filter(employee=self, date__year=year, date__month=month)
-        total_hours_worked = sum(log.hours_worked for log in work_logs)
-        total_overtime_hours = sum(log.overtime_hours for log in work_logs)
-
-        # Load company settings to determine the basis for salary calculation
-        settings = CompanySettings.load()
-        monthly_hours = Decimal('0.00')
-        work_days_in_month = 0
-
-        if settings.calculation_basis == 'monthly':
-            monthly_hours = settings.base_hours
-        elif settings.calculation_basis == 'weekly':
-            # Approximate monthly hours by multiplying by the average number of weeks in a month
-            monthly_hours = settings.base_hours * Decimal('4.333')
-        elif settings.calculation_basis == 'daily':
-            # Calculate the number of working days (Mon-Fri) in the given month and year
-            import calendar
-            cal = calendar.Calendar()
-            for day in cal.itermonthdays2(year, month):
-                if day[0] != 0 and day[1] < 5: # day[1] is the weekday (0=Mon, 6=Sun)
-                    work_days_in_month += 1
-            monthly_hours = settings.base_hours * Decimal(work_days_in_month)
-
-        if monthly_hours <= 0:
-             # Fallback to a default if hours are not set, to avoid division by zero
-            monthly_hours = Decimal('160')
-
-        hourly_rate = base_salary / monthly_hours
-        overtime_rate = hourly_rate * Decimal(1.5)
-
-        work_pay = total_hours_worked * hourly_rate
-        overtime_pay = total_overtime_hours * overtime_rate
-
-        # 2. Calculate performance bonus
-        performance_bonus = self.calculate_performance_bonus(year, month)
-
-        # 3. Calculate sales commissions
-        commissions = self.calculate_commissions(year, month)
-        commission_amount = commissions['commission_amount']
-
-        # 4. Calculate final total salary
-        total_salary = work_pay + overtime_pay + performance_bonus + commission_amount
-
-        # 5. Return a detailed dictionary
-        result = {
-            'base_salary': base_salary,
-            'work_pay': work_pay,
-            'overtime_pay': overtime_pay,
-            'performance_bonus': performance_bonus,
-            'commission_amount': commission_amount,
-            'total_salary': total_salary,
-            'total_hours_worked': total_hours_worked,
-            'total_overtime_hours': total_overtime_hours,
-            'hourly_rate': hourly_rate,
-            'overtime_rate': overtime_rate,
-            'calculation_basis': settings.calculation_basis,
-            'base_hours': settings.base_hours,
-            'monthly_hours': monthly_hours,
-            'work_days_in_month': work_days_in_month,
-        }
-        result.update(commissions)
-        return result
+        from .payroll import calculate_salaries
+        return calculate_salaries(year, month, [self], commit=True)[self.pk]
 
 class Salary(models.Model):
     """Represents a salary record for an employee with date-based history."""
@@ -505,15 +212,26 @@ class WorkLog(models.Model):
         return f"{self.employee.name} on {self.date}"
 
 
+class Feriado(models.Model):
+    """Día no laborable (feriado nacional o local). No cuenta como día hábil
+    en ausencias ni en las horas base de la nómina (ver calendario.py)."""
+    fecha = models.DateField(unique=True)
+    nombre = models.CharField(max_length=100)
+
+    class Meta:
+        ordering = ['fecha']
+        verbose_name = "Feriado"
+        verbose_name_plural = "Feriados"
+
+    def __str__(self):
+        return f"{self.fecha:%Y-%m-%d} {self.nombre}"
+
+
 def contar_dias_habiles(inicio, fin):
-    """Días lunes-viernes en el rango [inicio, fin], ambos inclusive."""
-    dias = 0
-    dia = inicio
-    while dia <= fin:
-        if dia.weekday() < 5:
-            dias += 1
-        dia += timedelta(days=1)
-    return dias
+    """Días hábiles (lunes a viernes, sin feriados) en el rango [inicio, fin],
+    ambos inclusive."""
+    from .calendario import business_calendar
+    return business_calendar().count(inicio, fin)
 
 
 class TipoAusencia(models.Model):
@@ -613,6 +331,74 @@ class ReciboNomina(models.Model):
     def __str__(self):
         return f"Recibo {self.employee.name} {self.year}-{self.month:02d} (${self.total})"
 
+
+class EnvioDolibarr(models.Model):
+    """Envío en segundo plano de los recibos de un período a Dolibarr
+    (nomina.iniciar_envio_dolibarr). La pantalla de nómina consulta su
+    avance mientras corre."""
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_CURSO', 'En curso'),
+        ('TERMINADO', 'Terminado'),
+        ('FALLIDO', 'Fallido'),
+    ]
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='PENDIENTE')
+    total = models.PositiveIntegerField(default=0, help_text="Recibos a enviar en este envío.")
+    hechos = models.PositiveIntegerField(default=0)
+    enviados = models.PositiveIntegerField(default=0)
+    ya_sincronizados = models.PositiveIntegerField(default=0)
+    sin_mapeo = models.PositiveIntegerField(default=0)
+    con_error = models.PositiveIntegerField(default=0)
+    detalle = models.TextField(blank=True, help_text="Empleados omitidos o error que detuvo el envío.")
+    iniciado_por = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-creado']
+        verbose_name = "Envío a Dolibarr"
+        verbose_name_plural = "Envíos a Dolibarr"
+
+    def __str__(self):
+        return f"Envío {self.year}-{self.month:02d} a Dolibarr ({self.get_estado_display()})"
+
+    @property
+    def activo(self):
+        return self.estado in ('PENDIENTE', 'EN_CURSO')
+
+class CierreNomina(models.Model):
+    """Cierre de mes en segundo plano (nomina.iniciar_cierre_mes): genera los
+    recibos del período fuera de la petición. La pantalla de nómina consulta
+    su avance mientras corre."""
+    ESTADO_CHOICES = EnvioDolibarr.ESTADO_CHOICES
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='PENDIENTE')
+    total = models.PositiveIntegerField(default=0, help_text="Empleados activos del período.")
+    hechos = models.PositiveIntegerField(default=0)
+    generados = models.PositiveIntegerField(default=0)
+    omitidos = models.PositiveIntegerField(default=0)
+    detalle = models.TextField(blank=True, help_text="Empleados omitidos o error que detuvo el cierre.")
+    iniciado_por = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-creado']
+        verbose_name = "Cierre de nómina"
+        verbose_name_plural = "Cierres de nómina"
+
+    def __str__(self):
+        return f"Cierre {self.year}-{self.month:02d} ({self.get_estado_display()})"
+
+    @property
+    def activo(self):
+        return self.estado in ('PENDIENTE', 'EN_CURSO')
+
 class SalesRecord(models.Model):
     """Tracks a sales event synced from Dolibarr."""
     STATUS_CHOICES = [
@@ -677,18 +463,166 @@ class CommissionBalance(models.Model):
         return f"{self.employee.name}: ${self.balance}"
 
 
+class EmployeeMonthSummary(models.Model):
+    """Agregados mensuales de un empleado mantenidos incrementalmente.
+
+    Cada cambio en WorkLog, SalesRecord, Task, ManualKpiEntry o
+    ProductCreationLog recalcula solo los meses del empleado afectados (ver
+    resumen_mensual.py), así las pantallas de salario leen una fila (con los
+    contadores por KPI de los bonos) en vez de agregar el histórico.
+    Las ventas facturadas sin pago (provisionales) se imputan al mes de la
+    factura. Es también el libro de comisiones: la nómina (pantallas,
+    calculate_commissions y cierre de mes) lee confirmadas, provisionales y
+    notas de crédito de aquí, y el webhook lo
+    actualiza en la misma transacción que la venta.
+    `manage.py reconstruir_resumenes` la regenera desde cero."""
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='month_summaries')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+
+    hours_worked = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    overtime_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+
+    proforma_count = models.PositiveIntegerField(default=0)
+    proforma_invoice_count = models.PositiveIntegerField(default=0)
+    confirmed_invoiced = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    confirmed_count = models.PositiveIntegerField(default=0)
+    provisional_invoiced = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    provisional_count = models.PositiveIntegerField(default=0)
+    credit_notes_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    credit_note_count = models.PositiveIntegerField(default=0)
+
+    tasks_completed = models.PositiveIntegerField(default=0)
+    tasks_completed_with_due_date = models.PositiveIntegerField(default=0)
+    tasks_completed_on_time = models.PositiveIntegerField(default=0)
+    tasks_completed_duration = models.DurationField(
+        default=timedelta(0), help_text="Suma de (completed_at - created_at) de las tareas completadas.")
+    manual_errors = models.DecimalField(
+        max_digits=10, decimal_places=2, default=Decimal('0.00'),
+        help_text="Suma de ManualKpiEntry de KPIs 'count_lt' (factor de calidad del IPAC).")
+    kpi_stats = models.JSONField(
+        default=dict, blank=True,
+        help_text="Por KPI: tareas con vencimiento en el mes (due) y en 'Hecho' (done), "
+                  "completadas en el mes (completed) y suma de ManualKpiEntry (manual).")
+    products_created = models.PositiveIntegerField(
+        default=0, help_text="Productos creados en el mes, sin los marcados como duplicado.")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('employee', 'year', 'month')
+        ordering = ['-year', '-month']
+        indexes = [
+            # Provisionales de un empleado: solo los meses con facturas impagas.
+            models.Index(fields=['employee'], condition=models.Q(provisional_count__gt=0),
+                         name='resumen_provisional_idx'),
+        ]
+        verbose_name = "Resumen mensual"
+        verbose_name_plural = "Resúmenes mensuales"
+
+    def __str__(self):
+        return f"Resumen {self.employee.name} {self.year}-{self.month:02d}"
+
+
 class WebhookLog(models.Model):
-    """Raw log of incoming webhooks for audit and debugging."""
+    """Raw log of incoming webhooks for audit and debugging.
+
+    With DOLIBARR_WEBHOOK_ASYNC the log is also the ingest queue: verified
+    events are stored as 'queued' and `procesar_webhooks` drains them
+    (cola_webhooks.py)."""
     received_at = models.DateTimeField(auto_now_add=True)
     sender_ip = models.GenericIPAddressField(null=True, blank=True)
     payload = models.JSONField(default=dict)
     headers = models.JSONField(default=dict)
-    status = models.CharField(max_length=20, default='pending') # pending, processed, error
+    # pending, processed, error, throttled; en modo asíncrono también
+    # queued, retry (con next_attempt_at) y dead (agotó los reintentos)
+    status = models.CharField(max_length=20, default='pending')
     error_message = models.TextField(blank=True)
+    instance = models.ForeignKey(
+        DolibarrInstance, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='webhook_logs', help_text="Instancia autenticada por HMAC.")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Copiados del payload y los headers al guardar, para filtrar sin leer el
+    # JSON (y poder compactar los headers). 'BATCH' = endpoint por lotes.
+    trigger_code = models.CharField(max_length=64, blank=True, db_index=True)
+    professional_id = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'instance'], name='webhooklog_cola_idx'),
+            models.Index(fields=['received_at'], name='webhooklog_recibido_idx'),
+        ]
 
     def __str__(self):
         return f"Webhook {self.id} at {self.received_at} ({self.status})"
 
+    def save(self, *args, **kwargs):
+        if not self.trigger_code and isinstance(self.payload, dict):
+            codigo = 'BATCH' if 'events' in self.payload else self.payload.get('trigger_code')
+            self.trigger_code = str(codigo or '')[:64]
+        if not self.professional_id and isinstance(self.headers, dict):
+            self.professional_id = str(self.headers.get('X-Dolibarr-Professional-Id') or '')[:64]
+        super().save(*args, **kwargs)
+
+
+class WebhookEventoVisto(models.Model):
+    """Evento de webhook ya aplicado, para reconocer reenvíos idénticos sin
+    tocar las ventas (idempotencia_webhooks.py). `visto` se renueva con cada
+    reenvío: la entrada vence tras WEBHOOK_IDEMPOTENCIA_HORAS sin verlo."""
+    instance = models.ForeignKey(DolibarrInstance, on_delete=models.CASCADE,
+                                 related_name='eventos_vistos')
+    trigger_code = models.CharField(max_length=64)
+    object_id = models.CharField(max_length=64)
+    payload_hash = models.CharField(max_length=64)
+    visto = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['instance', 'trigger_code', 'object_id', 'payload_hash'],
+                name='webhook_evento_visto_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.trigger_code} #{self.object_id} ({self.instance_id})"
+
+
+class WebhookTokenBucket(models.Model):
+    """Cubeta de tokens del webhook de una instancia, compartida por todos
+    los workers (limite_webhooks.py). `actualizado` es epoch en segundos."""
+    instance = models.OneToOneField(DolibarrInstance, on_delete=models.CASCADE,
+                                    primary_key=True, related_name='webhook_bucket')
+    tokens = models.FloatField()
+    actualizado = models.FloatField()
+
+    def __str__(self):
+        return f"{self.instance_id}: {self.tokens:.1f} tokens"
+
+
+class WebhookArchive(models.Model):
+    """Índice de los archivos JSONL comprimidos con WebhookLogs archivados
+    (archivo_webhooks.py): qué rango de ids y fechas guarda cada uno."""
+    archivo = models.CharField(max_length=255, unique=True,
+                               help_text="Relativo a WEBHOOK_ARCHIVE_DIR.")
+    primer_id = models.BigIntegerField()
+    ultimo_id = models.BigIntegerField()
+    desde = models.DateTimeField(help_text="received_at del log más antiguo.")
+    hasta = models.DateTimeField(help_text="received_at del log más reciente.")
+    cantidad = models.PositiveIntegerField()
+    bytes = models.PositiveBigIntegerField()
+    professional_ids = models.JSONField(default=list)
+    trigger_codes = models.JSONField(default=dict, help_text="{trigger_code: cantidad}")
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['primer_id']
+        indexes = [models.Index(fields=['desde', 'hasta'], name='webhookarchive_fechas_idx')]
+
+    def __str__(self):
+        return f"{self.archivo} ({self.cantidad} webhooks)"
+
 
 # --- Trello-like & Performance Management Models ---
 
@@ -796,6 +730,7 @@ class Task(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     completed_by_manager = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # delta sync (cambios_tablero.py)
     reminder_sent_at = models.DateTimeField(
         null=True, blank=True,
         help_text="Último aviso por email de vencimiento (idempotencia del cron diario).")
@@ -804,6 +739,12 @@ class Task(models.Model):
     is_recurring = models.BooleanField(default=False)
     recurrence_frequency = models.CharField(max_length=10, choices=RECURRENCE_CHOICES, null=True, blank=True)
     recurrence_end_date = models.DateField(null=True, blank=True)
+    recurrence_interval = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1)],
+        help_text="Cada cuántos periodos se repite (2 = cada dos semanas con 'weekly').")
+    recurrence_byday = models.CharField(
+        max_length=20, blank=True,
+        help_text="Días de la semana en formato RRULE (p. ej. MO,WE,FR). Vacío: el día de due_date.")
 
     # For tracking the chain of recurring tasks
     parent_task = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children')
@@ -819,6 +760,7 @@ class Checklist(models.Model):
     """A checklist within a task."""
     task = models.ForeignKey(Task, related_name='checklists', on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
@@ -828,6 +770,7 @@ class ChecklistItem(models.Model):
     checklist = models.ForeignKey(Checklist, related_name='items', on_delete=models.CASCADE)
     text = models.CharField(max_length=255)
     is_completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.text
@@ -838,10 +781,33 @@ class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.task.title}"
 
+
+class TaskTombstone(models.Model):
+    """A deleted task, checklist, checklist item or comment, so the board's
+    delta sync (GET /api/tasks/changes/) can tell clients to drop it.
+    Children removed together with their task or checklist get no
+    tombstone of their own: the parent's covers them."""
+    KIND_CHOICES = [
+        ('task', 'Task'),
+        ('checklist', 'Checklist'),
+        ('item', 'Checklist item'),
+        ('comment', 'Comment'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    task_id = models.PositiveIntegerField(null=True, blank=True)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='+')
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
 class EmployeePerformanceRecord(models.Model):
     """A record of an employee's performance for a specific KPI in a given month."""
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
@@ -897,12 +863,13 @@ class CompanySettings(models.Model):
         # Enforce a single instance of settings
         self.pk = 1
         super(CompanySettings, self).save(*args, **kwargs)
+        singletons.invalidate(CompanySettings)
 
     @classmethod
     def load(cls):
-        # Convenience method to get the single settings object
-        obj, created = cls.objects.get_or_create(pk=1)
-        return obj
+        # Convenience method to get the single settings object (cached per
+        # process, see singletons.py)
+        return singletons.load(cls)
 
 class SiteConfiguration(models.Model):
     """Singleton model to store site-wide configuration, like the favicon."""
@@ -915,9 +882,37 @@ class SiteConfiguration(models.Model):
         # Enforce a single instance of settings
         self.pk = 1
         super(SiteConfiguration, self).save(*args, **kwargs)
+        singletons.invalidate(SiteConfiguration)
 
     @classmethod
     def load(cls):
-        # Convenience method to get the single settings object
-        obj, created = cls.objects.get_or_create(pk=1)
-        return obj
+        # Convenience method to get the single settings object (cached per
+        # process, see singletons.py)
+        return singletons.load(cls)
+
+
+class CacheVersion(models.Model):
+    """Marca de versión compartida entre procesos para cachés en memoria.
+
+    Cada worker guarda junto a su caché el token con el que la construyó; si
+    el token de la base cambió (otro proceso invalidó), la reconstruye. Los
+    tokens son aleatorios, no contadores, para que un rollback no pueda
+    devolver un valor ya visto."""
+    name = models.CharField(max_length=100, unique=True)
+    token = models.CharField(max_length=32, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.token}"
+
+    @classmethod
+    def current(cls, name):
+        """Token vigente ('' si nunca se invalidó)."""
+        return cls.objects.filter(name=name).values_list('token', flat=True).first() or ''
+
+    @classmethod
+    def bump(cls, name):
+        """Invalida las cachés asociadas a `name` en todos los procesos."""
+        token = uuid.uuid4().hex
+        cls.objects.update_or_create(name=name, defaults={'token': token})
+        return token
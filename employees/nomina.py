@@ -4,20 +4,41 @@ Cierre de mes: generación de recibos de nómina (snapshots inmutables).
 El recibo congela el desglose de calculate_salary en JSON. El PDF y la
 planilla de meses cerrados se construyen SIEMPRE desde ese JSON, nunca
 recalculando, para que el histórico no cambie al cambiar reglas.
+
+El cierre y el envío de los recibos a Dolibarr corren en segundo plano desde
+la pantalla de nómina (CierreNomina, EnvioDolibarr), o con
+`generar_recibos` y `enviar_nomina_dolibarr`.
 """
 import logging
-from datetime import date
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from datetime import timedelta
 from decimal import Decimal
 
 import httpx
-from django.db.models import Q
+from django.conf import settings
+from django.db import connection, connections, transaction
 from django.utils import timezone
 
+from . import dolibarr_api
 from .dolibarr_api import DolibarrApiError, crear_salario
-from .models import DolibarrInstance, Employee, ReciboNomina
+from .models import (
+    CierreNomina, DolibarrInstance, DolibarrUserIdentity, EnvioDolibarr, ReciboNomina,
+)
+from .payroll import active_employees, calculate_salaries
 
 logger = logging.getLogger(__name__)
 
+# Empleados por transacción en el cierre de mes.
+TAM_LOTE_CIERRE = 50
+
+# Un cierre o envío sin avance en este lapso se da por muerto (p. ej. reinicio
+# del worker).
+ENVIO_VENCIDO = timedelta(minutes=10)
+
 
 def _jsonable(value):
     """Convierte el dict de calculate_salary a algo serializable en JSON.
@@ -48,43 +69,193 @@ def generar_recibo(employee, year, month, generado_por=None):
     return recibo
 
 
-def generar_recibos_mes(year, month, generado_por=None):
+def _lotes(items, tam_lote):
+    for inicio in range(0, len(items), tam_lote):
+        yield items[inicio:inicio + tam_lote]
+
+
+def _cerrar_lote(employees, year, month, generado_por):
+    """Calcula y guarda los recibos de un lote en UNA transacción: o quedan
+    todos los snapshots del lote (con sus bonos y saldos de comisión) o
+    ninguno. Devuelve (recibos, omitidos)."""
+    with transaction.atomic():
+        salarios = calculate_salaries(year, month, employees, commit=True)
+        nuevos, omitidos = [], []
+        for employee in employees:
+            salary = salarios[employee.pk]
+            if salary is None:
+                omitidos.append(employee)
+                continue
+            nuevos.append(ReciboNomina(
+                employee=employee, year=year, month=month,
+                datos=_jsonable(salary), total=salary['total_salary'],
+                generado_por=generado_por,
+            ))
+        if nuevos:
+            # Regenerar el mes actualiza el snapshot existente (conserva generado_en)
+            ReciboNomina.objects.bulk_create(
+                nuevos, update_conflicts=True,
+                unique_fields=['employee', 'year', 'month'],
+                update_fields=['datos', 'total', 'generado_por'],
+            )
+        recibos = ReciboNomina.objects.filter(
+            year=year, month=month, employee__in=[r.employee for r in nuevos],
+        ).select_related('employee').order_by('employee__name')
+        return list(recibos), omitidos
+
+
+def _cerrar_lote_en_hilo(*args):
+    """Cada hilo del pool abre su propia conexión: se cierra al terminar."""
+    try:
+        return _cerrar_lote(*args)
+    finally:
+        connections.close_all()
+
+
+def generar_recibos_mes(year, month, generado_por=None, workers=1,
+                        tam_lote=TAM_LOTE_CIERRE, progreso=None):
     """Genera recibos para todos los empleados activos en el mes objetivo.
-    Devuelve (generados, omitidos): omitidos = sin salario configurado."""
-    ultimo_dia = date(year, month, 1)
-    activos = Employee.objects.filter(
-        Q(end_date__isnull=True) | Q(end_date__gte=ultimo_dia)
-    ).order_by('name')
+    Devuelve (generados, omitidos): omitidos = sin salario configurado.
+
+    Los empleados se parten en lotes de `tam_lote`; cada lote se calcula con
+    el motor de nómina por lotes y se guarda con un upsert masivo en su propia
+    transacción. Con workers > 1 los lotes corren en un pool de hilos (cada
+    uno con su conexión); en SQLite se ignora porque la base serializa las
+    escrituras y bloquea en vez de esperar. `progreso(hechos, total)` se llama
+    al terminar cada lote, con hechos = empleados procesados hasta ese momento."""
+    if workers > 1 and connection.vendor == 'sqlite':
+        workers = 1
+    activos = list(active_employees(year, month))
+    lotes = list(_lotes(activos, max(1, tam_lote)))
+    resultados = [None] * len(lotes)
+    hechos = 0
+
+    if workers <= 1:
+        for idx, lote in enumerate(lotes):
+            resultados[idx] = _cerrar_lote(lote, year, month, generado_por)
+            hechos += len(lote)
+            if progreso:
+                progreso(hechos, len(activos))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futuros = {
+                pool.submit(_cerrar_lote_en_hilo, lote, year, month, generado_por): idx
+                for idx, lote in enumerate(lotes)
+            }
+            for futuro in as_completed(futuros):
+                idx = futuros[futuro]
+                resultados[idx] = futuro.result()
+                hechos += len(lotes[idx])
+                if progreso:
+                    progreso(hechos, len(activos))
 
     generados, omitidos = [], []
-    for employee in activos:
-        recibo = generar_recibo(employee, year, month, generado_por=generado_por)
-        if recibo is None:
-            omitidos.append(employee)
-            logger.warning("Recibo omitido para %s (%s-%02d): sin salario configurado",
-                           employee.name, year, month)
-        else:
-            generados.append(recibo)
+    for recibos, sin_salario in resultados:
+        generados.extend(recibos)
+        omitidos.extend(sin_salario)
+    for employee in omitidos:
+        logger.warning("Recibo omitido para %s (%s-%02d): sin salario configurado",
+                       employee.name, year, month)
     logger.info("Cierre %s-%02d: %d recibos generados, %d omitidos",
                 year, month, len(generados), len(omitidos))
     return generados, omitidos
 
 
-def enviar_recibos_dolibarr(year, month):
+def ejecutar_cierre_mes(cierre_id):
+    """Corre un CierreNomina y deja en él el avance y el resultado."""
+    cierre = CierreNomina.objects.get(pk=cierre_id)
+    CierreNomina.objects.filter(pk=cierre_id).update(estado='EN_CURSO', actualizado=timezone.now())
+
+    def progreso(hechos, total):
+        # Una escritura por lote de TAM_LOTE_CIERRE empleados
+        CierreNomina.objects.filter(pk=cierre_id).update(
+            hechos=hechos, total=total, actualizado=timezone.now())
+
+    try:
+        generados, omitidos = generar_recibos_mes(
+            cierre.year, cierre.month, generado_por=cierre.iniciado_por,
+            workers=getattr(settings, 'NOMINA_CIERRE_WORKERS', 1), progreso=progreso)
+    except Exception as exc:
+        logger.exception("Cierre de nómina #%s interrumpido", cierre_id)
+        CierreNomina.objects.filter(pk=cierre_id).update(
+            estado='FALLIDO', detalle=str(exc)[:2000], terminado=timezone.now(),
+            actualizado=timezone.now())
+        return
+
+    detalle = ''
+    if omitidos:
+        detalle = "Sin salario configurado (omitidos): " + ', '.join(e.name for e in omitidos)
+    CierreNomina.objects.filter(pk=cierre_id).update(
+        estado='TERMINADO', generados=len(generados), omitidos=len(omitidos),
+        detalle=detalle, terminado=timezone.now(), actualizado=timezone.now())
+
+
+def _cierre_en_hilo(cierre_id):
+    try:
+        ejecutar_cierre_mes(cierre_id)
+    finally:
+        connections.close_all()
+
+
+def cierre_activo(year, month):
+    """CierreNomina del período que sigue corriendo, o None."""
+    return CierreNomina.objects.filter(
+        year=year, month=month, estado__in=['PENDIENTE', 'EN_CURSO'],
+        actualizado__gte=timezone.now() - ENVIO_VENCIDO,
+    ).first()
+
+
+def iniciar_cierre_mes(year, month, usuario=None):
+    """Crea el CierreNomina del período y lo corre en un hilo al confirmarse
+    la transacción, como iniciar_envio_dolibarr. Si ya hay uno activo para
+    el período lo devuelve sin lanzar otro.
+    Devuelve (cierre, nuevo)."""
+    activo = cierre_activo(year, month)
+    if activo:
+        return activo, False
+    cierre = CierreNomina.objects.create(year=year, month=month, iniciado_por=usuario)
+    transaction.on_commit(lambda: threading.Thread(
+        target=_cierre_en_hilo, args=(cierre.pk,), daemon=True,
+        name=f'cierre-nomina-{cierre.pk}').start())
+    return cierre, True
+
+
+def _crear_salario(recibo, identidad, clientes):
+    """Corre en un hilo del pool: solo HTTP, sin tocar la base."""
+    try:
+        return crear_salario(recibo, identidad.dolibarr_instance, identidad.dolibarr_user_id,
+                             http=clientes[identidad.dolibarr_instance_id]), None
+    except (DolibarrApiError, httpx.HTTPError) as exc:
+        return None, exc
+
+
+def enviar_recibos_dolibarr(year, month, workers=None, progreso=None):
     """Envía a Dolibarr los recibos del período como salarios (paye=0).
 
     Idempotente: omite recibos ya sincronizados (con dolibarr_salary_id).
     Nunca aborta el lote: cada fallo queda en recibo.dolibarr_error y sigue.
+    Las peticiones salen en paralelo (`workers` hilos, default
+    DOLIBARR_PUSH_WORKERS) por un cliente HTTP por instancia; los hilos solo
+    hablan con Dolibarr y los recibos se guardan desde este hilo.
+    `progreso(hechos, total)` se llama tras cada recibo enviado.
     Devuelve un dict con cuatro listas:
         {'enviados': [recibos], 'ya_sincronizados': [recibos],
          'sin_mapeo': [employees], 'con_error': [(recibo, mensaje)]}
     """
+    if workers is None:
+        workers = getattr(settings, 'DOLIBARR_PUSH_WORKERS', 8)
     instancias_push = DolibarrInstance.objects.exclude(
         api_base_url='').exclude(api_key='')
-    recibos = ReciboNomina.objects.filter(
-        year=year, month=month).select_related('employee').order_by('employee__name')
+    recibos = list(ReciboNomina.objects.filter(
+        year=year, month=month).select_related('employee').order_by('employee__name'))
+    identidades = defaultdict(list)
+    for identidad in DolibarrUserIdentity.objects.filter(
+            employee__in=[r.employee_id for r in recibos],
+            dolibarr_instance__in=instancias_push).select_related('dolibarr_instance'):
+        identidades[identidad.employee_id].append(identidad)
 
     enviados, ya_sincronizados, sin_mapeo, con_error = [], [], [], []
+    pendientes = []
 
     def _marcar_error(recibo, mensaje):
         recibo.dolibarr_error = mensaje[:2000]
@@ -96,32 +267,41 @@ def enviar_recibos_dolibarr(year, month):
             ya_sincronizados.append(recibo)
             continue
 
-        identidades = list(recibo.employee.dolibarr_identities.filter(
-            dolibarr_instance__in=instancias_push).select_related('dolibarr_instance'))
-
-        if not identidades:
+        mapeos = identidades[recibo.employee_id]
+        if not mapeos:
             sin_mapeo.append(recibo.employee)
             continue
-        if len(identidades) > 1:
+        if len(mapeos) > 1:
             _marcar_error(recibo,
                           "Empleado mapeado en varias instancias Dolibarr con push "
                           "habilitado; deja solo una con api_key o elimina mapeos duplicados.")
             continue
+        pendientes.append((recibo, mapeos[0]))
 
-        identidad = identidades[0]
-        try:
-            salary_id = crear_salario(
-                recibo, identidad.dolibarr_instance, identidad.dolibarr_user_id)
-        except (DolibarrApiError, httpx.HTTPError) as exc:
-            logger.warning("Error enviando recibo #%s a Dolibarr: %s", recibo.pk, exc)
-            _marcar_error(recibo, str(exc))
-            continue
-
-        recibo.dolibarr_salary_id = salary_id
-        recibo.dolibarr_synced_at = timezone.now()
-        recibo.dolibarr_error = ''
-        recibo.save(update_fields=['dolibarr_salary_id', 'dolibarr_synced_at', 'dolibarr_error'])
-        enviados.append(recibo)
+    with ExitStack() as pila:
+        clientes = {}
+        for _, identidad in pendientes:
+            if identidad.dolibarr_instance_id not in clientes:
+                clientes[identidad.dolibarr_instance_id] = pila.enter_context(
+                    dolibarr_api.cliente(identidad.dolibarr_instance, max(1, workers)))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futuros = {pool.submit(_crear_salario, recibo, identidad, clientes): recibo
+                       for recibo, identidad in pendientes}
+            for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                recibo = futuros[futuro]
+                salary_id, exc = futuro.result()
+                if exc is not None:
+                    logger.warning("Error enviando recibo #%s a Dolibarr: %s", recibo.pk, exc)
+                    _marcar_error(recibo, str(exc))
+                else:
+                    recibo.dolibarr_salary_id = salary_id
+                    recibo.dolibarr_synced_at = timezone.now()
+                    recibo.dolibarr_error = ''
+                    recibo.save(update_fields=['dolibarr_salary_id', 'dolibarr_synced_at',
+                                               'dolibarr_error'])
+                    enviados.append(recibo)
+                if progreso:
+                    progreso(hechos, len(pendientes))
 
     logger.info("Push Dolibarr %s-%02d: %d enviados, %d ya sync, %d sin mapeo, %d errores",
                 year, month, len(enviados), len(ya_sincronizados), len(sin_mapeo), len(con_error))
@@ -131,3 +311,63 @@ def enviar_recibos_dolibarr(year, month):
         'sin_mapeo': sin_mapeo,
         'con_error': con_error,
     }
+
+
+def ejecutar_envio_dolibarr(envio_id):
+    """Corre un EnvioDolibarr y deja en él el avance y el resultado."""
+    envio = EnvioDolibarr.objects.get(pk=envio_id)
+    EnvioDolibarr.objects.filter(pk=envio_id).update(estado='EN_CURSO', actualizado=timezone.now())
+    ultimo = [0.0]
+
+    def progreso(hechos, total):
+        # A lo sumo una escritura por segundo (y siempre la última)
+        if hechos == total or time.monotonic() - ultimo[0] >= 1:
+            ultimo[0] = time.monotonic()
+            EnvioDolibarr.objects.filter(pk=envio_id).update(
+                hechos=hechos, total=total, actualizado=timezone.now())
+
+    try:
+        resultado = enviar_recibos_dolibarr(envio.year, envio.month, progreso=progreso)
+    except Exception as exc:
+        logger.exception("Envío a Dolibarr #%s interrumpido", envio_id)
+        EnvioDolibarr.objects.filter(pk=envio_id).update(
+            estado='FALLIDO', detalle=str(exc)[:2000], terminado=timezone.now(),
+            actualizado=timezone.now())
+        return
+
+    detalle = []
+    if resultado['sin_mapeo']:
+        detalle.append("Sin identidad Dolibarr: " + ', '.join(e.name for e in resultado['sin_mapeo']))
+    if resultado['con_error']:
+        detalle.append("Con error: " + ', '.join(r.employee.name for r, _ in resultado['con_error']))
+    enviados = len(resultado['enviados'])
+    EnvioDolibarr.objects.filter(pk=envio_id).update(
+        estado='TERMINADO', enviados=enviados,
+        ya_sincronizados=len(resultado['ya_sincronizados']),
+        sin_mapeo=len(resultado['sin_mapeo']), con_error=len(resultado['con_error']),
+        detalle='\n'.join(detalle), terminado=timezone.now(), actualizado=timezone.now())
+
+
+def _envio_en_hilo(envio_id):
+    try:
+        ejecutar_envio_dolibarr(envio_id)
+    finally:
+        connections.close_all()
+
+
+def iniciar_envio_dolibarr(year, month, usuario=None):
+    """Crea el EnvioDolibarr del período y lo corre en un hilo al confirmarse
+    la transacción. Si ya hay uno activo para el período (con avance en los
+    últimos ENVIO_VENCIDO) lo devuelve sin lanzar otro.
+    Devuelve (envio, nuevo)."""
+    activo = EnvioDolibarr.objects.filter(
+        year=year, month=month, estado__in=['PENDIENTE', 'EN_CURSO'],
+        actualizado__gte=timezone.now() - ENVIO_VENCIDO,
+    ).first()
+    if activo:
+        return activo, False
+    envio = EnvioDolibarr.objects.create(year=year, month=month, iniciado_por=usuario)
+    transaction.on_commit(lambda: threading.Thread(
+        target=_envio_en_hilo, args=(envio.pk,), daemon=True,
+        name=f'envio-dolibarr-{envio.pk}').start())
+    return envio, True
@@ -0,0 +1,665 @@
+"""
+Motor de nómina por lotes.
+
+Calcula el desglose de Employee.calculate_salary para muchos empleados de un
+mes con un número fijo de consultas agrupadas (salarios, horas, tareas,
+registros manuales, ventas, productos), en vez de decenas de consultas por
+empleado. Employee.calculate_salary, calculate_performance_bonus y
+calculate_commissions delegan aquí con un solo empleado, así que la vista
+individual y el cierre de mes aplican exactamente las mismas reglas.
+
+Las ventas (comisiones y efectividad) se leen siempre del libro
+EmployeeMonthSummary (resumen_mensual.py). Con from_summaries=True también
+horas, contadores del IPAC, contadores por KPI y productos salen de ahí en
+lugar de agregar los registros fuente; lo usan las pantallas de salario. El
+cierre de mes agrega esos registros fuente.
+"""
+import calendar
+import copy
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import cached_property
+
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum
+
+from .models import (
+    CacheVersion, CommissionBalance, CompanySettings, Employee, EmployeeMonthSummary,
+    EmployeePerformanceRecord, ManualKpiEntry,
+    ProductCreationLog, Salary, Task, WorkLog,
+)
+from . import reglas_kpi
+from .calendario import business_calendar
+from .reglas_kpi import compiled_rules
+from .resumen_mensual import compute_summaries
+
+ZERO = Decimal('0.00')
+
+BALANCE_FIELDS = ['balance', 'pre_month_balance', 'last_computed_year', 'last_computed_month']
+
+
+def active_employees(year, month):
+    """Empleados activos en algún día del mes (mismo criterio que el cierre)."""
+    primero = date(year, month, 1)
+    return Employee.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gte=primero)
+    ).order_by('name')
+
+
+def monthly_hours_for(settings, year, month):
+    """Horas base del mes según CompanySettings. Devuelve (horas, días hábiles);
+    días hábiles solo se calcula con base 'daily'."""
+    monthly_hours = Decimal('0.00')
+    work_days_in_month = 0
+
+    if settings.calculation_basis == 'monthly':
+        monthly_hours = settings.base_hours
+    elif settings.calculation_basis == 'weekly':
+        # Approximate monthly hours by multiplying by the average number of weeks in a month
+        monthly_hours = settings.base_hours * Decimal('4.333')
+    elif settings.calculation_basis == 'daily':
+        # Working days (Mon-Fri minus holidays) in the given month and year
+        work_days_in_month = business_calendar().month_count(year, month)
+        monthly_hours = settings.base_hours * Decimal(work_days_in_month)
+
+    if monthly_hours <= 0:
+        # Fallback to a default if hours are not set, to avoid division by zero
+        monthly_hours = Decimal('160')
+    return monthly_hours, work_days_in_month
+
+
+def ipac_score(completed, with_due_date, on_time, errors, avg_duration):
+    """Fórmula IPAC a partir de los conteos del mes (ver Employee.calculate_ipac)."""
+    if completed == 0:
+        return Decimal('0.00')
+
+    if with_due_date > 0:
+        on_time_factor = Decimal(on_time) / Decimal(with_due_date)
+    else:
+        on_time_factor = Decimal('1.0')  # Assume 100% if no due dates are set
+
+    error_rate = Decimal(errors) / Decimal(completed)
+    quality_factor = max(Decimal('0.0'), Decimal('1.0') - error_rate)
+
+    if not avg_duration:
+        avg_duration = timedelta(hours=1)  # Fallback to 1 hour to prevent errors
+    avg_execution_hours = Decimal(avg_duration.total_seconds()) / Decimal('3600')
+
+    # Prevent division by zero or extremely small denominators
+    min_avg_hours = Decimal('0.01')  # ~36 seconds
+    if avg_execution_hours < min_avg_hours:
+        avg_execution_hours = min_avg_hours
+
+    numerator = Decimal(completed) * on_time_factor * quality_factor
+    return (numerator / avg_execution_hours).quantize(Decimal('0.01'))
+
+
+def ipac_rows(year, month, employee_ids=None):
+    """Contadores del IPAC por empleado en UNA consulta: tareas completadas en
+    el mes (con/sin vencimiento, a tiempo, duración media) y, como subconsulta
+    correlacionada, la suma de errores de KPIs 'count_lt' del mes.
+    Devuelve {employee_id: fila}; solo empleados con tareas completadas."""
+    errors = ManualKpiEntry.objects.filter(
+        employee=OuterRef('assigned_to'), kpi__measurement_type='count_lt',
+        date__year=year, date__month=month,
+    ).values('employee').annotate(total=Sum('value')).values('total')
+    with_due = Q(due_date__isnull=False)
+    rows = Task.objects.filter(completed_at__year=year, completed_at__month=month)
+    if employee_ids is not None:
+        rows = rows.filter(assigned_to_id__in=employee_ids)
+    rows = rows.values('assigned_to_id').annotate(
+        completed=Count('id'),
+        with_due_date=Count('id', filter=with_due),
+        on_time=Count('id', filter=with_due & Q(completed_at__date__lte=F('due_date'))),
+        avg_duration=Avg(F('completed_at') - F('created_at')),
+        errors=Subquery(errors),
+    )
+    return {r['assigned_to_id']: r for r in rows}
+
+
+def _ipac_from_row(row):
+    return ipac_score(row['completed'], row['with_due_date'], row['on_time'],
+                      row['errors'] or Decimal('0'), row['avg_duration'])
+
+
+def ipac_scores(year, month, employee_ids=None):
+    """{employee_id: IPAC} del mes con una sola consulta agrupada. Los
+    empleados pedidos sin tareas completadas quedan en 0.00."""
+    scores = {pk: Decimal('0.00') for pk in employee_ids or []}
+    for pk, row in ipac_rows(year, month, employee_ids).items():
+        scores[pk] = _ipac_from_row(row)
+    return scores
+
+
+def ipac_ranking(year, month, kpi):
+    """[{'employee', 'actual_value'}] de los empleados activos del mes cuyo
+    perfil mide el KPI IPAC, de mayor a menor (misma forma que los
+    EmployeePerformanceRecord que muestran las plantillas)."""
+    employees = list(active_employees(year, month).filter(profile__kpis=kpi))
+    scores = ipac_scores(year, month, [e.pk for e in employees])
+    ranking = [{'employee': e, 'actual_value': scores[e.pk]} for e in employees]
+    ranking.sort(key=lambda r: r['actual_value'], reverse=True)
+    return ranking
+
+
+def _zero_commissions():
+    return {
+        'commission_amount': ZERO,
+        'confirmed_invoiced': ZERO,
+        'confirmed_count': 0,
+        'provisional_invoiced': ZERO,
+        'provisional_count': 0,
+        'credit_notes_amount': ZERO,
+        'credit_note_count': 0,
+        'net_confirmed': ZERO,
+        'commission_percentage': ZERO,
+    }
+
+
+class PayrollBatch:
+    """Insumos de nómina de un mes precargados para un conjunto de empleados.
+
+    Cada grupo de insumos se carga con UNA consulta agrupada la primera vez
+    que se necesita, así que el número de consultas depende de los tipos de
+    KPI en juego, no de la cantidad de empleados."""
+
+    def __init__(self, year, month, employees, from_summaries=False):
+        self.year = year
+        self.month = month
+        self.from_summaries = from_summaries
+        self.employees = list(employees)
+        self.ids = [e.pk for e in self.employees]
+        self.record_date = date(year, month, calendar.monthrange(year, month)[1])
+
+    def with_overrides(self, commission_percentages=None, kpi_targets=None):
+        """Copia del lote que comparte los insumos ya cargados pero usa otros
+        porcentajes de comisión y/o metas de KPI (escenarios what-if)."""
+        clone = copy.copy(self)
+        clone.__dict__ = dict(self.__dict__)
+        commission_percentages = commission_percentages or {}
+        if commission_percentages:
+            employees = []
+            for employee in self.employees:
+                if employee.pk in commission_percentages:
+                    employee = copy.copy(employee)
+                    employee.commission_percentage = Decimal(commission_percentages[employee.pk])
+                employees.append(employee)
+            clone.employees = employees
+        if kpi_targets:
+            clone.rules = self.rules.with_targets(kpi_targets)
+        return clone
+
+    def commit(self):
+        """Confirma lo calculado: upsert de EmployeePerformanceRecord y de los
+        CommissionBalance avanzados. Solo lo usa el cierre de mes (y los
+        métodos de Employee, que son la API explícita de un empleado)."""
+        records = getattr(self, '_pending_records', [])
+        balances = getattr(self, '_pending_balances', [])
+        if records:
+            EmployeePerformanceRecord.objects.bulk_create(
+                records, update_conflicts=True,
+                unique_fields=['employee', 'kpi', 'date'],
+                update_fields=['actual_value', 'target_met', 'bonus_awarded'],
+            )
+        if balances:
+            CommissionBalance.objects.bulk_create(
+                balances, update_conflicts=True,
+                unique_fields=['employee'], update_fields=BALANCE_FIELDS,
+            )
+            # bulk_create no dispara señales: el saldo cambia el arrastre
+            invalidate_salary_cache(*(b.employee_id for b in balances))
+        self._pending_records, self._pending_balances = [], []
+
+    # --- Insumos ---------------------------------------------------------
+
+    @cached_property
+    def base_salaries(self):
+        """{employee_id: base_amount} vigente el primer día del mes."""
+        target_date = date(self.year, self.month, 1)
+        rows = Salary.objects.filter(
+            employee_id__in=self.ids, effective_date__lte=target_date,
+        ).order_by('employee_id', '-effective_date').values_list('employee_id', 'base_amount')
+        salaries = {}
+        for employee_id, amount in rows:
+            salaries.setdefault(employee_id, amount)
+        return salaries
+
+    @cached_property
+    def summaries(self):
+        """{employee_id: EmployeeMonthSummary} del mes; los que aún no existen
+        se agregan en el momento sin guardarlos (el lote no escribe)."""
+        rows = {
+            s.employee_id: s for s in EmployeeMonthSummary.objects.filter(
+                employee_id__in=self.ids, year=self.year, month=self.month)
+        }
+        missing = [pk for pk in self.ids if pk not in rows]
+        if missing:
+            rows.update(compute_summaries(self.year, self.month, missing))
+        return rows
+
+    @cached_property
+    def hours(self):
+        """{employee_id: (horas, horas extra)} del mes."""
+        if self.from_summaries:
+            return {pk: (s.hours_worked, s.overtime_hours) for pk, s in self.summaries.items()}
+        rows = WorkLog.objects.filter(
+            employee_id__in=self.ids, date__year=self.year, date__month=self.month,
+        ).values('employee_id').annotate(
+            worked=Sum('hours_worked'), overtime=Sum('overtime_hours'))
+        return {r['employee_id']: (r['worked'], r['overtime']) for r in rows}
+
+    @cached_property
+    def settings(self):
+        return CompanySettings.load()
+
+    @cached_property
+    def rules(self):
+        """Tabla compilada de reglas de KPI (reglas_kpi), compartida entre
+        corridas mientras no cambien KPIs, reglas, escalones o perfiles."""
+        return compiled_rules()
+
+    @cached_property
+    def kpi_ids(self):
+        """KPIs de los perfiles presentes en el lote."""
+        return {
+            compiled.kpi.pk
+            for profile_id in {e.profile_id for e in self.employees}
+            for compiled in self.rules.for_profile(profile_id)
+        }
+
+    @cached_property
+    def task_counts(self):
+        """{(employee_id, kpi_id): {'due', 'done', 'completed'}}: tareas con
+        vencimiento en el mes (y cuántas están en 'Hecho') y tareas completadas
+        en el mes, en una sola consulta."""
+        if self.from_summaries:
+            return {
+                (pk, int(kpi_id)): stats
+                for pk, s in self.summaries.items()
+                for kpi_id, stats in s.kpi_stats.items()
+                if int(kpi_id) in self.kpi_ids
+            }
+        due_in_month = Q(due_date__year=self.year, due_date__month=self.month)
+        completed_in_month = Q(completed_at__year=self.year, completed_at__month=self.month)
+        rows = Task.objects.filter(
+            due_in_month | completed_in_month,
+            assigned_to_id__in=self.ids, kpi_id__in=self.kpi_ids,
+        ).values('assigned_to_id', 'kpi_id').annotate(
+            due=Count('id', filter=due_in_month),
+            done=Count('id', filter=due_in_month & Q(
+                completed_at__isnull=False, list__name__iexact='Hecho')),
+            completed=Count('id', filter=completed_in_month),
+        )
+        return {(r['assigned_to_id'], r['kpi_id']): r for r in rows}
+
+    @cached_property
+    def manual_totals(self):
+        """{(employee_id, kpi_id): suma} de ManualKpiEntry del mes."""
+        if self.from_summaries:
+            return {
+                (pk, int(kpi_id)): Decimal(stats['manual'])
+                for pk, s in self.summaries.items()
+                for kpi_id, stats in s.kpi_stats.items()
+                if Decimal(stats['manual'])
+            }
+        return {
+            (r['employee_id'], r['kpi_id']): r['total']
+            for r in self._manual_rows
+        }
+
+    @cached_property
+    def _manual_rows(self):
+        return list(ManualKpiEntry.objects.filter(
+            employee_id__in=self.ids, date__year=self.year, date__month=self.month,
+        ).values('employee_id', 'kpi_id').annotate(total=Sum('value')))
+
+    @cached_property
+    def sales(self):
+        """{employee_id: agregados de ventas} para efectividad de ventas y
+        comisiones. Siempre desde el libro EmployeeMonthSummary, también en
+        el cierre de mes: la vista, calculate_commissions y el cierre no
+        pueden diferir en lo que pagan."""
+        # Las provisionales (facturadas sin pago) no dependen del mes: se
+        # suman las de todos los resúmenes del empleado.
+        provisional = {
+            r['employee_id']: r for r in EmployeeMonthSummary.objects.filter(
+                employee_id__in=self.ids, provisional_count__gt=0,
+            ).values('employee_id').annotate(
+                amount=Sum('provisional_invoiced'), n=Sum('provisional_count'))
+        }
+        sales = {}
+        for pk, s in self.summaries.items():
+            pending = provisional.get(pk, {})
+            sales[pk] = {
+                'proformas': s.proforma_count,
+                'proforma_invoices': s.proforma_invoice_count,
+                'confirmed_invoiced': s.confirmed_invoiced,
+                'confirmed_count': s.confirmed_count,
+                'provisional_invoiced': pending.get('amount'),
+                'provisional_count': pending.get('n', 0),
+                'credit_notes_amount': s.credit_notes_amount,
+                'credit_note_count': s.credit_note_count,
+            }
+        return sales
+
+    @cached_property
+    def products(self):
+        """{employee_id: productos creados en el mes sin duplicados}."""
+        if self.from_summaries:
+            return {pk: s.products_created for pk, s in self.summaries.items()}
+        rows = ProductCreationLog.objects.filter(
+            employee_id__in=self.ids, created_at__year=self.year,
+            created_at__month=self.month, is_suspect_duplicate=False,
+        ).values('employee_id').annotate(n=Count('id'))
+        return {r['employee_id']: r['n'] for r in rows}
+
+    @cached_property
+    def ipac_stats(self):
+        """{employee_id: contadores del IPAC} (ver ipac_rows)."""
+        if self.from_summaries:
+            return {
+                pk: {
+                    'completed': s.tasks_completed,
+                    'with_due_date': s.tasks_completed_with_due_date,
+                    'on_time': s.tasks_completed_on_time,
+                    'avg_duration': (s.tasks_completed_duration / s.tasks_completed
+                                     if s.tasks_completed else None),
+                    'errors': s.manual_errors,
+                }
+                for pk, s in self.summaries.items() if s.tasks_completed
+            }
+        return ipac_rows(self.year, self.month, self.ids)
+
+    # --- Cálculo ---------------------------------------------------------
+
+    def ipac(self, employee_id):
+        stats = self.ipac_stats.get(employee_id)
+        if not stats:
+            return Decimal('0.00')
+        return _ipac_from_row(stats)
+
+    def kpi_value(self, employee, kpi):
+        """Valor medido de un KPI para un empleado (internal_code primero,
+        luego measurement_type)."""
+        key = (employee.pk, kpi.pk)
+
+        if kpi.internal_code == 'SALES_EFFECTIVENESS':
+            # (Invoices with proforma / Total proformas) * 100
+            sales = self.sales.get(employee.pk)
+            total_proformas = sales['proformas'] if sales else 0
+            if total_proformas >= kpi.min_volume_threshold and total_proformas > 0:
+                return (Decimal(sales['proforma_invoices']) / Decimal(total_proformas)) * 100
+            return 0
+
+        if kpi.internal_code == 'PRODUCT_CREATION':
+            return self.products.get(employee.pk, 0)
+
+        if kpi.measurement_type == 'percentage':
+            counts = self.task_counts.get(key)
+            if counts and counts['due'] > 0:
+                return (counts['done'] / counts['due']) * 100
+            return 0
+
+        if kpi.measurement_type == 'count_lt':
+            # No entries = 0 errors = target met
+            return self.manual_totals.get(key, 0)
+
+        if kpi.measurement_type == 'count_gt':
+            counts = self.task_counts.get(key)
+            return counts['completed'] if counts else 0
+
+        if kpi.measurement_type == 'composite_ipac':
+            return self.ipac(employee.pk)
+
+        return 0
+
+    def performance_bonuses(self, employees=None):
+        """{employee_id: bono total}. No escribe: los EmployeePerformanceRecord
+        quedan pendientes hasta commit()."""
+        totals = {}
+        records = []
+        for employee in self.employees if employees is None else employees:
+            total = Decimal('0.00')
+            # Employees without a profile get NO KPIs evaluated (no bonuses)
+            for compiled in self.rules.for_profile(employee.profile_id):
+                actual_value = self.kpi_value(employee, compiled.kpi)
+                target_met, bonus = compiled.evaluate(actual_value)
+                total += bonus
+                records.append(EmployeePerformanceRecord(
+                    employee=employee, kpi=compiled.kpi, date=self.record_date,
+                    actual_value=actual_value, target_met=target_met, bonus_awarded=bonus,
+                ))
+            totals[employee.pk] = total
+
+        self._pending_records = records
+        return totals
+
+    def _commission_balances(self, employees):
+        """{employee_id: CommissionBalance}; los que faltan se crean en memoria
+        (con saldo cero) y se guardan recién en commit()."""
+        ids = [e.pk for e in employees]
+        balances = {b.employee_id: b for b in CommissionBalance.objects.filter(employee_id__in=ids)}
+        for pk in ids:
+            if pk not in balances:
+                balances[pk] = CommissionBalance(employee_id=pk)
+        return balances
+
+    def commissions(self, employees=None):
+        """{employee_id: desglose de comisiones} con el clawback aplicado sobre
+        CommissionBalance (ver Employee.calculate_commissions). Los saldos se
+        avanzan solo en memoria; commit() los guarda."""
+        employees = self.employees if employees is None else employees
+        earners = [e for e in employees if e.commission_percentage > 0]
+        balances = self._commission_balances(earners) if earners else {}
+
+        results = {}
+        changed = []
+        requested = (self.year, self.month)
+        for employee in employees:
+            pct = employee.commission_percentage
+            if pct <= 0:
+                results[employee.pk] = _zero_commissions()
+                continue
+
+            sales = self.sales.get(employee.pk, {})
+            confirmed_invoiced = sales.get('confirmed_invoiced') or ZERO
+            provisional_invoiced = sales.get('provisional_invoiced') or ZERO
+            credit_notes_amount = sales.get('credit_notes_amount') or ZERO  # negative value
+
+            # Net confirmed = paid invoices + credit notes (credit notes are negative)
+            net_confirmed = confirmed_invoiced + credit_notes_amount
+            raw_commission = (net_confirmed * pct / Decimal('100')).quantize(Decimal('0.01'))
+
+            # Apply clawback: use running balance to recover past debts
+            bal = balances[employee.pk]
+            last_computed = (bal.last_computed_year, bal.last_computed_month)
+
+            if requested == last_computed:
+                # Same month recalculation (new invoices arrived): use pre-month snapshot
+                carry_forward = bal.pre_month_balance
+                adjusted = raw_commission + carry_forward
+                commission_amount = max(ZERO, adjusted)
+                remaining_debt = min(ZERO, adjusted)
+                bal.balance = remaining_debt
+                changed.append(bal)
+            elif requested > last_computed:
+                # New month (forward): snapshot and advance
+                carry_forward = bal.balance
+                bal.pre_month_balance = bal.balance
+                adjusted = raw_commission + carry_forward
+                commission_amount = max(ZERO, adjusted)
+                remaining_debt = min(ZERO, adjusted)
+                bal.balance = remaining_debt
+                bal.last_computed_year, bal.last_computed_month = requested
+                changed.append(bal)
+            else:
+                # Past month query: read-only, do NOT modify balance
+                carry_forward = ZERO
+                commission_amount = max(ZERO, raw_commission)
+                remaining_debt = ZERO
+
+            results[employee.pk] = {
+                'commission_amount': commission_amount,
+                'raw_commission': raw_commission,
+                'carry_forward_applied': carry_forward,
+                'remaining_debt': remaining_debt,
+                'confirmed_invoiced': confirmed_invoiced,
+                'confirmed_count': sales.get('confirmed_count', 0),
+                'provisional_invoiced': provisional_invoiced,
+                'provisional_count': sales.get('provisional_count', 0),
+                'credit_notes_amount': abs(credit_notes_amount),
+                'credit_note_count': sales.get('credit_note_count', 0),
+                'net_confirmed': net_confirmed,
+                'commission_percentage': pct,
+            }
+
+        self._pending_balances = changed
+        return results
+
+    def salaries(self):
+        """{employee_id: desglose de calculate_salary o None si el empleado no
+        tiene salario vigente}. Bonos y comisiones solo se calculan para
+        quienes tienen salario, igual que el cálculo individual. Simulación
+        pura: nada se escribe hasta commit()."""
+        with_salary = [e for e in self.employees if e.pk in self.base_salaries]
+        results = {e.pk: None for e in self.employees}
+        if not with_salary:
+            return results
+
+        settings = self.settings
+        monthly_hours, work_days_in_month = monthly_hours_for(settings, self.year, self.month)
+        bonuses = self.performance_bonuses(with_salary)
+        commissions = self.commissions(with_salary)
+
+        for employee in with_salary:
+            base_salary = self.base_salaries[employee.pk]
+            total_hours_worked, total_overtime_hours = self.hours.get(
+                employee.pk, (Decimal('0'), Decimal('0')))
+
+            hourly_rate = base_salary / monthly_hours
+            overtime_rate = hourly_rate * Decimal(1.5)
+            work_pay = total_hours_worked * hourly_rate
+            overtime_pay = total_overtime_hours * overtime_rate
+
+            performance_bonus = bonuses[employee.pk]
+            employee_commissions = commissions[employee.pk]
+            commission_amount = employee_commissions['commission_amount']
+
+            result = {
+                'base_salary': base_salary,
+                'work_pay': work_pay,
+                'overtime_pay': overtime_pay,
+                'performance_bonus': performance_bonus,
+                'commission_amount': commission_amount,
+                'total_salary': work_pay + overtime_pay + performance_bonus + commission_amount,
+                'total_hours_worked': total_hours_worked,
+                'total_overtime_hours': total_overtime_hours,
+                'hourly_rate': hourly_rate,
+                'overtime_rate': overtime_rate,
+                'calculation_basis': settings.calculation_basis,
+                'base_hours': settings.base_hours,
+                'monthly_hours': monthly_hours,
+                'work_days_in_month': work_days_in_month,
+            }
+            result.update(employee_commissions)
+            results[employee.pk] = result
+        return results
+
+
+def calculate_salaries(year, month, employees=None, commit=False):
+    """Calcula la nómina del mes para varios empleados a la vez.
+
+    `employees` por defecto son los activos del mes (orden alfabético).
+    Devuelve {employee_id: desglose} con el mismo dict que
+    Employee.calculate_salary (None si no tiene salario configurado).
+    Sin commit=True es una simulación: no escribe registros de desempeño ni
+    avanza saldos de comisión (solo el cierre de mes debe confirmar)."""
+    if employees is None:
+        employees = active_employees(year, month)
+    batch = PayrollBatch(year, month, employees)
+    results = batch.salaries()
+    if commit:
+        batch.commit()
+    return results
+
+
+def what_if(year, month, commission_percentages=None, kpi_targets=None, employees=None):
+    """Simula la nómina del mes dos veces sobre los mismos insumos: con las
+    reglas vigentes y con porcentajes de comisión ({employee_id: %}) y/o
+    metas de KPI ({kpi_id: meta}) alternativos. No escribe nada.
+    Devuelve (actual, escenario), ambos como calculate_salaries."""
+    if employees is None:
+        employees = active_employees(year, month)
+    batch = PayrollBatch(year, month, employees)
+    actual = batch.salaries()
+    escenario = batch.with_overrides(commission_percentages, kpi_targets).salaries()
+    return actual, escenario
+
+
+# --- Caché de desgloses simulados -----------------------------------------
+#
+# Clave: (empleado, año, mes) + tokens CacheVersion de las reglas de KPI
+# (reglas_kpi), de los parámetros globales (CompanySettings) y del empleado.
+# signals.py renueva el token del empleado ante cualquier cambio en sus
+# insumos, así una entrada vieja simplemente deja de consultarse.
+
+SALARY_CACHE_GLOBAL_KEY = 'salarios'
+SALARY_CACHE_STATS_KEYS = {'hits': 'salario_cache:hits', 'misses': 'salario_cache:misses'}
+_MISS = object()
+
+
+def _employee_version_key(employee_id):
+    return f'salario:{employee_id}'
+
+
+def invalidate_salary_cache(*employee_ids):
+    """Descarta los desgloses en caché de esos empleados (todos los meses)."""
+    for pk in {pk for pk in employee_ids if pk}:
+        CacheVersion.bump(_employee_version_key(pk))
+
+
+def invalidate_all_salary_cache():
+    CacheVersion.bump(SALARY_CACHE_GLOBAL_KEY)
+
+
+def _count(kind):
+    key = SALARY_CACHE_STATS_KEYS[kind]
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cached_salary(employee, year, month):
+    """Desglose simulado (sin escrituras, desde EmployeeMonthSummary) de un
+    empleado y mes, servido desde la caché mientras no cambien sus insumos.
+    Una consulta para leer los tokens de versión en caso de acierto."""
+    names = [reglas_kpi.VERSION_KEY, SALARY_CACHE_GLOBAL_KEY, _employee_version_key(employee.pk)]
+    tokens = dict(CacheVersion.objects.filter(name__in=names).values_list('name', 'token'))
+    key = 'salario:{}:{}:{}:{}'.format(
+        employee.pk, year, month, ':'.join(tokens.get(name, '') for name in names))
+
+    result = cache.get(key, _MISS)
+    if result is not _MISS:
+        _count('hits')
+        return result
+    _count('misses')
+    result = PayrollBatch(year, month, [employee], from_summaries=True).salaries()[employee.pk]
+    cache.set(key, result, getattr(django_settings, 'SALARY_CACHE_TIMEOUT', 60 * 60 * 24))
+    return result
+
+
+def salary_cache_stats():
+    """Aciertos/fallos de cached_salary desde el último reinicio de la caché.
+    Con la caché por defecto (memoria local) son del proceso; con un backend
+    compartido (Redis/Memcached en CACHES) son globales."""
+    hits = cache.get(SALARY_CACHE_STATS_KEYS['hits'], 0)
+    misses = cache.get(SALARY_CACHE_STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
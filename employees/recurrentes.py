@@ -0,0 +1,210 @@
+"""
+Motor de recurrencia de tareas y materialización de sus instancias.
+
+Las fechas de una plantilla recurrente salen de una sola regla de
+dateutil.rrule (`regla`): frecuencia, recurrence_interval (cada N periodos),
+recurrence_byday (días de la semana en formato RRULE, p. ej. MO,WE,FR) y
+recurrence_end_date como límite. La usan el comando
+`materializar_recurrentes`, la creación de una tarea recurrente en la API
+(primera instancia) y el signal que encadena la siguiente tarea al
+completar una recurrente, así las tres calculan igual 'weekly' y las demás
+frecuencias.
+
+`crear_instancias` calcula de una vez todas las ocurrencias de la ventana
+de cada plantilla (desde su última instancia, o desde su due_date, hasta el
+horizonte). Luego las compara contra las due_date de las hijas existentes,
+que trae en una sola consulta, y con un bulk_create inserta solo los días
+que faltan, junto con sus eventos de CalDAV. Volver a correrlo no duplica
+nada. El horizonte es hoy más TAREAS_RECURRENTES_HORIZONTE_DIAS (0: hasta
+hoy).
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from dateutil.rrule import DAILY, FR, MO, MONTHLY, SA, SU, TH, TU, WE, WEEKLY, YEARLY, rrule
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Task
+from .payroll import invalidate_salary_cache
+
+logger = logging.getLogger(__name__)
+
+FRECUENCIAS = {'daily': DAILY, 'weekly': WEEKLY, 'monthly': MONTHLY, 'yearly': YEARLY}
+DIAS_SEMANA = {'MO': MO, 'TU': TU, 'WE': WE, 'TH': TH, 'FR': FR, 'SA': SA, 'SU': SU}
+
+
+def _horizonte_dias():
+    return getattr(settings, 'TAREAS_RECURRENTES_HORIZONTE_DIAS', 0)
+
+
+def dias_semana(texto):
+    """'MO,WE,FR' -> (MO, WE, FR); vacío -> None. ValueError si hay un día
+    desconocido."""
+    codigos = [c.strip().upper() for c in (texto or '').split(',') if c.strip()]
+    desconocidos = [c for c in codigos if c not in DIAS_SEMANA]
+    if desconocidos:
+        raise ValueError(f"Días no válidos: {', '.join(desconocidos)} (usar {', '.join(DIAS_SEMANA)})")
+    return tuple(DIAS_SEMANA[c] for c in codigos) or None
+
+
+def regla(plantilla):
+    """rrule de la plantilla en hora local (datetimes naive). Empieza en su
+    due_date y termina al final de recurrence_end_date.
+
+    Mensual o anual con día > 28: los meses sin ese día caen en su último
+    día (31 -> 30 de abril, 28/29 de febrero; 29 de febrero -> 28 los años
+    no bisiestos), como hacía relativedelta. Un rrule simple los salteaba."""
+    frecuencia = FRECUENCIAS[plantilla.recurrence_frequency]
+    inicio = timezone.localtime(plantilla.due_date).replace(tzinfo=None)
+    byweekday = dias_semana(plantilla.recurrence_byday)
+    extra = {}
+    if frecuencia in (MONTHLY, YEARLY) and not byweekday and inicio.day > 28:
+        # El último día existente entre el 28 y el del vencimiento
+        extra = {'bymonthday': range(28, inicio.day + 1), 'bysetpos': -1}
+        if frecuencia == YEARLY:
+            extra['bymonth'] = inicio.month
+    return rrule(
+        frecuencia,
+        dtstart=inicio,
+        interval=max(plantilla.recurrence_interval or 1, 1),
+        byweekday=byweekday,
+        until=(datetime.combine(plantilla.recurrence_end_date, time.max)
+               if plantilla.recurrence_end_date else None),
+        **extra,
+    )
+
+
+def ocurrencias(plantilla, desde, hasta):
+    """Vencimientos (datetimes aware) de la plantilla entre las fechas
+    locales `desde` y `hasta`, ambas inclusive."""
+    return [
+        timezone.make_aware(momento)
+        for momento in regla(plantilla).between(
+            datetime.combine(desde, time.min), datetime.combine(hasta, time.max), inc=True)
+    ]
+
+
+def siguiente(plantilla, despues_de):
+    """Próximo vencimiento posterior a `despues_de` (aware) o None si la
+    recurrencia ya terminó."""
+    momento = regla(plantilla).after(timezone.localtime(despues_de).replace(tzinfo=None))
+    return timezone.make_aware(momento) if momento else None
+
+
+def plantillas_vigentes(hoy, employee_ids=None):
+    """Plantillas recurrentes aún vigentes de empleados activos, con
+    `ultima` = due_date de su última instancia (o None)."""
+    plantillas = Task.objects.filter(
+        Q(assigned_to__end_date__isnull=True) | Q(assigned_to__end_date__gte=hoy),
+        is_recurring=True, due_date__isnull=False, recurrence_end_date__gte=hoy,
+        recurrence_frequency__in=FRECUENCIAS,
+    )
+    if employee_ids is not None:
+        plantillas = plantillas.filter(assigned_to_id__in=employee_ids)
+    return plantillas.select_related('assigned_to__user').annotate(ultima=Max('children__due_date'))
+
+
+def _instancia(plantilla, vencimiento):
+    fecha = timezone.localtime(vencimiento).date()
+    return Task(
+        parent_task=plantilla,
+        list_id=plantilla.list_id,
+        assigned_to=plantilla.assigned_to,
+        created_by_id=plantilla.created_by_id,
+        kpi_id=plantilla.kpi_id,
+        title=f"{plantilla.title} - {fecha.strftime('%Y-%m-%d')}",
+        description=plantilla.description,
+        order=plantilla.order,
+        due_date=vencimiento,
+        is_recurring=False,
+    )
+
+
+def _eventos_de_calendario(tareas):
+    """Lo mismo que sync_task_to_calendar hace al guardar una tarea (el
+    bulk_create no dispara post_save)."""
+    from caldav.models import CalendarEvent
+    from .signals import DEFAULT_ALARM_MINUTES
+
+    CalendarEvent.objects.bulk_create([
+        CalendarEvent(
+            user=tarea.assigned_to.user,
+            task=tarea,
+            title=tarea.title,
+            start_date=tarea.due_date,
+            end_date=tarea.due_date + timedelta(hours=1),
+            description=tarea.description or '',
+            alarm_minutes=DEFAULT_ALARM_MINUTES,
+            uid=f"task-{tarea.pk}-{uuid.uuid4().hex[:8]}@payroll",
+        )
+        for tarea in tareas if getattr(tarea.assigned_to, 'user', None)
+    ])
+
+
+def crear_instancias(plantillas, hasta):
+    """Crea las instancias que faltan de `plantillas` hasta la fecha local
+    `hasta`. La ventana de cada una empieza en su última instancia
+    (atributo `ultima`, ver plantillas_vigentes) o en su due_date.
+    Devuelve las tareas creadas."""
+    ventanas = {}
+    for plantilla in plantillas:
+        if not plantilla.due_date or plantilla.recurrence_frequency not in FRECUENCIAS:
+            continue
+        inicio = getattr(plantilla, 'ultima', None) or plantilla.due_date
+        ventanas[plantilla.pk] = (plantilla, timezone.localtime(inicio).date())
+    if not ventanas:
+        return []
+
+    # Días que ya tienen instancia, de todas las plantillas en una consulta
+    desde = min(inicio for _, inicio in ventanas.values())
+    existentes = defaultdict(set)
+    for parent_id, vencimiento in Task.objects.filter(
+        parent_task_id__in=ventanas,
+        due_date__gte=timezone.make_aware(datetime.combine(desde, time.min)),
+    ).values_list('parent_task_id', 'due_date'):
+        existentes[parent_id].add(timezone.localtime(vencimiento).date())
+
+    nuevas = [
+        _instancia(plantilla, vencimiento)
+        for pk, (plantilla, inicio) in ventanas.items()
+        for vencimiento in ocurrencias(plantilla, inicio, hasta)
+        if timezone.localtime(vencimiento).date() not in existentes[pk]
+    ]
+    if not nuevas:
+        return []
+    with transaction.atomic():
+        creadas = Task.objects.bulk_create(nuevas)
+        _eventos_de_calendario(creadas)
+    invalidate_salary_cache(*{tarea.assigned_to_id for tarea in creadas})
+    return creadas
+
+
+def crear_primera_instancia(plantilla):
+    """Instancia del primer vencimiento de una plantilla recién creada (si
+    cae antes de recurrence_end_date). Devuelve la tarea o None."""
+    if not plantilla.due_date or plantilla.recurrence_frequency not in FRECUENCIAS:
+        return None
+    primera = regla(plantilla).after(
+        timezone.localtime(plantilla.due_date).replace(tzinfo=None), inc=True)
+    if primera is None:
+        return None
+    creadas = crear_instancias([plantilla], primera.date())
+    return creadas[0] if creadas else None
+
+
+def materializar(horizonte_dias=None, employee_ids=None):
+    """Crea las instancias que faltan de todas las plantillas vigentes.
+    Devuelve cuántas creó."""
+    if horizonte_dias is None:
+        horizonte_dias = _horizonte_dias()
+    hoy = timezone.localdate()
+    hasta = hoy + timedelta(days=horizonte_dias)
+    creadas = crear_instancias(plantillas_vigentes(hoy, employee_ids), hasta)
+    if creadas:
+        logger.info("Tareas recurrentes: %d instancias creadas hasta %s", len(creadas), hasta)
+    return len(creadas)
@@ -0,0 +1,146 @@
+"""
+Tabla compilada de reglas de bono por KPI.
+
+Carga KPI, BonusRule, KPIBonusTier y los KPIs de cada JobProfile una sola
+vez y los deja en memoria del proceso: por KPI, el monto de la regla y los
+escalones ordenados por umbral con el mejor bono acumulado, así evaluar un
+valor es un bisect en vez de recorrer escalones; por perfil, la lista de KPIs
+compilados, compartida por todos sus empleados.
+
+La tabla se reconstruye cuando cambia el token CacheVersion 'reglas_kpi',
+que signals.py renueva al guardar o borrar KPI, BonusRule, KPIBonusTier o
+JobProfile (y al cambiar los KPIs de un perfil).
+"""
+import copy
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from .models import KPI, BonusRule, CacheVersion, JobProfile, KPIBonusTier
+
+VERSION_KEY = 'reglas_kpi'
+
+
+class CompiledKpi:
+    """Un KPI con su regla y escalones listos para evaluar."""
+
+    def __init__(self, kpi, rule, tiers):
+        self.kpi = kpi
+        self.lower_is_better = kpi.measurement_type == 'count_lt'
+        self.rule_amount = rule.bonus_amount if rule else None
+
+        tiers = sorted(tiers, key=lambda t: t.threshold)
+        self.thresholds = [t.threshold for t in tiers]
+        amounts = [t.bonus_amount for t in tiers]
+        # best[i] = mayor bono de los escalones alcanzados cuando el corte del
+        # bisect cae en i. count_lt ("menos es mejor") alcanza un escalón en o
+        # bajo el umbral (sufijo); el resto en o sobre el umbral (prefijo).
+        self.best = []
+        if self.lower_is_better:
+            running = None
+            for amount in reversed(amounts):
+                running = amount if running is None else max(running, amount)
+                self.best.append(running)
+            self.best.reverse()
+        else:
+            running = None
+            for amount in amounts:
+                running = amount if running is None else max(running, amount)
+                self.best.append(running)
+
+    def best_tier(self, actual_value):
+        """Mayor bono de escalón alcanzado con el valor, o None."""
+        if not self.thresholds:
+            return None
+        if self.lower_is_better:
+            i = bisect_left(self.thresholds, actual_value)
+            return self.best[i] if i < len(self.best) else None
+        i = bisect_right(self.thresholds, actual_value)
+        return self.best[i - 1] if i else None
+
+    def evaluate(self, actual_value):
+        """(target_met, bonus): meta y regla estándar; un escalón alcanzado
+        la reemplaza si paga más."""
+        if self.lower_is_better:
+            target_met = actual_value < self.kpi.target_value
+        else:
+            target_met = actual_value >= self.kpi.target_value
+
+        bonus = Decimal('0.00')
+        if self.rule_amount is not None and target_met:
+            bonus = self.rule_amount
+
+        tier_bonus = self.best_tier(actual_value)
+        if tier_bonus is not None and tier_bonus > bonus:
+            bonus = tier_bonus
+            target_met = True
+        return target_met, bonus
+
+
+class RuleTable:
+    def __init__(self, kpis, profiles):
+        self.kpis = kpis          # {kpi_id: CompiledKpi}
+        self.profiles = profiles  # {profile_id: (CompiledKpi, ...)}
+
+    def for_profile(self, profile_id):
+        """KPIs compilados del perfil (vacío sin perfil)."""
+        return self.profiles.get(profile_id, ()) if profile_id else ()
+
+    def with_targets(self, targets):
+        """Copia de la tabla con otras metas ({kpi_id: meta}); reglas y
+        escalones se comparten. Para simulaciones what-if."""
+        kpis = dict(self.kpis)
+        for kpi_id, target in targets.items():
+            original = kpis.get(kpi_id)
+            if original is None:
+                continue
+            compiled = copy.copy(original)
+            compiled.kpi = copy.copy(original.kpi)
+            compiled.kpi.target_value = Decimal(target)
+            kpis[kpi_id] = compiled
+        profiles = {
+            profile_id: tuple(kpis[c.kpi.pk] for c in items)
+            for profile_id, items in self.profiles.items()
+        }
+        return RuleTable(kpis, profiles)
+
+
+def compile_rules():
+    """Construye la tabla desde la base (cuatro consultas)."""
+    rules = {}
+    for rule in BonusRule.objects.order_by('pk'):
+        rules.setdefault(rule.kpi_id, rule)  # la primera por pk, como .first()
+    tiers = defaultdict(list)
+    for tier in KPIBonusTier.objects.all():
+        tiers[tier.kpi_id].append(tier)
+    kpis = {
+        kpi.pk: CompiledKpi(kpi, rules.get(kpi.pk), tiers[kpi.pk])
+        for kpi in KPI.objects.all()
+    }
+    profiles = defaultdict(list)
+    for profile_id, kpi_id in JobProfile.kpis.through.objects.order_by('pk').values_list(
+            'jobprofile_id', 'kpi_id'):
+        profiles[profile_id].append(kpis[kpi_id])
+    return RuleTable(kpis, {pk: tuple(items) for pk, items in profiles.items()})
+
+
+_lock = threading.Lock()
+_table = None
+_version = None
+
+
+def compiled_rules():
+    """Tabla vigente: la del proceso si su versión coincide con la de la
+    base, o una recién compilada."""
+    global _table, _version
+    version = CacheVersion.current(VERSION_KEY)
+    with _lock:
+        if _table is None or _version != version:
+            _table = compile_rules()
+            _version = version
+        return _table
+
+
+def invalidate():
+    CacheVersion.bump(VERSION_KEY)
@@ -0,0 +1,267 @@
+"""
+Resumen mensual incremental por empleado (EmployeeMonthSummary).
+
+Los receivers de signals.py y el webhook de pagos llaman a
+`refresh_summaries` con las claves (empleado, año, mes) que tocó un cambio;
+solo esos meses se vuelven a agregar (consultas acotadas a un empleado y un
+mes) y se guardan con un upsert. `rebuild_summaries` regenera la tabla
+completa (o un mes) y la usa el comando `reconstruir_resumenes`.
+
+Además de horas, ventas e IPAC, cada fila guarda los contadores por KPI que
+usan los bonos (`kpi_stats`) y los productos creados, así cached_salary
+calcula un desglose leyendo solo esa fila.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    EmployeeMonthSummary, ManualKpiEntry, ProductCreationLog, SalesRecord, Task, WorkLog,
+)
+
+SUMMARY_FIELDS = [
+    'hours_worked', 'overtime_hours',
+    'proforma_count', 'proforma_invoice_count',
+    'confirmed_invoiced', 'confirmed_count',
+    'provisional_invoiced', 'provisional_count',
+    'credit_notes_amount', 'credit_note_count',
+    'tasks_completed', 'tasks_completed_with_due_date', 'tasks_completed_on_time',
+    'tasks_completed_duration', 'manual_errors', 'kpi_stats', 'products_created',
+]
+
+
+def _mes(valor):
+    """(año, mes) de una fecha o de un datetime (en la zona horaria local,
+    la misma que usan los lookups __year/__month)."""
+    if valor is None:
+        return None
+    if hasattr(valor, 'hour') and timezone.is_aware(valor):
+        valor = timezone.localtime(valor)
+    return valor.year, valor.month
+
+
+def _fechas_worklog(obj):
+    return obj.employee_id, [obj.date]
+
+
+def _fechas_venta(obj):
+    return obj.employee_id, [obj.date, obj.payment_date]
+
+
+def _fechas_tarea(obj):
+    # El vencimiento decide el % de tareas cumplidas del KPI
+    return obj.assigned_to_id, [obj.completed_at, obj.due_date]
+
+
+def _fechas_entrada_manual(obj):
+    return obj.employee_id, [obj.date]
+
+
+def _fechas_producto(obj):
+    return obj.employee_id, [obj.created_at]
+
+
+# Modelo -> (campos que deciden el mes, función que extrae empleado y fechas)
+FUENTES = {
+    WorkLog: (['employee_id', 'date'], _fechas_worklog),
+    SalesRecord: (['employee_id', 'date', 'payment_date'], _fechas_venta),
+    Task: (['assigned_to_id', 'completed_at', 'due_date'], _fechas_tarea),
+    ManualKpiEntry: (['employee_id', 'date'], _fechas_entrada_manual),
+    ProductCreationLog: (['employee_id', 'created_at'], _fechas_producto),
+}
+
+
+def summary_keys(obj):
+    """Claves (employee_id, año, mes) que un registro fuente alimenta."""
+    employee_id, fechas = FUENTES[type(obj)][1](obj)
+    if not employee_id:
+        return set()
+    return {(employee_id,) + mes for mes in map(_mes, fechas) if mes}
+
+
+def stored_summary_keys(model, pk):
+    """Claves del registro tal como está guardado (antes de un update)."""
+    campos, _ = FUENTES[model]
+    valores = model.objects.filter(pk=pk).values(*campos).first()
+    if not valores:
+        return set()
+    return summary_keys(model(pk=pk, **valores))
+
+
+def _agregados_mes(year, month, employee_ids=None):
+    """{employee_id: {campo: valor}} con los agregados del mes. Solo incluye
+    empleados con algún dato; employee_ids=None agrega a todos."""
+    datos = defaultdict(dict)
+
+    def por_empleado(qs, campo_empleado='employee_id'):
+        if employee_ids is not None:
+            qs = qs.filter(**{f'{campo_empleado}__in': employee_ids})
+        return qs.values(campo_empleado)
+
+    horas = por_empleado(WorkLog.objects.filter(date__year=year, date__month=month)).annotate(
+        worked=Sum('hours_worked'), overtime=Sum('overtime_hours'))
+    for r in horas:
+        datos[r['employee_id']].update(hours_worked=r['worked'], overtime_hours=r['overtime'])
+
+    in_month = Q(date__year=year, date__month=month)
+    confirmed = Q(status='invoiced', payment_date__year=year, payment_date__month=month)
+    provisional = Q(status='invoiced', payment_date__isnull=True) & in_month
+    credit_notes = Q(status='credit_note') & in_month
+    ventas = por_empleado(SalesRecord.objects.filter(in_month | confirmed)).annotate(
+        proformas=Count('id', filter=Q(status='proforma') & in_month),
+        proforma_invoices=Count('id', filter=Q(
+            status='invoiced', origin_proforma_id__isnull=False) & in_month),
+        confirmed_sum=Sum('amount_untaxed', filter=confirmed),
+        confirmed_n=Count('id', filter=confirmed),
+        provisional_sum=Sum('amount_untaxed', filter=provisional),
+        provisional_n=Count('id', filter=provisional),
+        credit_sum=Sum('amount_untaxed', filter=credit_notes),
+        credit_n=Count('id', filter=credit_notes),
+    )
+    for r in ventas:
+        datos[r['employee_id']].update(
+            proforma_count=r['proformas'],
+            proforma_invoice_count=r['proforma_invoices'],
+            confirmed_invoiced=r['confirmed_sum'] or Decimal('0.00'),
+            confirmed_count=r['confirmed_n'],
+            provisional_invoiced=r['provisional_sum'] or Decimal('0.00'),
+            provisional_count=r['provisional_n'],
+            credit_notes_amount=r['credit_sum'] or Decimal('0.00'),
+            credit_note_count=r['credit_n'],
+        )
+
+    with_due = Q(due_date__isnull=False)
+    tareas = por_empleado(
+        Task.objects.filter(completed_at__year=year, completed_at__month=month),
+        'assigned_to_id',
+    ).annotate(
+        completed=Count('id'),
+        with_due_date=Count('id', filter=with_due),
+        on_time=Count('id', filter=with_due & Q(completed_at__date__lte=F('due_date'))),
+        duration=Sum(F('completed_at') - F('created_at')),
+    )
+    for r in tareas:
+        datos[r['assigned_to_id']].update(
+            tasks_completed=r['completed'],
+            tasks_completed_with_due_date=r['with_due_date'],
+            tasks_completed_on_time=r['on_time'],
+            tasks_completed_duration=r['duration'] or timedelta(0),
+        )
+
+    errores = por_empleado(ManualKpiEntry.objects.filter(
+        date__year=year, date__month=month, kpi__measurement_type='count_lt',
+    )).annotate(total=Sum('value'))
+    for r in errores:
+        datos[r['employee_id']]['manual_errors'] = r['total']
+
+    # Contadores por KPI de los bonos (PayrollBatch.task_counts y
+    # manual_totals); claves str porque se guardan como JSON.
+    kpi_stats = defaultdict(dict)
+
+    def stats(employee_id, kpi_id):
+        return kpi_stats[employee_id].setdefault(
+            str(kpi_id), {'due': 0, 'done': 0, 'completed': 0, 'manual': '0'})
+
+    due_in_month = Q(due_date__year=year, due_date__month=month)
+    completed_in_month = Q(completed_at__year=year, completed_at__month=month)
+    por_kpi = por_empleado(
+        Task.objects.filter(due_in_month | completed_in_month, kpi__isnull=False),
+        'assigned_to_id',
+    ).values('assigned_to_id', 'kpi_id').annotate(
+        due=Count('id', filter=due_in_month),
+        done=Count('id', filter=due_in_month & Q(
+            completed_at__isnull=False, list__name__iexact='Hecho')),
+        completed=Count('id', filter=completed_in_month),
+    )
+    for r in por_kpi:
+        stats(r['assigned_to_id'], r['kpi_id']).update(
+            due=r['due'], done=r['done'], completed=r['completed'])
+
+    manuales = por_empleado(ManualKpiEntry.objects.filter(
+        date__year=year, date__month=month,
+    )).values('employee_id', 'kpi_id').annotate(total=Sum('value'))
+    for r in manuales:
+        stats(r['employee_id'], r['kpi_id'])['manual'] = str(r['total'])
+
+    for employee_id, por_id in kpi_stats.items():
+        datos[employee_id]['kpi_stats'] = por_id
+
+    productos = por_empleado(ProductCreationLog.objects.filter(
+        created_at__year=year, created_at__month=month, is_suspect_duplicate=False,
+    )).annotate(n=Count('id'))
+    for r in productos:
+        datos[r['employee_id']]['products_created'] = r['n']
+
+    return datos
+
+
+def compute_summaries(year, month, employee_ids):
+    """{employee_id: EmployeeMonthSummary sin guardar} recién agregados, en
+    cero para quien no tenga datos en el mes."""
+    datos = _agregados_mes(year, month, employee_ids)
+    return {
+        pk: EmployeeMonthSummary(employee_id=pk, year=year, month=month, **datos.get(pk, {}))
+        for pk in employee_ids
+    }
+
+
+def _guardar(filas):
+    if filas:
+        EmployeeMonthSummary.objects.bulk_create(
+            filas, update_conflicts=True,
+            unique_fields=['employee', 'year', 'month'],
+            update_fields=SUMMARY_FIELDS + ['updated_at'],
+        )
+
+
+def refresh_summaries(keys):
+    """Recalcula los resúmenes de las claves (employee_id, año, mes) dadas.
+    Los meses que quedan sin datos se guardan en cero (no se borran), así una
+    fila ausente significa "nunca calculado"."""
+    por_mes = defaultdict(set)
+    for employee_id, year, month in keys:
+        por_mes[(year, month)].add(employee_id)
+
+    for (year, month), ids in por_mes.items():
+        _guardar(list(compute_summaries(year, month, ids).values()))
+
+
+def _meses_con_datos():
+    meses = set()
+    for fechas in (
+        WorkLog.objects.dates('date', 'month'),
+        SalesRecord.objects.dates('date', 'month'),
+        SalesRecord.objects.filter(payment_date__isnull=False).dates('payment_date', 'month'),
+        ManualKpiEntry.objects.dates('date', 'month'),
+        Task.objects.filter(completed_at__isnull=False).datetimes('completed_at', 'month'),
+        Task.objects.filter(due_date__isnull=False).datetimes('due_date', 'month'),
+        ProductCreationLog.objects.datetimes('created_at', 'month'),
+    ):
+        meses.update((f.year, f.month) for f in fechas)
+    return sorted(meses)
+
+
+@transaction.atomic
+def rebuild_summaries(year=None, month=None):
+    """Regenera EmployeeMonthSummary desde los registros fuente: todo el
+    histórico, o solo el mes indicado. Devuelve (meses, filas)."""
+    if year and month:
+        meses = [(year, month)]
+        EmployeeMonthSummary.objects.filter(year=year, month=month).delete()
+    else:
+        meses = _meses_con_datos()
+        EmployeeMonthSummary.objects.all().delete()
+
+    filas = 0
+    for y, m in meses:
+        datos = _agregados_mes(y, m)
+        _guardar([
+            EmployeeMonthSummary(employee_id=pk, year=y, month=m, **campos)
+            for pk, campos in datos.items()
+        ])
+        filas += len(datos)
+    return len(meses), filas
@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from .models import Employee, WorkLog, Task, TaskList, TaskBoard, Checklist, ChecklistItem
+from .recurrentes import dias_semana
 from datetime import date, timedelta, datetime
 
 
@@ -35,7 +36,8 @@ class TaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = [
             'id', 'title', 'description', 'order', 'due_date', 'status', 'list', 'assigned_to',
-            'is_recurring', 'recurrence_frequency', 'recurrence_end_date', 'parent_task',
+            'is_recurring', 'recurrence_frequency', 'recurrence_end_date',
+            'recurrence_interval', 'recurrence_byday', 'parent_task',
             'checklists', 'due_date_status'
         ]
         read_only_fields = ('parent_task',)
@@ -81,6 +83,10 @@ class TaskSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({
                     'recurrence_end_date': 'La fecha de finalización de la recurrencia es obligatoria para las tareas recurrentes.'
                 })
+            try:
+                dias_semana(data.get('recurrence_byday'))
+            except ValueError as e:
+                raise serializers.ValidationError({'recurrence_byday': str(e)})
 
         return data
 
@@ -93,7 +99,9 @@ class TaskListSerializer(serializers.ModelSerializer):
 
     def get_tasks(self, obj):
         # Exclude recurring "template" tasks from the board, only show instances
-        tasks = obj.tasks.filter(is_recurring=False)
+        tasks = getattr(obj, 'visible_tasks', None)  # prefetched (BOARD_PREFETCH)
+        if tasks is None:
+            tasks = obj.tasks.filter(is_recurring=False)
         serializer = TaskSerializer(tasks, many=True)
         return serializer.data
 
@@ -104,6 +112,54 @@ class TaskBoardSerializer(serializers.ModelSerializer):
         model = TaskBoard
         fields = ['id', 'name', 'employee', 'lists']
 
+
+# Lists, their visible tasks (no recurring templates), checklists and items:
+# a fixed number of queries per board, whatever the task count.
+BOARD_PREFETCH = (
+    Prefetch('lists__tasks', queryset=Task.objects.filter(is_recurring=False),
+             to_attr='visible_tasks'),
+    'lists__visible_tasks__checklists__items',
+)
+
+
+class FlatTaskSerializer(TaskSerializer):
+    """Read-only task for the flattened board: checklists as ids."""
+    assigned_to = serializers.PrimaryKeyRelatedField(read_only=True)
+    checklists = serializers.SerializerMethodField()
+
+    def get_fields(self):
+        # No assignable-employee queryset: nothing is written through here
+        return serializers.ModelSerializer.get_fields(self)
+
+    def get_checklists(self, obj):
+        return [checklist.pk for checklist in obj.checklists.all()]
+
+
+def board_document(board):
+    """Normalized board document: the board with its list ids in order and
+    `lists`, `tasks` and `checklists` keyed by id (items stay inside their
+    checklist). `board` must come with BOARD_PREFETCH."""
+    lists, tasks, checklists = {}, [], {}
+    for task_list in board.lists.all():
+        lists[task_list.pk] = {
+            'id': task_list.pk, 'name': task_list.name, 'order': task_list.order,
+            'tasks': [task.pk for task in task_list.visible_tasks],
+        }
+        tasks.extend(task_list.visible_tasks)
+        for task in task_list.visible_tasks:
+            for checklist in task.checklists.all():
+                checklists[checklist.pk] = {
+                    'id': checklist.pk, 'title': checklist.title, 'task': task.pk,
+                    'items': ChecklistItemSerializer(checklist.items.all(), many=True).data,
+                }
+    return {
+        'board': {'id': board.pk, 'name': board.name, 'employee': board.employee_id,
+                  'lists': list(lists)},
+        'lists': lists,
+        'tasks': {task['id']: task for task in FlatTaskSerializer(tasks, many=True).data},
+        'checklists': checklists,
+    }
+
 class WorkLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkLog
@@ -1,9 +1,15 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
 from django.dispatch import receiver
+from . import calendario, cambios_tablero, identidades, recurrentes, reglas_kpi
 from .emails import send_html_mail
-from .models import ManualKpiEntry, Task, TaskList
+from .models import (
+    KPI, BonusRule, Checklist, ChecklistItem, Comment, CompanySettings, DolibarrInstance,
+    DolibarrUserIdentity, Employee, Feriado, JobProfile, KPIBonusTier, ManualKpiEntry,
+    ProductCreationLog, Salary, SalesRecord, Task, TaskList, WorkLog,
+)
+from .payroll import invalidate_all_salary_cache, invalidate_salary_cache
+from .resumen_mensual import refresh_summaries, stored_summary_keys, summary_keys
 from datetime import date, timedelta
-from dateutil.relativedelta import relativedelta
 import uuid
 import logging
 
@@ -21,18 +27,12 @@ def handle_recurring_task(sender, instance, created, **kwargs):
     if instance.children.exists():
         return
 
-    next_due_date = None
-    if not instance.due_date:
+    if not instance.due_date or instance.recurrence_frequency not in recurrentes.FRECUENCIAS:
         return
 
-    if instance.recurrence_frequency == 'daily':
-        next_due_date = instance.due_date + relativedelta(days=1)
-    elif instance.recurrence_frequency == 'monthly':
-        next_due_date = instance.due_date + relativedelta(months=1)
-    elif instance.recurrence_frequency == 'yearly':
-        next_due_date = instance.due_date + relativedelta(years=1)
-
-    if not next_due_date or (instance.recurrence_end_date and next_due_date.date() > instance.recurrence_end_date):
+    # Same rrule as the materializer (interval, weekdays, end date)
+    next_due_date = recurrentes.siguiente(instance, instance.due_date)
+    if not next_due_date:
         return
 
     try:
@@ -52,7 +52,9 @@ def handle_recurring_task(sender, instance, created, **kwargs):
         due_date=next_due_date,
         is_recurring=True,
         recurrence_frequency=instance.recurrence_frequency,
-        recurrence_end_date=instance.recurrence_end_date
+        recurrence_end_date=instance.recurrence_end_date,
+        recurrence_interval=instance.recurrence_interval,
+        recurrence_byday=instance.recurrence_byday,
     )
 
 @receiver(post_save, sender=ManualKpiEntry)
@@ -129,3 +131,165 @@ def delete_task_calendar_event(sender, instance, **kwargs):
     """Remove the calendar event when a task is deleted."""
     from caldav.models import CalendarEvent
     CalendarEvent.objects.filter(task=instance).delete()
+
+
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Checklist)
+@receiver(post_delete, sender=ChecklistItem)
+@receiver(post_delete, sender=Comment)
+def record_board_tombstone(sender, instance, origin=None, **kwargs):
+    # Lápida para la sincronización incremental del tablero (cambios_tablero.py)
+    cambios_tablero.registrar_borrado(instance, origin)
+
+
+# --- Resumen mensual incremental (EmployeeMonthSummary) ---
+
+@receiver(pre_save, sender=WorkLog)
+@receiver(pre_save, sender=SalesRecord)
+@receiver(pre_save, sender=Task)
+@receiver(pre_save, sender=ManualKpiEntry)
+@receiver(pre_save, sender=ProductCreationLog)
+def remember_summary_keys(sender, instance, **kwargs):
+    """Guarda los meses que alimentaba el registro antes del update, para
+    recalcularlos también si cambió la fecha, el estado o el empleado."""
+    if instance._state.adding or instance.pk is None:
+        instance._summary_keys_before = set()
+    else:
+        instance._summary_keys_before = stored_summary_keys(sender, instance.pk)
+
+
+@receiver(post_save, sender=WorkLog)
+@receiver(post_save, sender=SalesRecord)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=ManualKpiEntry)
+@receiver(post_save, sender=ProductCreationLog)
+def refresh_month_summary_on_save(sender, instance, **kwargs):
+    keys = summary_keys(instance) | getattr(instance, '_summary_keys_before', set())
+    refresh_summaries(keys)
+
+
+@receiver(post_delete, sender=WorkLog)
+@receiver(post_delete, sender=SalesRecord)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=ManualKpiEntry)
+@receiver(post_delete, sender=ProductCreationLog)
+def refresh_month_summary_on_delete(sender, instance, origin=None, **kwargs):
+    # Al borrar un empleado sus resúmenes se van en cascada: no recalcular.
+    if isinstance(origin, Employee) or getattr(origin, 'model', None) is Employee:
+        return
+    refresh_summaries(summary_keys(instance))
+
+
+@receiver(pre_save, sender=KPI)
+def remember_kpi_measurement_type(sender, instance, **kwargs):
+    instance._measurement_type_before = None if instance._state.adding else (
+        KPI.objects.filter(pk=instance.pk).values_list('measurement_type', flat=True).first())
+
+
+@receiver(post_save, sender=KPI)
+def refresh_month_summary_on_kpi_type(sender, instance, created, **kwargs):
+    """manual_errors suma las entradas de KPIs 'count_lt': si el KPI cambia
+    de tipo, recalcular los meses donde tiene entradas."""
+    if created or getattr(instance, '_measurement_type_before', None) in (None, instance.measurement_type):
+        return
+    refresh_summaries(set(ManualKpiEntry.objects.filter(kpi=instance).values_list(
+        'employee_id', 'date__year', 'date__month').distinct()))
+
+
+# --- Tabla compilada de reglas de KPI ---
+
+@receiver(post_save, sender=KPI)
+@receiver(post_delete, sender=KPI)
+@receiver(post_save, sender=BonusRule)
+@receiver(post_delete, sender=BonusRule)
+@receiver(post_save, sender=KPIBonusTier)
+@receiver(post_delete, sender=KPIBonusTier)
+@receiver(post_save, sender=JobProfile)
+@receiver(post_delete, sender=JobProfile)
+def invalidate_kpi_rules(sender, **kwargs):
+    reglas_kpi.invalidate()
+
+
+@receiver(m2m_changed, sender=JobProfile.kpis.through)
+def invalidate_kpi_rules_on_profile_kpis(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        reglas_kpi.invalidate()
+
+
+# --- Caché de desgloses de salario (payroll.cached_salary) ---
+
+SALARY_INPUT_EMPLOYEE = {
+    WorkLog: 'employee_id',
+    Salary: 'employee_id',
+    SalesRecord: 'employee_id',
+    Task: 'assigned_to_id',
+    ManualKpiEntry: 'employee_id',
+    ProductCreationLog: 'employee_id',
+    Employee: 'pk',
+}
+
+
+@receiver(post_save, sender=WorkLog)
+@receiver(post_delete, sender=WorkLog)
+@receiver(post_save, sender=Salary)
+@receiver(post_delete, sender=Salary)
+@receiver(post_save, sender=SalesRecord)
+@receiver(post_delete, sender=SalesRecord)
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@receiver(post_save, sender=ManualKpiEntry)
+@receiver(post_delete, sender=ManualKpiEntry)
+@receiver(post_save, sender=ProductCreationLog)
+@receiver(post_delete, sender=ProductCreationLog)
+@receiver(post_save, sender=Employee)
+def invalidate_employee_salary_cache(sender, instance, **kwargs):
+    """Nuevo token para el empleado dueño del registro (y el anterior, si un
+    update lo reasignó)."""
+    employee_ids = {getattr(instance, SALARY_INPUT_EMPLOYEE[sender])}
+    employee_ids.update(key[0] for key in getattr(instance, '_summary_keys_before', ()))
+    invalidate_salary_cache(*employee_ids)
+
+
+@receiver(pre_save, sender=TaskList)
+def remember_task_list_name(sender, instance, **kwargs):
+    instance._name_before = None if instance._state.adding else (
+        TaskList.objects.filter(pk=instance.pk).values_list('name', flat=True).first())
+
+
+@receiver(post_save, sender=TaskList)
+def invalidate_board_salary_cache(sender, instance, created, **kwargs):
+    # El % de tareas cumplidas cuenta las de la lista 'Hecho': renombrar
+    # cambia los contadores por KPI de los resúmenes de sus tareas.
+    if created:
+        return
+    keys = set()
+    if getattr(instance, '_name_before', None) != instance.name:
+        for task in instance.tasks.only('assigned_to_id', 'completed_at', 'due_date'):
+            keys |= summary_keys(task)
+        refresh_summaries(keys)
+    invalidate_salary_cache(instance.board.employee_id, *(key[0] for key in keys))
+
+
+@receiver(post_save, sender=CompanySettings)
+def invalidate_company_salary_cache(sender, **kwargs):
+    invalidate_all_salary_cache()
+
+
+@receiver(post_save, sender=Feriado)
+@receiver(post_delete, sender=Feriado)
+def invalidate_business_calendar(sender, **kwargs):
+    # Cambian los días hábiles del mes y con ellos las horas base 'daily'
+    calendario.invalidate()
+    invalidate_all_salary_cache()
+
+
+# --- Caché de instancias e identidades de Dolibarr (identidades.py) ---
+
+@receiver(post_save, sender=DolibarrInstance)
+@receiver(post_delete, sender=DolibarrInstance)
+@receiver(post_save, sender=DolibarrUserIdentity)
+@receiver(post_delete, sender=DolibarrUserIdentity)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_dolibarr_lookups(sender, **kwargs):
+    identidades.invalidate()
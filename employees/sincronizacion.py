@@ -0,0 +1,242 @@
+"""
+Reconciliación por API (pull) de las ventas de Dolibarr: sincronizar_dolibarr.
+
+Si se pierde un webhook, SalesRecord queda desfasado sin aviso y las
+comisiones salen mal. Este módulo recorre presupuestos, pedidos y facturas
+de cada instancia con API (api_base_url y api_key cargados) desde su cursor
+(fecha de modificación, t.tms) y los convierte en los mismos eventos que
+manda el webhook. Cada página se compara contra los SalesRecord locales en
+una sola consulta y se descartan los objetos sin cambios; el resto pasa por
+WebhookBatchProcessor, o sea por las mismas reglas que process_bill_validate
+y compañía.
+
+Los recursos van en orden (presupuestos, pedidos, facturas) para que una
+factura encuentre ya guardado su presupuesto o pedido. Cada página se aplica
+en su transacción junto con el avance del cursor, así un corte a mitad de
+camino retoma desde la última página aplicada. Las fechas de pago se piden
+(un GET por factura) solo para facturas pagadas en Dolibarr que localmente
+no tienen payment_date, y antes de abrir esa transacción, para no retener
+bloqueos durante la red.
+"""
+import logging
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import dolibarr_api
+from .models import CursorDolibarr, DolibarrInstance, DolibarrUserIdentity, SalesRecord
+
+logger = logging.getLogger(__name__)
+
+# recurso de la API -> trigger_code del webhook equivalente
+RECURSOS = {
+    'proposals': 'PROPAL_VALIDATE',
+    'orders': 'ORDER_VALIDATE',
+    'invoices': 'BILL_VALIDATE',
+}
+# Se relee un margen antes del cursor: los tms de un mismo segundo o con
+# relojes desparejos no se pierden, y releer lo ya aplicado no cambia nada.
+SOLAPAMIENTO = timedelta(minutes=5)
+
+
+def instancias_con_api():
+    return DolibarrInstance.objects.exclude(api_base_url='').exclude(api_key='')
+
+
+def _momento(valor):
+    """Timestamp Unix o texto 'AAAA-MM-DD[ HH:MM:SS]' de Dolibarr -> datetime UTC."""
+    if valor in (None, ''):
+        return None
+    try:
+        return datetime.fromtimestamp(int(valor), dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        return datetime.fromisoformat(str(valor).strip()).replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        return None
+
+
+def _fecha(valor):
+    momento = _momento(valor)
+    return timezone.localtime(momento).date().isoformat() if momento else None
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _vinculado(obj, tipo):
+    """Primer id de linkedObjectsIds[tipo] ('propal', 'commande')."""
+    vinculados = (obj.get('linkedObjectsIds') or {}).get(tipo)
+    if isinstance(vinculados, dict):
+        vinculados = list(vinculados.values())
+    if isinstance(vinculados, list) and vinculados:
+        return _entero(vinculados[0])
+    return None
+
+
+def evento(recurso, obj):
+    """Evento de webhook equivalente a un objeto de la API, o None si el
+    objeto sigue en borrador."""
+    if _entero(obj.get('statut', obj.get('status'))) in (None, 0):
+        return None
+    datos = {
+        'id': obj.get('id'),
+        'ref': obj.get('ref'),
+        'total_ht': obj.get('total_ht'),
+        'fk_user_author': obj.get('fk_user_author') or obj.get('user_author_id'),
+        'date_validation': _fecha(obj.get('date_validation') or obj.get('date')),
+    }
+    if recurso == 'orders':
+        datos['fk_propal'] = _vinculado(obj, 'propal')
+    elif recurso == 'invoices':
+        datos.update(
+            type=obj.get('type', 0),
+            fk_propal=_vinculado(obj, 'propal'),
+            fk_commande=_vinculado(obj, 'commande'),
+            fk_facture_source=obj.get('fk_facture_source'),
+        )
+    return {'trigger_code': RECURSOS[recurso], 'object': datos}
+
+
+def _status_local(ev):
+    if ev['trigger_code'] == 'PROPAL_VALIDATE':
+        return 'proforma'
+    if ev['trigger_code'] == 'ORDER_VALIDATE':
+        return 'order'
+    return 'credit_note' if _entero(ev['object'].get('type')) == 2 else 'invoiced'
+
+
+def _sin_cambios(ev, record, empleados):
+    """True si aplicar `ev` dejaría `record` como está."""
+    if record is None:
+        return False
+    obj = ev['object']
+    try:
+        monto = Decimal(str(obj.get('total_ht')))
+    except (InvalidOperation, ValueError):
+        return False
+    if record.status == 'credit_note':
+        monto = -abs(monto)
+    elif empleados.get(_entero(obj.get('fk_user_author'))) != record.employee_id:
+        return False
+    return (
+        record.dolibarr_ref == str(obj.get('ref', ''))[:100]
+        and record.amount_untaxed == monto
+        and record.date.isoformat() == obj.get('date_validation')
+        and record.origin_proforma_id == _entero(obj.get('fk_propal'))
+        and (record.status == 'proforma'
+             or record.origin_order_id == _entero(obj.get('fk_commande')))
+    )
+
+
+def _cambios(instance, eventos, empleados):
+    """Los eventos de una página que modifican algún SalesRecord."""
+    ids = {_entero(ev['object']['id']) for ev in eventos}
+    locales = {
+        (record.dolibarr_id, record.status): record
+        for record in SalesRecord.objects.filter(dolibarr_instance=instance, dolibarr_id__in=ids)
+    }
+    return [ev for ev in eventos
+            if not _sin_cambios(ev, locales.get((_entero(ev['object']['id']), _status_local(ev))),
+                                empleados)]
+
+
+def _fechas_de_pago(http, instance, pagadas):
+    """{dolibarr_id: fecha del último pago} de las facturas pagadas en
+    Dolibarr que localmente no tienen payment_date. Un GET por factura, fuera
+    de la transacción de la página."""
+    ya_pagadas = set(SalesRecord.objects.filter(
+        dolibarr_instance=instance, payment_date__isnull=False, dolibarr_id__in=pagadas,
+    ).values_list('dolibarr_id', flat=True))
+    fechas = {}
+    for dolibarr_id in set(pagadas) - ya_pagadas - {None}:
+        pagos = [_fecha(pago.get('date')) for pago in dolibarr_api.pagos_factura(http, dolibarr_id)]
+        pagos = [f for f in pagos if f]
+        if pagos:
+            fechas[dolibarr_id] = max(pagos)
+    return fechas
+
+
+def _eventos_de_pago(instance, fechas):
+    """PAYMENT_CUSTOMER_CREATE para las facturas de `fechas` que, ya aplicada
+    la página, siguen facturadas y sin payment_date."""
+    impagas = SalesRecord.objects.filter(
+        dolibarr_instance=instance, status='invoiced', payment_date__isnull=True,
+        dolibarr_id__in=fechas,
+    ).values_list('dolibarr_id', flat=True)
+    return [{'trigger_code': 'PAYMENT_CUSTOMER_CREATE',
+             'object': {'invoice_ids': [dolibarr_id], 'date_payment': fechas[dolibarr_id]}}
+            for dolibarr_id in sorted(impagas)]
+
+
+def _aplicar(instance, eventos, resultado):
+    from .api_views import DolibarrWebhookBatchView
+
+    for r in DolibarrWebhookBatchView().process_batch(instance, eventos):
+        if r['status'] == 'error':
+            resultado['errores'] += 1
+            logger.warning("Sincronización '%s': evento rechazado (%s): %s",
+                           instance.name, eventos[r['index']]['object'], r.get('error'))
+        else:
+            resultado['aplicados'] += 1
+
+
+def sincronizar_recurso(http, instance, recurso, empleados, desde=None):
+    """Lee `recurso` de una instancia desde su cursor (o desde `desde`) y
+    aplica los cambios. Devuelve {'leidos', 'aplicados', 'errores', 'pagos'}."""
+    cursor, _ = CursorDolibarr.objects.get_or_create(dolibarr_instance=instance, recurso=recurso)
+    inicio = desde or (cursor.modificado_hasta - SOLAPAMIENTO if cursor.modificado_hasta else None)
+    resultado = {'leidos': 0, 'aplicados': 0, 'errores': 0, 'pagos': 0}
+    pagina = 0
+    while True:
+        objetos = dolibarr_api.listar(http, recurso, inicio, pagina)
+        if not objetos:
+            break
+        resultado['leidos'] += len(objetos)
+        eventos = [ev for ev in (evento(recurso, obj) for obj in objetos) if ev]
+        modificados = [m for m in (_momento(obj.get('date_modification') or obj.get('tms'))
+                                   for obj in objetos) if m]
+        fechas_pago = {}
+        if recurso == 'invoices':
+            # La red va antes de la transacción: no retener bloqueos de filas
+            # mientras se esperan (y reintentan) los GET de pagos
+            pagadas = [_entero(obj.get('id')) for obj in objetos
+                       if _entero(obj.get('paye')) == 1 and _entero(obj.get('type')) != 2]
+            fechas_pago = _fechas_de_pago(http, instance, pagadas) if pagadas else {}
+        with transaction.atomic():
+            cambios = _cambios(instance, eventos, empleados)
+            if cambios:
+                _aplicar(instance, cambios, resultado)
+            if fechas_pago:
+                pagos = _eventos_de_pago(instance, fechas_pago)
+                if pagos:
+                    _aplicar(instance, pagos, resultado)
+                    resultado['pagos'] += len(pagos)
+            if modificados and (cursor.modificado_hasta is None
+                                or max(modificados) > cursor.modificado_hasta):
+                cursor.modificado_hasta = max(modificados)
+                cursor.save(update_fields=['modificado_hasta', 'actualizado'])
+        if len(objetos) < dolibarr_api.TAM_PAGINA:
+            break
+        pagina += 1
+    return resultado
+
+
+def sincronizar_instancia(instance, desde=None):
+    """Sincroniza presupuestos, pedidos y facturas de una instancia.
+    Devuelve {recurso: resultado de sincronizar_recurso}."""
+    empleados = dict(DolibarrUserIdentity.objects.filter(
+        dolibarr_instance=instance).values_list('dolibarr_user_id', 'employee_id'))
+    with dolibarr_api.cliente(instance) as http:
+        resultado = {recurso: sincronizar_recurso(http, instance, recurso, empleados, desde)
+                     for recurso in RECURSOS}
+    logger.info("Sincronización de '%s': %s", instance.name, resultado)
+    return resultado
@@ -0,0 +1,59 @@
+"""
+Caché por proceso de los modelos singleton (CompanySettings, SiteConfiguration).
+
+`load()` de esos modelos devuelve una copia de la instancia guardada en
+memoria del proceso en vez de hacer get_or_create(pk=1) en cada render y en
+cada cálculo de nómina. La copia vale mientras coincida su token
+CacheVersion ('singleton:<modelo>'), que save() renueva en la base: la
+invalidación llega a todos los workers en su siguiente load(), sin depender
+de que la caché de Django sea compartida (igual que reglas_kpi y
+calendario). Así un worker nunca calcula un salario con una copia vieja de
+CompanySettings después de que otro la guardó.
+
+Solo se llena fuera de transacciones, para no quedarse con datos que un
+rollback podría descartar.
+"""
+import copy
+import threading
+
+from django.db import connection
+
+_lock = threading.Lock()
+_entries = {}  # version_key -> (instancia, token)
+
+
+def _version_key(model):
+    return f'singleton:{model._meta.label_lower}'
+
+
+def load(model):
+    """Instancia pk=1 de `model` (creándola si falta), desde la copia del
+    proceso cuando sigue vigente. Una consulta (el token) en el camino
+    normal."""
+    from .models import CacheVersion
+
+    key = _version_key(model)
+    token = CacheVersion.current(key)
+    with _lock:
+        entry = _entries.get(key)
+    if entry and entry[1] == token:
+        return copy.copy(entry[0])
+
+    obj, creado = model.objects.get_or_create(pk=1)
+    if creado:
+        # save() acaba de renovar el token
+        token = CacheVersion.current(key)
+    if not connection.in_atomic_block:
+        with _lock:
+            _entries[key] = (copy.copy(obj), token)
+    return obj
+
+
+def invalidate(model):
+    """Descarta la copia de este proceso y renueva el token para el resto."""
+    from .models import CacheVersion
+
+    key = _version_key(model)
+    CacheVersion.bump(key)
+    with _lock:
+        _entries.pop(key, None)
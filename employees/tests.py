@@ -1,13 +1,22 @@
 import calendar
+from io import StringIO
 from unittest import mock
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework.test import APIClient
+from caldav.models import CalendarEvent
 from .models import (
     Employee, Salary, WorkLog, KPI, BonusRule, KPIBonusTier, TaskBoard, TaskList, Task,
-    ManualKpiEntry, EmployeePerformanceRecord, JobProfile
+    ManualKpiEntry, EmployeePerformanceRecord, JobProfile, CompanySettings, SiteConfiguration, CacheVersion
 )
+from . import singletons
+from .recurrentes import materializar, ocurrencias
+from .serializers import TaskSerializer
 from decimal import Decimal
 from datetime import date, datetime, timedelta, timezone as dt_timezone
 from django.utils import timezone
@@ -270,8 +279,10 @@ class RecurringTaskTest(TestCase):
         self.assertEqual(Task.objects.filter(is_recurring=True).count(), 1)
         self.assertEqual(Task.objects.filter(is_recurring=False).count(), 1)
 
-        # 3. Trigger on-demand generation by accessing the task list
+        # 3. Listing is read-only; the scheduled materializer creates instances
         self.api_client.get(url)
+        self.assertEqual(Task.objects.filter(is_recurring=False).count(), 1)
+        call_command('materializar_recurrentes', stdout=StringIO())
 
         # 4. Assert that the next task instance is created
         # We expect two instances to have been created: one for last week and one for this week.
@@ -301,7 +312,7 @@ class RecurringTaskTest(TestCase):
         self.assertEqual(Task.objects.filter(is_recurring=False).count(), 1)
 
         # 2. Trigger generation
-        self.api_client.get(url)
+        call_command('materializar_recurrentes', stdout=StringIO())
 
         # After GET, tasks for day -2, -1, and 0 (today) should be created.
         # The initial instance for day -3 already exists. So, 3 new tasks.
@@ -309,13 +320,13 @@ class RecurringTaskTest(TestCase):
         self.assertEqual(Task.objects.filter(is_recurring=False).count(), 4)
 
         # 3. Trigger generation again
-        self.api_client.get(url)
+        call_command('materializar_recurrentes', stdout=StringIO())
 
         # The number of tasks should not change, proving idempotency.
         self.assertEqual(Task.objects.filter(is_recurring=False).count(), 4)
 
     @mock.patch('django.utils.timezone.now', return_value=FROZEN_NOW)
-    def test_superuser_generates_tasks_for_specific_employee(self, mock_now):
+    def test_materializer_generates_tasks_for_specific_employee(self, mock_now):
         # 1. Create a recurring task for a specific employee
         start_datetime = timezone.now() - timedelta(days=2)
         end_date = (timezone.now() + timedelta(days=10)).date()
@@ -333,15 +344,101 @@ class RecurringTaskTest(TestCase):
         response = self.api_client.post(url, task_data, format='json')
         self.assertEqual(response.status_code, 201)
 
-        # 2. Access the API as a superuser for that specific employee
-        # This should trigger the generation of missing tasks for that employee.
-        url_with_param = f"{url}?employee_id={self.employee.id}"
-        self.api_client.get(url_with_param)
+        # 2. Materialize only that employee's templates
+        materializar(employee_ids=[self.employee.id])
 
         # 3. Assert that tasks were generated
         # Initial task (day -2) + generated tasks (day -1, day 0) = 3 tasks
         self.assertEqual(Task.objects.filter(is_recurring=False, assigned_to=self.employee).count(), 3)
 
+    @mock.patch('django.utils.timezone.now', return_value=FROZEN_NOW)
+    def test_materializer_bulk_pass_and_calendar_events(self, mock_now):
+        self.employee.user = User.objects.create_user('recurrente', password='x')
+        self.employee.save()
+        for n in range(5):
+            Task.objects.create(
+                list=self.task_list, assigned_to=self.employee, title=f'Plantilla {n}', order=n,
+                is_recurring=True, recurrence_frequency='daily',
+                due_date=timezone.now() - timedelta(days=2),
+                recurrence_end_date=(timezone.now() + timedelta(days=30)).date())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(materializar(horizonte_dias=1), 20)  # días -2 a +1 de cada plantilla
+        # una lectura de plantillas, un INSERT de tareas y otro de eventos
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        # plantillas + días ya materializados, sin importar cuántas plantillas haya
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('SELECT')
+                              and 'FROM "employees_task"' in q['sql']]), 2)
+        self.assertEqual(CalendarEvent.objects.filter(task__parent_task__isnull=False).count(), 20)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.api_client.get(reverse('task-list'))
+        self.assertFalse([q for q in queries if q['sql'].startswith('INSERT')])
+
+
+class RecurrenceEngineTest(TestCase):
+    """Motor de recurrencia (rrule): intervalo, días de la semana y signal."""
+
+    def setUp(self):
+        self.employee = Employee.objects.create(name='Rrule', email='rrule@example.com',
+                                                hire_date=date(2023, 1, 1))
+        board = TaskBoard.objects.create(employee=self.employee, name='Board')
+        self.pendiente = TaskList.objects.create(board=board, name='Pendiente', order=1)
+
+    def _plantilla(self, due_date, **campos):
+        campos.setdefault('recurrence_end_date', date(2025, 12, 31))
+        return Task.objects.create(list=self.pendiente, assigned_to=self.employee, title='Informe',
+                                   order=1, is_recurring=True, due_date=due_date, **campos)
+
+    def _fechas(self, plantilla):
+        return sorted(timezone.localtime(t.due_date).date()
+                      for t in Task.objects.filter(parent_task=plantilla))
+
+    @mock.patch('django.utils.timezone.now', return_value=FROZEN_NOW)
+    def test_byday_e_intervalo(self, mock_now):
+        # Lunes 26/05, cada dos semanas los lunes y jueves
+        plantilla = self._plantilla(FROZEN_NOW - timedelta(days=21), recurrence_frequency='weekly',
+                                    recurrence_interval=2, recurrence_byday='MO,TH')
+        materializar()
+        self.assertEqual(self._fechas(plantilla), [
+            date(2025, 5, 26), date(2025, 5, 29), date(2025, 6, 9), date(2025, 6, 12)])
+
+        Task.objects.filter(parent_task=plantilla, due_date__date=date(2025, 6, 12)).delete()
+        self.assertEqual(materializar(horizonte_dias=14), 3)  # 12/06 de nuevo, 23/06 y 26/06
+        self.assertEqual(materializar(horizonte_dias=14), 0)
+
+    def test_signal_semanal_usa_el_mismo_motor(self):
+        vence = timezone.make_aware(datetime(2025, 6, 2, 9, 0))
+        plantilla = self._plantilla(vence, recurrence_frequency='weekly', recurrence_interval=3)
+        plantilla.completed_at = timezone.now()
+        plantilla.save()
+        siguiente = Task.objects.get(parent_task=plantilla)
+        self.assertEqual(siguiente.due_date, vence + timedelta(weeks=3))
+        self.assertEqual((siguiente.recurrence_interval, siguiente.is_recurring), (3, True))
+
+    def test_fin_de_mes_no_saltea_meses(self):
+        plantilla = self._plantilla(timezone.make_aware(datetime(2025, 1, 31, 9, 0)),
+                                    recurrence_frequency='monthly')
+        self.assertEqual([m.date() for m in ocurrencias(plantilla, date(2025, 1, 1), date(2025, 6, 30))], [
+            date(2025, 1, 31), date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30),
+            date(2025, 5, 31), date(2025, 6, 30)])
+        self.assertEqual(timezone.localtime(ocurrencias(plantilla, date(2025, 2, 1), date(2025, 2, 28))[0]).hour, 9)
+
+    def test_29_de_febrero_anual(self):
+        plantilla = self._plantilla(timezone.make_aware(datetime(2024, 2, 29, 9, 0)),
+                                    recurrence_frequency='yearly', recurrence_end_date=date(2028, 12, 31))
+        self.assertEqual([m.date() for m in ocurrencias(plantilla, date(2024, 1, 1), date(2028, 12, 31))], [
+            date(2024, 2, 29), date(2025, 2, 28), date(2026, 2, 28), date(2027, 2, 28), date(2028, 2, 29)])
+
+    def test_byday_invalido(self):
+        serializer = TaskSerializer(data={
+            'title': 'X', 'order': 1, 'list': self.pendiente.pk, 'assigned_to': self.employee.pk,
+            'is_recurring': True, 'recurrence_frequency': 'weekly',
+            'recurrence_end_date': '2025-12-31', 'recurrence_byday': 'MO,XX'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('recurrence_byday', serializer.errors)
+
 
 class SalaryViewTest(TestCase):
     def setUp(self):
@@ -540,3 +637,49 @@ class PostLoginRedirectTest(TestCase):
                                     follow=True)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request['PATH_INFO'], reverse('task_board'))
+
+
+class SingletonCacheTest(TransactionTestCase):
+    """CompanySettings/SiteConfiguration.load() reutilizan la copia del proceso."""
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        singletons._entries.clear()
+
+    def tearDown(self):
+        cache.clear()
+        singletons._entries.clear()
+
+    def test_load_solo_lee_el_token_tras_la_primera(self):
+        CompanySettings.load()
+        SiteConfiguration.load()
+        with CaptureQueriesContext(connection) as ctx:
+            settings = CompanySettings.load()
+            SiteConfiguration.load()
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertTrue(all('employees_cacheversion' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(settings.pk, 1)
+
+    def test_save_invalida(self):
+        settings = CompanySettings.load()
+        settings.base_hours = Decimal('120.00')
+        settings.save()
+        self.assertEqual(CompanySettings.load().base_hours, Decimal('120.00'))
+
+    def test_otro_worker_invalida_por_token(self):
+        CompanySettings.load()
+        CompanySettings.objects.filter(pk=1).update(base_hours=Decimal('40.00'))
+        self.assertNotEqual(CompanySettings.load().base_hours, Decimal('40.00'))
+        # Otro proceso guardó: renovó el token en la base (sin caché compartida)
+        CacheVersion.bump('singleton:employees.companysettings')
+        self.assertEqual(CompanySettings.load().base_hours, Decimal('40.00'))
+
+    def test_copia_no_comparte_estado(self):
+        CompanySettings.load().base_hours = Decimal('1.00')
+        self.assertNotEqual(CompanySettings.load().base_hours, Decimal('1.00'))
+
+    def test_dentro_de_transaccion_no_llena_la_cache(self):
+        with transaction.atomic():
+            CompanySettings.load()
+        self.assertEqual(singletons._entries, {})
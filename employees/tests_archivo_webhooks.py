@@ -0,0 +1,80 @@
+"""Tests de la retención de WebhookLog (compactar y archivar)."""
+import gzip
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .archivo_webhooks import archivar, buscar_archivados, compactar
+from .models import WebhookArchive, WebhookLog
+
+HEADERS = {'X-Dolibarr-Professional-Id': 'pro-1', 'X-Dolibarr-Signature': 'abc'}
+
+
+class WebhookRetencionTest(TestCase):
+    def setUp(self):
+        self.directorio = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directorio)
+        ajuste = override_settings(WEBHOOK_ARCHIVE_DIR=self.directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def _log(self, dias, status='processed', trigger='BILL_VALIDATE'):
+        log = WebhookLog.objects.create(
+            status=status, headers=HEADERS,
+            payload={'trigger_code': trigger, 'object': {'id': 1, 'ref': 'Ñandú'}})
+        WebhookLog.objects.filter(pk=log.pk).update(
+            received_at=timezone.now() - timedelta(days=dias))
+        return log
+
+    def test_columnas_promovidas(self):
+        log = self._log(0)
+        self.assertEqual((log.trigger_code, log.professional_id), ('BILL_VALIDATE', 'pro-1'))
+        lote = WebhookLog.objects.create(payload={'events': []})
+        self.assertEqual((lote.trigger_code, lote.professional_id), ('BATCH', ''))
+
+    def test_compactar_solo_procesados_viejos(self):
+        viejo, reciente, error = self._log(10), self._log(1), self._log(10, status='error')
+        self.assertEqual(compactar(7), 1)
+        self.assertEqual(WebhookLog.objects.get(pk=viejo.pk).headers, {})
+        self.assertEqual(WebhookLog.objects.get(pk=reciente.pk).headers, HEADERS)
+        self.assertEqual(WebhookLog.objects.get(pk=error.pk).headers, HEADERS)
+
+    def test_archivar_y_buscar(self):
+        viejos = [self._log(100, trigger=t) for t in ('BILL_VALIDATE', 'PRODUCT_CREATE', 'BILL_VALIDATE')]
+        en_cola = self._log(100, status='retry')
+        reciente = self._log(5)
+
+        self.assertEqual(archivar(90, tam_archivo=2), {'archivos': 2, 'logs': 3})
+        self.assertEqual(set(WebhookLog.objects.values_list('pk', flat=True)), {en_cola.pk, reciente.pk})
+        primero, segundo = WebhookArchive.objects.all()
+        self.assertEqual((primero.primer_id, primero.ultimo_id, primero.cantidad),
+                         (viejos[0].pk, viejos[1].pk, 2))
+        self.assertEqual(primero.trigger_codes, {'BILL_VALIDATE': 1, 'PRODUCT_CREATE': 1})
+        self.assertEqual(primero.professional_ids, ['pro-1'])
+        self.assertEqual(sorted(p.name for p in self.directorio.iterdir()),
+                         sorted([primero.archivo, segundo.archivo]))
+
+        with gzip.open(self.directorio / segundo.archivo, 'rt', encoding='utf-8') as entrada:
+            self.assertEqual(json.loads(entrada.readline())['payload']['object']['ref'], 'Ñandú')
+
+        [log] = buscar_archivados(log_id=viejos[1].pk)
+        self.assertEqual((log['trigger_code'], log['headers']), ('PRODUCT_CREATE', HEADERS))
+        self.assertEqual(len(list(buscar_archivados(trigger_code='BILL_VALIDATE'))), 2)
+        self.assertEqual(list(buscar_archivados(desde=timezone.now() - timedelta(days=50))), [])
+
+    def test_comando(self):
+        log = self._log(100)
+        salida = StringIO()
+        call_command('archivar_webhooks', stdout=salida)
+        self.assertIn('1 archivados en 1 archivo(s)', salida.getvalue())
+
+        salida = StringIO()
+        call_command('archivar_webhooks', '--buscar', str(log.pk), stdout=salida)
+        self.assertEqual(json.loads(salida.getvalue())['id'], log.pk)
@@ -1,6 +1,7 @@
 """Tests de Fase 1: ausencias, recibos de nómina (snapshot) y clawback de comisiones."""
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
@@ -8,11 +9,12 @@ from django.test import TestCase
 from django.urls import reverse
 
 from .ausencias import aprobar_solicitud, rechazar_solicitud, cancelar_solicitud
+from .calendario import BusinessCalendar
 from .models import (
-    CommissionBalance, DolibarrInstance, Employee, ReciboNomina, Salary,
+    CierreNomina, CommissionBalance, DolibarrInstance, Employee, Feriado, ReciboNomina, Salary,
     SalesRecord, SolicitudAusencia, TipoAusencia, WorkLog,
 )
-from .nomina import generar_recibo, generar_recibos_mes
+from .nomina import ejecutar_cierre_mes, generar_recibo, generar_recibos_mes
 
 
 def _mk_employee(name='Emp', email=None, with_user=True, commission=0):
@@ -49,6 +51,14 @@ class AusenciasServiceTest(TestCase):
         self.assertTrue(all(log.hours_worked == 8 for log in logs))
         self.assertTrue(all(log.date.weekday() < 5 for log in logs))
 
+    def test_feriado_no_es_dia_habil(self):
+        Feriado.objects.create(fecha=date(2026, 6, 3), nombre='Feriado de prueba')
+        s = self._solicitud(date(2026, 6, 1), date(2026, 6, 7))
+        self.assertEqual(s.dias_habiles, Decimal('4'))
+        aprobar_solicitud(s, self.aprobador)
+        self.assertFalse(WorkLog.objects.filter(date=date(2026, 6, 3)).exists())
+        self.assertEqual(WorkLog.objects.filter(ausencia=s).count(), 4)
+
     def test_aprobar_no_pisa_worklog_existente(self):
         WorkLog.objects.create(employee=self.employee, date=date(2026, 6, 2),
                                hours_worked=4, overtime_hours=2)
@@ -115,6 +125,40 @@ class AusenciasServiceTest(TestCase):
         self.assertFalse(CalendarEvent.objects.filter(uid=f"ausencia-{s.pk}@payroll").exists())
 
 
+class BusinessCalendarTest(TestCase):
+    def setUp(self):
+        self.feriados = {date(2025, 12, 25), date(2026, 1, 1), date(2026, 5, 1)}
+        self.calendario = BusinessCalendar(self.feriados)
+
+    def _habiles(self, inicio, fin):
+        dias = []
+        dia = inicio
+        while dia <= fin:
+            if dia.weekday() < 5 and dia not in self.feriados:
+                dias.append(dia)
+            dia += timedelta(days=1)
+        return dias
+
+    def test_coincide_con_recorrer_dia_por_dia(self):
+        rangos = [
+            (date(2025, 12, 20), date(2026, 1, 10)),  # cruza el año y dos feriados
+            (date(2026, 1, 1), date(2026, 1, 1)),      # feriado solo
+            (date(2026, 5, 2), date(2026, 5, 3)),      # fin de semana
+            (date(2024, 2, 28), date(2026, 3, 1)),     # bisiesto y varios años
+        ]
+        for inicio, fin in rangos:
+            esperado = self._habiles(inicio, fin)
+            self.assertEqual(self.calendario.business_days(inicio, fin), esperado, (inicio, fin))
+            self.assertEqual(self.calendario.count(inicio, fin), len(esperado), (inicio, fin))
+
+    def test_rango_invertido_y_mes(self):
+        self.assertEqual(self.calendario.count(date(2026, 1, 9), date(2026, 1, 5)), 0)
+        self.assertEqual(self.calendario.business_days(date(2026, 1, 9), date(2026, 1, 5)), [])
+        self.assertEqual(self.calendario.month_count(2026, 5), 20)  # 21 hábiles - 1 de mayo
+        self.assertFalse(self.calendario.is_business_day(date(2025, 12, 25)))
+        self.assertTrue(self.calendario.is_business_day(date(2025, 12, 26)))
+
+
 class AusenciasViewsTest(TestCase):
     def setUp(self):
         self.employee = _mk_employee('Solicitante')
@@ -222,8 +266,10 @@ class ReciboNominaTest(TestCase):
         self.client.login(username='asalariado', password='password')
         self.assertEqual(self.client.get(reverse('nomina_cierre')).status_code, 403)
         self.client.login(username='boss', password='password')
-        response = self.client.post(reverse('nomina_cierre'), {'year': 2023, 'month': 1})
+        with mock.patch('employees.nomina.threading.Thread'):
+            response = self.client.post(reverse('nomina_cierre'), {'year': 2023, 'month': 1})
         self.assertEqual(response.status_code, 302)
+        ejecutar_cierre_mes(CierreNomina.objects.get().pk)
         self.assertEqual(ReciboNomina.objects.count(), 1)
 
 
@@ -8,9 +8,11 @@ from django.contrib.auth.models import User
 from django.test import TestCase
 from django.urls import reverse
 
-from .models import (DolibarrInstance, DolibarrUserIdentity, Employee, Salary,
-                     WorkLog)
-from .nomina import enviar_recibos_dolibarr, generar_recibo
+from . import dolibarr_api
+from .models import (DolibarrInstance, DolibarrUserIdentity, Employee, EnvioDolibarr,
+                     Salary, WorkLog)
+from .nomina import (ejecutar_envio_dolibarr, enviar_recibos_dolibarr, generar_recibo,
+                     iniciar_envio_dolibarr)
 
 
 def _mock_resp(status_code=200, json_data=41):
@@ -39,7 +41,7 @@ class DolibarrPushTest(TestCase):
         self.recibo = generar_recibo(self.employee, 2023, 1)
 
     def test_exito_guarda_id_y_payload(self):
-        with mock.patch('employees.dolibarr_api.httpx.post',
+        with mock.patch('employees.dolibarr_api.httpx.Client.post',
                         return_value=_mock_resp(200, 41)) as post:
             resultado = enviar_recibos_dolibarr(2023, 1)
 
@@ -54,12 +56,17 @@ class DolibarrPushTest(TestCase):
         self.assertEqual(kwargs['json']['paye'], 0)
         self.assertIn('Nómina 2023-01', kwargs['json']['label'])
         self.assertIn('Ana Nómina', kwargs['json']['label'])
-        self.assertEqual(kwargs['headers']['DOLAPIKEY'], 'DOLKEY123')
+        self.assertEqual(post.call_args.args, ('salaries',))
+        # URL base y DOLAPIKEY viajan en el cliente de la instancia
+        with dolibarr_api.cliente(self.instancia) as http:
+            self.assertEqual(http.headers['DOLAPIKEY'], 'DOLKEY123')
+            self.assertEqual(str(http.build_request('post', 'salaries').url),
+                             'https://erp.example.com/api/index.php/salaries')
 
     def test_idempotente_no_reenvia(self):
         self.recibo.dolibarr_salary_id = 41
         self.recibo.save(update_fields=['dolibarr_salary_id'])
-        with mock.patch('employees.dolibarr_api.httpx.post') as post:
+        with mock.patch('employees.dolibarr_api.httpx.Client.post') as post:
             resultado = enviar_recibos_dolibarr(2023, 1)
         post.assert_not_called()
         self.assertEqual(len(resultado['ya_sincronizados']), 1)
@@ -67,7 +74,7 @@ class DolibarrPushTest(TestCase):
 
     def test_sin_mapeo_se_omite(self):
         DolibarrUserIdentity.objects.all().delete()
-        with mock.patch('employees.dolibarr_api.httpx.post') as post:
+        with mock.patch('employees.dolibarr_api.httpx.Client.post') as post:
             resultado = enviar_recibos_dolibarr(2023, 1)
         post.assert_not_called()
         self.assertEqual([e.name for e in resultado['sin_mapeo']], ['Ana Nómina'])
@@ -83,10 +90,14 @@ class DolibarrPushTest(TestCase):
             employee=otro, dolibarr_instance=self.instancia, dolibarr_user_id=9)
         generar_recibo(otro, 2023, 1)
 
-        # Ana (orden alfabético primero) falla con 403; Beto pasa OK.
-        with mock.patch('employees.dolibarr_api.httpx.post',
-                        side_effect=[_mock_resp(403, 'Forbidden'), _mock_resp(200, 42)]):
+        # Ana (fk_user 7) falla con 403; Beto pasa OK. Los dos comparten cliente.
+        def responder(url, json, **kwargs):
+            return _mock_resp(403, 'Forbidden') if json['fk_user'] == 7 else _mock_resp(200, 42)
+
+        with mock.patch('employees.dolibarr_api.httpx.Client.post', side_effect=responder), \
+                mock.patch('employees.dolibarr_api.cliente', wraps=dolibarr_api.cliente) as cliente:
             resultado = enviar_recibos_dolibarr(2023, 1)
+        cliente.assert_called_once()
 
         self.assertEqual(len(resultado['con_error']), 1)
         self.assertEqual(len(resultado['enviados']), 1)
@@ -95,21 +106,41 @@ class DolibarrPushTest(TestCase):
         self.assertIn('HTTP 403', self.recibo.dolibarr_error)
 
     def test_timeout_no_aborta_lote(self):
-        with mock.patch('employees.dolibarr_api.httpx.post',
-                        side_effect=httpx.ConnectTimeout('timeout')):
+        with mock.patch('employees.dolibarr_api.httpx.Client.post',
+                        side_effect=httpx.ConnectTimeout('timeout')) as post, \
+                mock.patch('employees.dolibarr_api.time.sleep'):
             resultado = enviar_recibos_dolibarr(2023, 1)
+        self.assertEqual(post.call_count, dolibarr_api.REINTENTOS)
         self.assertEqual(len(resultado['con_error']), 1)
         self.recibo.refresh_from_db()
         self.assertIsNone(self.recibo.dolibarr_salary_id)
         self.assertTrue(self.recibo.dolibarr_error)
 
+    def test_reintenta_si_dolibarr_no_recibio(self):
+        with mock.patch('employees.dolibarr_api.httpx.Client.post', side_effect=[
+                    _mock_resp(503, 'Service Unavailable'), httpx.ConnectError('refused'),
+                    _mock_resp(200, 41)]) as post, \
+                mock.patch('employees.dolibarr_api.time.sleep') as sleep:
+            resultado = enviar_recibos_dolibarr(2023, 1)
+        self.assertEqual(len(resultado['enviados']), 1)
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.5, 1.0])
+
+    def test_no_reintenta_si_el_post_pudo_llegar(self):
+        for fallo in (_mock_resp(500, ['amount required']), httpx.ReadTimeout('lento')):
+            with mock.patch('employees.dolibarr_api.httpx.Client.post', side_effect=[fallo]) as post, \
+                    mock.patch('employees.dolibarr_api.time.sleep'):
+                resultado = enviar_recibos_dolibarr(2023, 1)
+            self.assertEqual(post.call_count, 1)
+            self.assertEqual(len(resultado['con_error']), 1)
+
     def test_ambiguedad_varias_instancias(self):
         otra = DolibarrInstance.objects.create(
             name='Empresa2', professional_id='PROF2', api_secret='hmac2',
             api_base_url='https://erp2.example.com', api_key='DOLKEY456')
         DolibarrUserIdentity.objects.create(
             employee=self.employee, dolibarr_instance=otra, dolibarr_user_id=8)
-        with mock.patch('employees.dolibarr_api.httpx.post') as post:
+        with mock.patch('employees.dolibarr_api.httpx.Client.post') as post:
             resultado = enviar_recibos_dolibarr(2023, 1)
         post.assert_not_called()
         self.assertEqual(len(resultado['con_error']), 1)
@@ -125,14 +156,41 @@ class DolibarrPushTest(TestCase):
         self.assertEqual(self.client.post(url, {'year': 2023, 'month': 1}).status_code, 403)
 
         self.client.login(username='boss', password='password')
-        with mock.patch('employees.dolibarr_api.httpx.post',
-                        return_value=_mock_resp(200, 41)):
+        with mock.patch('employees.nomina.threading.Thread') as hilo, \
+                self.captureOnCommitCallbacks(execute=True):
             response = self.client.post(url, {'year': 2023, 'month': 1})
         self.assertEqual(response.status_code, 302)
+        envio = EnvioDolibarr.objects.get()
+        self.assertEqual((envio.year, envio.month, envio.estado), (2023, 1, 'PENDIENTE'))
+        self.assertEqual(hilo.call_args.kwargs['args'], (envio.pk,))
+        hilo.return_value.start.assert_called_once()
+
+        # Un segundo clic mientras corre no lanza otro envío
+        with mock.patch('employees.nomina.threading.Thread') as hilo:
+            self.client.post(url, {'year': 2023, 'month': 1})
+        hilo.assert_not_called()
+        self.assertEqual(EnvioDolibarr.objects.count(), 1)
+
+    def test_envio_en_segundo_plano_y_estado(self):
+        envio, nuevo = iniciar_envio_dolibarr(2023, 1)
+        self.assertTrue(nuevo)
+        with mock.patch('employees.dolibarr_api.httpx.Client.post',
+                        return_value=_mock_resp(200, 41)):
+            ejecutar_envio_dolibarr(envio.pk)
+
+        self.client.login(username='boss', password='password')
+        estado = self.client.get(reverse('nomina_envio_estado', args=[envio.pk])).json()
+        self.assertEqual((estado['estado'], estado['activo']), ('TERMINADO', False))
+        self.assertEqual((estado['hechos'], estado['total'], estado['enviados']), (1, 1, 1))
+        self.recibo.refresh_from_db()
+        self.assertEqual(self.recibo.dolibarr_salary_id, 41)
+
+        response = self.client.get(reverse('nomina_cierre') + '?year=2023&month=1')
+        self.assertContains(response, 'nomina/enviar-dolibarr/%d/' % envio.pk)
 
     def test_vista_get_no_tiene_efecto(self):
         self.client.login(username='boss', password='password')
-        with mock.patch('employees.dolibarr_api.httpx.post') as post:
+        with mock.patch('employees.dolibarr_api.httpx.Client.post') as post:
             response = self.client.get(reverse('nomina_enviar_dolibarr'))
         post.assert_not_called()
         self.assertEqual(response.status_code, 302)
@@ -1,30 +1,37 @@
 import hashlib
 import hmac
 import json
+import tempfile
 from datetime import date
 from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
 
+from . import identidades
+from .api_views import DolibarrWebhookView
+from .cola_webhooks import procesar_pendientes, reprocesables, reprocesar
+from .idempotencia_webhooks import estadisticas
+from .limite_webhooks import consumir
 from .models import (
-    DolibarrInstance, DolibarrUserIdentity, Employee, SalesRecord,
+    DolibarrInstance, DolibarrUserIdentity, Employee, EmployeeMonthSummary,
+    ProductCreationLog, SalesRecord, WebhookEventoVisto, WebhookLog, WebhookTokenBucket,
 )
 
 
 WEBHOOK_URL = '/api/webhook/dolibarr/'
+BATCH_URL = '/api/webhook/dolibarr/batch/'
 
 
-class DolibarrWebhookIdempotencyTest(TestCase):
-    """
-    Regression tests for the Dolibarr webhook re-validation bug.
-
-    When Dolibarr re-validates a PROPAL/BILL/ORDER, it re-sends the same event
-    with the same (instance, dolibarr_id, status). Before the fix the webhook
-    raised IntegrityError -> HTTP 500, which made the Dolibarr trigger rollback
-    the source transaction and surface "BadValueForParameter" to the user.
-    """
+class DolibarrWebhookMixin:
+    """Instancia, identidad y payloads firmados compartidos por los tests del webhook."""
 
     def setUp(self):
         self.client = APIClient()
@@ -44,7 +51,7 @@ class DolibarrWebhookIdempotencyTest(TestCase):
             dolibarr_user_id=5,
         )
 
-    def _post(self, payload):
+    def _post(self, payload, url=WEBHOOK_URL):
         body = json.dumps(payload).encode('utf-8')
         signature = hmac.new(
             key=self.instance.api_secret.encode('utf-8'),
@@ -52,13 +59,19 @@ class DolibarrWebhookIdempotencyTest(TestCase):
             digestmod=hashlib.sha256,
         ).hexdigest()
         return self.client.post(
-            WEBHOOK_URL,
+            url,
             data=body,
             content_type='application/json',
             HTTP_X_DOLIBARR_PROFESSIONAL_ID=self.instance.professional_id,
             HTTP_X_DOLIBARR_SIGNATURE=signature,
         )
 
+    def _post_batch(self, events):
+        return self._post(
+            {'events': [dict(event, event_id=i) if isinstance(event, dict) else event
+                        for i, event in enumerate(events, start=1)]},
+            url=BATCH_URL)
+
     def _propal_payload(self, dolibarr_id=123, amount='1500.00', ref='PR2605-1319'):
         return {
             'trigger_code': 'PROPAL_VALIDATE',
@@ -101,6 +114,16 @@ class DolibarrWebhookIdempotencyTest(TestCase):
             },
         }
 
+class DolibarrWebhookIdempotencyTest(DolibarrWebhookMixin, TestCase):
+    """
+    Regression tests for the Dolibarr webhook re-validation bug.
+
+    When Dolibarr re-validates a PROPAL/BILL/ORDER, it re-sends the same event
+    with the same (instance, dolibarr_id, status). Before the fix the webhook
+    raised IntegrityError -> HTTP 500, which made the Dolibarr trigger rollback
+    the source transaction and surface "BadValueForParameter" to the user.
+    """
+
     def test_propal_validate_creates_proforma(self):
         response = self._post(self._propal_payload())
         self.assertEqual(response.status_code, 200)
@@ -165,3 +188,466 @@ class DolibarrWebhookIdempotencyTest(TestCase):
         response = self._post(self._propal_payload())
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json().get('status'), 'already_processed')
+
+
+@override_settings(DOLIBARR_WEBHOOK_ASYNC=True)
+class WebhookIngestQueueTest(DolibarrWebhookMixin, TestCase):
+    """Modo ingesta: el webhook solo encola y procesar_webhooks aplica en orden."""
+
+    def test_encola_y_responde_202(self):
+        response = self._post(self._propal_payload())
+        self.assertEqual(response.status_code, 202)
+        log = WebhookLog.objects.get()
+        self.assertEqual((log.status, log.instance), ('queued', self.instance))
+        self.assertFalse(SalesRecord.objects.exists())
+
+        self.assertEqual(procesar_pendientes(), {'processed': 1})
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.attempts), ('processed', 1))
+        self.assertIsNotNone(log.processed_at)
+        self.assertEqual(SalesRecord.objects.get().status, 'proforma')
+
+    def test_firma_invalida_no_se_encola(self):
+        response = self.client.post(
+            WEBHOOK_URL, data=json.dumps(self._propal_payload()), content_type='application/json',
+            HTTP_X_DOLIBARR_PROFESSIONAL_ID=self.instance.professional_id,
+            HTTP_X_DOLIBARR_SIGNATURE='firma-falsa')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WebhookLog.objects.get().status, 'error')
+        self.assertEqual(procesar_pendientes(), {})
+
+    def test_fallo_reintenta_sin_desordenar_la_instancia(self):
+        self._post(self._propal_payload(dolibarr_id=400, amount='1000.00'))
+        self._post(self._bill_payload(dolibarr_id=500, amount='1000.00', fk_propal=400))
+        primero, segundo = WebhookLog.objects.order_by('pk')
+
+        with patch('employees.api_views.DolibarrWebhookView.process_proforma',
+                   side_effect=RuntimeError('base caída')):
+            self.assertEqual(procesar_pendientes(), {'retry': 1})
+        primero.refresh_from_db()
+        self.assertEqual((primero.status, primero.attempts), ('retry', 1))
+        self.assertGreater(primero.next_attempt_at, timezone.now())
+        # La factura espera detrás de su proforma
+        self.assertEqual(WebhookLog.objects.get(pk=segundo.pk).status, 'queued')
+        self.assertEqual(procesar_pendientes(), {})
+
+        WebhookLog.objects.filter(pk=primero.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(procesar_pendientes(), {'processed': 2})
+        self.assertEqual(SalesRecord.objects.get(status='invoiced').dolibarr_id, 500)
+
+    @override_settings(WEBHOOK_MAX_INTENTOS=1)
+    def test_agotar_intentos_pasa_a_dead_y_sigue(self):
+        self._post(self._propal_payload(dolibarr_id=400))
+        self._post(self._order_payload(dolibarr_id=600))
+        with patch('employees.api_views.DolibarrWebhookView.process_proforma',
+                   side_effect=RuntimeError('payload raro')):
+            self.assertEqual(procesar_pendientes(), {'dead': 1, 'processed': 1})
+        self.assertEqual(WebhookLog.objects.order_by('pk').first().error_message, 'payload raro')
+        self.assertTrue(SalesRecord.objects.filter(status='order').exists())
+
+    def test_comando(self):
+        self._post(self._propal_payload())
+        salida = StringIO()
+        call_command('procesar_webhooks', stdout=salida)
+        self.assertIn('Webhooks: 1 processed.', salida.getvalue())
+
+
+class DolibarrWebhookBatchTest(DolibarrWebhookMixin, TestCase):
+    """Endpoint por lotes: mismas reglas que el webhook individual, escritura en bloque."""
+
+    def _events(self):
+        return [
+            self._propal_payload(dolibarr_id=400, amount='1000.00'),
+            self._bill_payload(dolibarr_id=500, amount='1000.00', fk_propal=400),
+            {'trigger_code': 'PAYMENT_CUSTOMER_CREATE',
+             'object': {'invoice_ids': [500], 'date_payment': '2024-04-02'}},
+            {'trigger_code': 'BILL_VALIDATE',
+             'object': {'id': 501, 'fk_user_author': 99, 'ref': 'AV-1', 'total_ht': '200',
+                        'type': 2, 'fk_facture_source': 500, 'date_validation': '2024-04-03'}},
+            self._bill_payload(dolibarr_id=502, ref='FA-directa'),  # sin origen: rechazada
+            {'trigger_code': 'PRODUCT_CREATE',
+             'object': {'id': 70, 'fk_user_author': 5, 'ref': 'SKU-1', 'date_creation': '2024-04-05'}},
+            {'trigger_code': 'PRODUCT_CREATE',
+             'object': {'id': 71, 'fk_user_author': 5, 'ref': 'SKU-1', 'date_creation': '2024-04-06'}},
+        ]
+
+    def _ventas(self):
+        return sorted(SalesRecord.objects.values_list(
+            'dolibarr_id', 'status', 'employee_id', 'amount_untaxed', 'date', 'payment_date'))
+
+    def test_mismo_resultado_que_eventos_individuales(self):
+        for event in self._events():
+            self._post(event)
+        individuales = self._ventas()
+        productos = sorted(ProductCreationLog.objects.values_list(
+            'dolibarr_product_id', 'is_suspect_duplicate'))
+        SalesRecord.objects.all().delete()
+        ProductCreationLog.objects.all().delete()
+        WebhookEventoVisto.objects.all().delete()  # si no, el lote son reenvíos
+
+        response = self._post_batch(self._events())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({r['status'] for r in response.json()['results']}, {'processed'})
+        self.assertEqual(self._ventas(), individuales)
+        self.assertEqual(sorted(ProductCreationLog.objects.values_list(
+            'dolibarr_product_id', 'is_suspect_duplicate')), productos)
+        self.assertEqual(productos, [(70, False), (71, True)])
+
+        abril = EmployeeMonthSummary.objects.get(employee=self.employee, year=2024, month=4)
+        self.assertEqual(abril.confirmed_invoiced, Decimal('1000.00'))
+        self.assertEqual(abril.credit_notes_amount, Decimal('-200.00'))
+
+    def test_resultados_por_evento(self):
+        self._post_batch([self._events()[5]])
+        response = self._post_batch([
+            self._events()[5],                 # producto ya registrado
+            'no soy un evento',
+            self._propal_payload(),
+        ])
+        results = response.json()['results']
+        self.assertEqual([(r['event_id'], r['status']) for r in results],
+                         [(1, 'already_processed'), (None, 'error'), (3, 'processed')])
+        log = WebhookLog.objects.order_by('pk').last()
+        self.assertEqual((log.status, log.instance), ('processed', self.instance))
+        self.assertIn('event 1: Event must be an object', log.error_message)
+
+    def test_consultas_no_crecen_con_el_lote(self):
+        eventos = [self._propal_payload(dolibarr_id=1000 + i, ref=f'PR-{i}') for i in range(60)]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._post_batch(eventos)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SalesRecord.objects.filter(status='proforma').count(), 60)
+        self.assertLess(len(ctx.captured_queries), 30)
+
+    def test_firma_invalida(self):
+        response = self.client.post(
+            BATCH_URL, data=json.dumps({'events': []}), content_type='application/json',
+            HTTP_X_DOLIBARR_PROFESSIONAL_ID=self.instance.professional_id,
+            HTTP_X_DOLIBARR_SIGNATURE='firma-falsa')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WebhookLog.objects.get().status, 'error')
+
+
+class WebhookReplayTest(DolibarrWebhookMixin, TestCase):
+    """replay_webhooks: reencola error/throttled/dead y los aplica sin duplicar."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()  # historial del throttle
+
+    def _post_throttled(self, payload, url=WEBHOOK_URL):
+        with override_settings(WEBHOOK_BUCKET_CAPACIDAD=0):
+            response = self._post(payload, url=url)
+        self.assertEqual(response.status_code, 429)
+        return WebhookLog.objects.order_by('pk').last()
+
+    def test_throttled_con_firma_valida_se_reprocesa(self):
+        self._post_throttled(self._propal_payload(dolibarr_id=400, amount='1000.00'))
+        self._post_throttled(self._bill_payload(dolibarr_id=500, amount='1000.00', fk_propal=400))
+        with patch('employees.api_views.WebhookRateThrottle.rate', '0/min'):
+            self.client.post(WEBHOOK_URL, data=json.dumps(self._propal_payload()),
+                             content_type='application/json',
+                             HTTP_X_DOLIBARR_PROFESSIONAL_ID=self.instance.professional_id,
+                             HTTP_X_DOLIBARR_SIGNATURE='firma-falsa')
+        self.assertEqual(WebhookLog.objects.filter(
+            status='throttled', instance=self.instance).count(), 2)
+
+        salida = StringIO()
+        call_command('replay_webhooks', '--estado', 'throttled', stdout=salida)
+        self.assertIn('2 webhooks reencolados: 2 processed', salida.getvalue())
+        self.assertIn('1 sin instancia verificada', salida.getvalue())
+        self.assertEqual(SalesRecord.objects.get(status='invoiced').dolibarr_id, 500)
+        self.assertEqual(WebhookLog.objects.filter(status='throttled').count(), 1)
+
+    def test_reaplicar_no_duplica(self):
+        self._post(self._propal_payload())
+        WebhookLog.objects.update(status='error', error_message='caída')
+        resultado = reprocesar(reprocesables())
+        self.assertEqual((resultado['reencolados'], resultado['processed']), (1, 1))
+        self.assertEqual(SalesRecord.objects.count(), 1)
+        self.assertEqual(WebhookLog.objects.get().error_message, '')
+
+    def test_informa_solo_lo_reencolado(self):
+        otra = DolibarrInstance.objects.create(name='Otra', professional_id='otra', api_secret='x')
+        ajeno = WebhookLog.objects.create(instance=otra, status='queued', payload=self._propal_payload(7))
+        WebhookLog.objects.create(instance=self.instance, status='queued',
+                                  payload=self._propal_payload(dolibarr_id=8))
+        WebhookLog.objects.create(instance=self.instance, status='error',
+                                  payload=self._propal_payload(dolibarr_id=9))
+        avances = []
+        resultado = reprocesar(reprocesables(), progreso=lambda h, t, s: avances.append((h, t)))
+        self.assertEqual(avances, [(1, 1)])
+        self.assertEqual((resultado['processed'], resultado['arrastrados']), (1, 1))
+        ajeno.refresh_from_db()
+        self.assertEqual(ajeno.status, 'queued')  # otra instancia: no se drena
+
+    def test_filtros(self):
+        self._post_throttled(self._propal_payload(dolibarr_id=400))
+        self._post_throttled(self._order_payload(dolibarr_id=600))
+        self.assertEqual(reprocesables(trigger_code='ORDER_VALIDATE').count(), 1)
+        self._post_throttled({'events': [self._propal_payload(dolibarr_id=401)]}, url=BATCH_URL)
+        self.assertEqual(reprocesables(trigger_code='BATCH').count(), 1)
+        self.assertEqual(reprocesables(estados=['dead']).count(), 0)
+        manana = timezone.localdate() + timezone.timedelta(days=1)
+        self.assertEqual(reprocesables(desde=manana).count(), 0)
+        self.assertEqual(reprocesables(hasta=manana).count(), 3)
+
+    def test_lote_throttled(self):
+        log = self._post_throttled({'events': [self._propal_payload(dolibarr_id=400)]}, url=BATCH_URL)
+        self.assertEqual(log.instance, self.instance)
+        self.assertEqual(reprocesar(reprocesables())['processed'], 1)
+        self.assertEqual(SalesRecord.objects.get().dolibarr_id, 400)
+
+    def test_confiar_encabezados(self):
+        WebhookLog.objects.create(
+            status='error', payload=self._propal_payload(),
+            headers={'X-Dolibarr-Professional-Id': self.instance.professional_id})
+        self.assertEqual(reprocesar(reprocesables())['sin_instancia'], 1)
+        self.assertFalse(SalesRecord.objects.exists())
+
+        resultado = reprocesar(reprocesables(), confiar_encabezados=True)
+        self.assertEqual((resultado['reencolados'], resultado['sin_instancia']), (1, 0))
+        self.assertEqual(WebhookLog.objects.get().instance, self.instance)
+        self.assertTrue(SalesRecord.objects.exists())
+
+
+class WebhookIdempotencyIndexTest(DolibarrWebhookMixin, TestCase):
+    """Los reenvíos idénticos se reconocen por el índice, sin tocar ventas."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_reenvio_identico_no_toca_ventas(self):
+        self.assertEqual(self._post(self._propal_payload()).json(), {'status': 'ok'})
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._post(self._propal_payload())
+        self.assertEqual(response.json(), {'status': 'already_processed'})
+        self.assertFalse([q for q in consultas if 'employees_salesrecord' in q['sql']])
+
+        # un cambio en el payload no es un reenvío
+        self._post(self._propal_payload(amount='1600.00'))
+        self.assertEqual(SalesRecord.objects.get().amount_untaxed, Decimal('1600.00'))
+        self.assertEqual(estadisticas(), {'hits': 1, 'misses': 2, 'hit_rate': 0.3333, 'entries': 2})
+
+    def test_lote_ignora_event_id(self):
+        self._post(self._propal_payload(dolibarr_id=1))
+        response = self._post_batch([self._propal_payload(dolibarr_id=1),
+                                     self._propal_payload(dolibarr_id=2)])
+        self.assertEqual([r['status'] for r in response.json()['results']],
+                         ['already_processed', 'processed'])
+        self.assertEqual(WebhookEventoVisto.objects.count(), 2)
+
+    def _sin_mapear(self):
+        payload = self._propal_payload()
+        payload['object']['fk_user_author'] = 9
+        return payload
+
+    def _mapear(self):
+        DolibarrUserIdentity.objects.create(
+            employee=self.employee, dolibarr_instance=self.instance, dolibarr_user_id=9)
+
+    def test_sin_mapeo_no_se_registra(self):
+        self.assertEqual(self._post(self._sin_mapear()).json(), {'status': 'ok'})
+        self.assertFalse(WebhookEventoVisto.objects.exists())
+        self._mapear()
+        self.assertEqual(self._post(self._sin_mapear()).json(), {'status': 'ok'})
+        self.assertEqual(SalesRecord.objects.get().employee, self.employee)
+        self.assertEqual(WebhookEventoVisto.objects.count(), 1)
+
+    def test_lote_sin_mapeo_no_se_registra(self):
+        self._post_batch([self._sin_mapear()])
+        self.assertFalse(WebhookEventoVisto.objects.exists())
+        self._mapear()
+        response = self._post_batch([self._sin_mapear()])
+        self.assertEqual(response.json()['results'][0]['status'], 'processed')
+        self.assertEqual(SalesRecord.objects.get().employee, self.employee)
+
+    @override_settings(WEBHOOK_IDEMPOTENCIA_HORAS=1)
+    def test_ventana_deslizante_y_purga(self):
+        self._post(self._propal_payload())
+        WebhookEventoVisto.objects.update(visto=timezone.now() - timezone.timedelta(minutes=50))
+        self._post(self._propal_payload())  # reenvío: renueva la ventana
+        self.assertGreater(WebhookEventoVisto.objects.get().visto,
+                           timezone.now() - timezone.timedelta(minutes=1))
+
+        WebhookEventoVisto.objects.update(visto=timezone.now() - timezone.timedelta(hours=2))
+        self.assertEqual(self._post(self._propal_payload()).json(), {'status': 'ok'})
+        WebhookEventoVisto.objects.update(visto=timezone.now() - timezone.timedelta(hours=2))
+        with tempfile.TemporaryDirectory() as directorio, \
+                override_settings(WEBHOOK_ARCHIVE_DIR=directorio):
+            call_command('archivar_webhooks', stdout=StringIO())
+        self.assertFalse(WebhookEventoVisto.objects.exists())
+
+
+class WebhookTokenBucketTest(DolibarrWebhookMixin, TestCase):
+    """Cubeta de tokens por instancia en la base, común a todos los workers."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    @override_settings(WEBHOOK_BUCKET_CAPACIDAD=2, WEBHOOK_BUCKET_TASA=1.0)
+    def test_rafaga_y_recarga(self):
+        pk = self.instance.pk
+        self.assertEqual(consumir(pk, ahora=1000.0), (True, 0.0))
+        self.assertEqual(consumir(pk, ahora=1000.0), (True, 0.0))
+        self.assertEqual(consumir(pk, ahora=1000.25), (False, 0.75))
+        self.assertEqual(consumir(pk, ahora=1001.0), (True, 0.0))
+        # la recarga no pasa de la capacidad
+        self.assertTrue(consumir(pk, ahora=2000.0)[0])
+        self.assertTrue(consumir(pk, ahora=2000.0)[0])
+        self.assertFalse(consumir(pk, ahora=2000.0)[0])
+
+    def test_una_consulta_por_peticion(self):
+        self._post(self._propal_payload(dolibarr_id=1))
+        with CaptureQueriesContext(connection) as consultas:
+            consumir(self.instance.pk)
+        self.assertEqual(len(consultas), 1)
+        self.assertIn('UPDATE', consultas[0]['sql'])
+
+    @override_settings(
+        WEBHOOK_BUCKET_CAPACIDAD=2, WEBHOOK_BUCKET_TASA=1.0, WEBHOOK_BUCKET_CACHE='limite',
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'limite': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                       'LOCATION': 'limite-webhooks'},
+        })
+    def test_cache_compartida_sin_consultas(self):
+        pk = self.instance.pk
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(consumir(pk, ahora=1000.0), (True, 0.0))
+            self.assertEqual(consumir(pk, ahora=1000.5), (True, 0.0))
+            self.assertEqual(consumir(pk, ahora=1001.25), (False, 0.75))
+            self.assertEqual(consumir(pk, ahora=1002.0), (True, 0.0))  # ventana nueva
+        self.assertEqual(len(consultas), 0)
+        self.assertFalse(WebhookTokenBucket.objects.exists())
+
+    def test_firma_se_verifica_una_vez(self):
+        original = DolibarrWebhookView.authenticate_instance
+        with patch.object(DolibarrWebhookView, 'authenticate_instance',
+                          side_effect=original) as autenticar:
+            self.assertEqual(self._post(self._propal_payload(dolibarr_id=1)).status_code, 200)
+            self.assertEqual(self._post_batch([self._propal_payload(dolibarr_id=2)]).status_code, 200)
+        self.assertEqual(autenticar.call_count, 2)
+
+    @override_settings(WEBHOOK_BUCKET_CAPACIDAD=1, WEBHOOK_BUCKET_TASA=0.5)
+    def test_429_informa_cola(self):
+        WebhookLog.objects.create(instance=self.instance, status='queued', payload={})
+        self.assertEqual(self._post(self._propal_payload(dolibarr_id=1)).status_code, 200)
+
+        response = self._post(self._propal_payload(dolibarr_id=2))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['queue_depth'], 1)
+        self.assertEqual(WebhookLog.objects.filter(
+            status='throttled', instance=self.instance).count(), 1)
+
+    @override_settings(WEBHOOK_BUCKET_CAPACIDAD=0)
+    def test_firma_invalida_no_gasta_la_cubeta(self):
+        response = self.client.post(WEBHOOK_URL, data=json.dumps(self._propal_payload()),
+                                    content_type='application/json',
+                                    HTTP_X_DOLIBARR_PROFESSIONAL_ID=self.instance.professional_id,
+                                    HTTP_X_DOLIBARR_SIGNATURE='firma-falsa')
+        self.assertEqual(response.status_code, 400)
+
+
+class DolibarrLookupCacheTest(TransactionTestCase):
+    """Instancias e identidades se resuelven desde la LRU del proceso."""
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        identidades.invalidate()
+        self.instance = DolibarrInstance.objects.create(
+            name='ERP', professional_id='pro-1', api_secret='secreto')
+        self.employee = Employee.objects.create(
+            name='Vendedora', email='vendedora@example.com', hire_date=date(2024, 1, 1))
+        DolibarrUserIdentity.objects.create(
+            employee=self.employee, dolibarr_instance=self.instance, dolibarr_user_id=5)
+        self.view = DolibarrWebhookView()
+
+    def tearDown(self):
+        cache.clear()
+        identidades.invalidate()
+
+    def _firma(self, body, secreto='secreto'):
+        return hmac.new(secreto.encode(), body, hashlib.sha256).hexdigest()
+
+    def _resolver(self, body=b'{}'):
+        instance = self.view.authenticate_instance('pro-1', self._firma(body), body)
+        return instance, self.view._resolve_employee(instance, 5)
+
+    def test_sin_consultas_tras_la_primera(self):
+        self._resolver()
+        with CaptureQueriesContext(connection) as ctx:
+            instance, employee = self._resolver(b'{"otro": 1}')
+            self.assertIsNone(self.view._resolve_employee(instance, 99))
+            self.assertIsNone(self.view._resolve_employee(instance, 99))
+        self.assertEqual(len(ctx.captured_queries), 1)  # solo la identidad 99
+        self.assertEqual((instance.pk, employee.pk), (self.instance.pk, self.employee.pk))
+
+    def test_cambios_invalidan(self):
+        self._resolver()
+        otra = Employee.objects.create(
+            name='Otra', email='otra@example.com', hire_date=date(2024, 1, 1))
+        DolibarrUserIdentity.objects.filter(dolibarr_user_id=5).delete()
+        DolibarrUserIdentity.objects.create(
+            employee=otra, dolibarr_instance=self.instance, dolibarr_user_id=5)
+        self.assertEqual(self._resolver()[1].pk, otra.pk)
+
+        self.instance.api_secret = 'rotado'
+        self.instance.save()
+        with self.assertRaises(ValueError):
+            self._resolver()
+        body = b'{}'
+        instance = self.view.authenticate_instance('pro-1', self._firma(body, 'rotado'), body)
+        self.assertEqual(instance.api_secret, 'rotado')
+
+    def test_lru_descarta_la_menos_usada(self):
+        instance = self._resolver()[0]
+        with patch.object(identidades, 'MAX_IDENTIDADES', 2):
+            for user_id in (6, 7, 8):
+                self.view._find_employee(instance, user_id)
+        self.assertEqual(list(identidades._identidades), [(instance.pk, 7), (instance.pk, 8)])
+
+    def _entregar(self, dolibarr_id, **extra):
+        body = json.dumps({
+            'trigger_code': 'PROPAL_VALIDATE',
+            'object': {'id': dolibarr_id, 'fk_user_author': 5, 'ref': f'PR-{dolibarr_id}',
+                       'total_ht': '100.00', 'date_validation': '2024-03-23'},
+        }).encode()
+        return APIClient().post(
+            WEBHOOK_URL, data=body, content_type='application/json',
+            HTTP_X_DOLIBARR_PROFESSIONAL_ID='pro-1', HTTP_X_DOLIBARR_SIGNATURE=self._firma(body),
+            **extra)
+
+    def _consultas_de_identidad(self, ctx):
+        return [q for q in ctx.captured_queries if 'employees_dolibarruseridentity' in q['sql']]
+
+    def test_webhook_llena_la_lru_al_confirmar(self):
+        self.assertEqual(self._entregar(301).status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._entregar(302).status_code, 200)
+        self.assertEqual(self._consultas_de_identidad(ctx), [])
+        self.assertEqual(SalesRecord.objects.filter(employee=self.employee).count(), 2)
+
+    @override_settings(DOLIBARR_WEBHOOK_ASYNC=True)
+    def test_cola_llena_la_lru_al_confirmar(self):
+        self._entregar(301)
+        procesar_pendientes()
+        self._entregar(302)
+        with CaptureQueriesContext(connection) as ctx:
+            procesar_pendientes()
+        self.assertEqual(self._consultas_de_identidad(ctx), [])
+        self.assertEqual(SalesRecord.objects.filter(employee=self.employee).count(), 2)
+
+    def test_rollback_no_llena_la_lru(self):
+        instance = self._resolver()[0]
+        try:
+            with transaction.atomic():
+                self.view._find_employee(instance, 6)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertNotIn((instance.pk, 6), identidades._identidades)
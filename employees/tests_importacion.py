@@ -0,0 +1,97 @@
+"""Tests de la importación masiva de WorkLogs (reloj de marcación)."""
+import io
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from openpyxl import Workbook
+from rest_framework.test import APIClient
+
+from .importacion import ImportacionError, importar_worklogs, leer_filas
+from .models import Employee, EmployeeMonthSummary, Salary, WorkLog
+from .payroll import cached_salary
+
+
+class ImportarWorklogsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = Employee.objects.create(
+            name='Ana', email='ana@example.com', hire_date=date(2023, 1, 1))
+        self.beto = Employee.objects.create(
+            name='Beto', email='beto@example.com', hire_date=date(2023, 1, 1))
+
+    def _importar(self, contenido, nombre='marcaciones.csv', **kwargs):
+        return importar_worklogs(leer_filas(io.BytesIO(contenido.encode()), nombre), **kwargs)
+
+    def test_crea_actualiza_y_rechaza(self):
+        WorkLog.objects.create(employee=self.ana, date=date(2024, 6, 3), hours_worked=4)
+        resultado = self._importar(
+            "email;fecha;horas;horas_extra\n"
+            "ANA@example.com;2024-06-03;8;1,5\n"
+            f"{self.beto.pk};04/06/2024;7.5;\n"
+            "nadie@example.com;2024-06-04;8;0\n"
+            "ana@example.com;2024-13-01;8;0\n"
+            "ana@example.com;2024-06-05;120;0\n"
+            ";;;\n"
+            "ana@example.com;2024-06-06;;0\n",
+            tam_lote=2)
+
+        self.assertEqual(resultado['procesadas'], 6)
+        self.assertEqual((resultado['creadas'], resultado['actualizadas']), (1, 1))
+        self.assertEqual([n for n, _ in resultado['rechazadas']], [4, 5, 6, 8])
+        self.assertIn('empleado desconocido', resultado['rechazadas'][0][1])
+
+        ana = WorkLog.objects.get(employee=self.ana, date=date(2024, 6, 3))
+        self.assertEqual((ana.hours_worked, ana.overtime_hours), (Decimal('8'), Decimal('1.5')))
+        self.assertEqual(WorkLog.objects.get(employee=self.beto).hours_worked, Decimal('7.5'))
+
+    def test_actualiza_resumen_y_cache_de_salario(self):
+        Salary.objects.create(employee=self.ana, base_amount=Decimal('1600'),
+                              effective_date=date(2023, 1, 1))
+        self.assertEqual(cached_salary(self.ana, 2024, 6)['work_pay'], Decimal('0'))
+        self._importar("employee,date,hours_worked\nana@example.com,2024-06-03,80\n")
+
+        resumen = EmployeeMonthSummary.objects.get(employee=self.ana, year=2024, month=6)
+        self.assertEqual(resumen.hours_worked, Decimal('80'))
+        self.assertEqual(cached_salary(self.ana, 2024, 6)['work_pay'], Decimal('800'))
+
+    def test_xlsx_y_comando(self):
+        libro = Workbook()
+        hoja = libro.active
+        hoja.append(['Employee_ID', 'Date', 'Hours'])
+        hoja.append([self.ana.pk, date(2024, 6, 3), 8])
+        hoja.append([self.beto.pk, date(2024, 6, 3), 6.25])
+        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
+            libro.save(tmp)
+        self.addCleanup(os.remove, tmp.name)
+
+        salida = StringIO()
+        call_command('importar_marcaciones', tmp.name, stdout=salida)
+        self.assertIn('2 filas: 2 días creados, 0 actualizados, 0 rechazadas', salida.getvalue())
+        self.assertEqual(WorkLog.objects.get(employee=self.beto).hours_worked, Decimal('6.25'))
+
+    def test_encabezado_incompleto(self):
+        with self.assertRaises(ImportacionError):
+            self._importar("email,fecha\nana@example.com,2024-06-03\n")
+
+    def test_api_solo_superuser(self):
+        url = reverse('worklog-import-file')
+        archivo = lambda: SimpleUploadedFile(
+            'marcaciones.csv', b"email,fecha,horas\nana@example.com,2024-06-03,8\nx,2024-06-03,8\n")
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_user('empleado', password='x'))
+        self.assertEqual(cliente.post(url, {'file': archivo()}).status_code, 403)
+
+        cliente.force_authenticate(User.objects.create_superuser('admin', password='x'))
+        respuesta = cliente.post(url, {'file': archivo()})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data['created'], 1)
+        self.assertEqual(respuesta.data['rejected'], [{'row': 3, 'error': "empleado desconocido: 'x'"}])
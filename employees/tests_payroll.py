@@ -0,0 +1,456 @@
+"""Tests del motor de nómina por lotes (simulación, reglas, IPAC) y del cierre de mes."""
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    BonusRule, CierreNomina, CommissionBalance, CompanySettings, DolibarrInstance, Employee,
+    EnvioDolibarr, Feriado, EmployeePerformanceRecord, JobProfile, KPI, KPIBonusTier,
+    ManualKpiEntry, ReciboNomina,
+    Salary, SalesRecord, Task, TaskBoard, TaskList, WorkLog,
+)
+from .nomina import ejecutar_cierre_mes, generar_recibos_mes
+from .payroll import (
+    cached_salary, calculate_salaries, ipac_ranking, ipac_scores, salary_cache_stats, what_if,
+)
+from .reglas_kpi import compiled_rules
+
+
+class CalculateSalariesTest(TestCase):
+    def setUp(self):
+        self.instance = DolibarrInstance.objects.create(
+            name='ERP', professional_id='RUC-1', api_secret='secret')
+        self.kpi_tasks = KPI.objects.create(
+            name='Productividad', measurement_type='percentage', target_value=Decimal('90'))
+        self.kpi_errors = KPI.objects.create(
+            name='Calidad', measurement_type='count_lt', target_value=Decimal('3'))
+        self.kpi_ipac = KPI.objects.create(
+            name='IPAC', measurement_type='composite_ipac', target_value=Decimal('1'))
+        BonusRule.objects.create(kpi=self.kpi_tasks, bonus_amount=Decimal('50'))
+        BonusRule.objects.create(kpi=self.kpi_errors, bonus_amount=Decimal('30'))
+        BonusRule.objects.create(kpi=self.kpi_ipac, bonus_amount=Decimal('20'))
+        self.profile = JobProfile.objects.create(name='Ventas')
+        self.profile.kpis.add(self.kpi_tasks, self.kpi_errors, self.kpi_ipac)
+        self.seq = 0
+
+    def _employee(self, commission=10, salary=True):
+        self.seq += 1
+        employee = Employee.objects.create(
+            name=f'Emp {self.seq:03d}', email=f'emp{self.seq}@example.com',
+            hire_date=date(2023, 1, 1), profile=self.profile,
+            commission_percentage=Decimal(commission))
+        if salary:
+            Salary.objects.create(employee=employee, base_amount=Decimal('1600'),
+                                  effective_date=date(2023, 1, 1))
+        board = TaskBoard.objects.create(employee=employee, name=f'Board {self.seq}')
+        hecho = TaskList.objects.create(board=board, name='Hecho', order=3)
+        pendiente = TaskList.objects.create(board=board, name='Pendiente', order=1)
+        due = timezone.make_aware(datetime(2024, 8, 15, 12))
+        done = timezone.make_aware(datetime(2024, 8, 14, 12))
+        for i in range(3):
+            Task.objects.create(list=hecho, assigned_to=employee, kpi=self.kpi_tasks,
+                                title=f'T{i}', order=i, due_date=due, completed_at=done)
+        Task.objects.create(list=pendiente, assigned_to=employee, kpi=self.kpi_tasks,
+                            title='T3', order=3, due_date=due)
+        WorkLog.objects.create(employee=employee, date=date(2024, 8, 5),
+                               hours_worked=80, overtime_hours=4)
+        WorkLog.objects.create(employee=employee, date=date(2024, 8, 6), hours_worked=60)
+        ManualKpiEntry.objects.create(employee=employee, kpi=self.kpi_errors,
+                                      date=date(2024, 8, 10), value=1)
+        SalesRecord.objects.create(
+            employee=employee, dolibarr_instance=self.instance, dolibarr_id=self.seq,
+            dolibarr_ref=f'FA-{self.seq}', status='invoiced', amount_untaxed=Decimal('1000'),
+            date=date(2024, 8, 2), payment_date=date(2024, 8, 20))
+        return employee
+
+    def test_mismo_desglose_que_calculo_individual(self):
+        a, b = self._employee(), self._employee()
+        lote = calculate_salaries(2024, 8, [a, b], commit=True)
+
+        individual = b.calculate_salary(2024, 8)
+        self.assertEqual(set(lote), {a.pk, b.pk})
+        for clave in ('base_salary', 'work_pay', 'overtime_pay', 'performance_bonus',
+                      'commission_amount', 'total_salary', 'total_hours_worked',
+                      'confirmed_count', 'provisional_count'):
+            self.assertEqual(lote[b.pk][clave], individual[clave], clave)
+
+        # 140h * $10 + 4h * $15 + bonos (30 errores + 20 IPAC; 75% < 90%) + 10% de 1000
+        self.assertEqual(lote[a.pk]['total_salary'], Decimal('1400') + Decimal('60')
+                         + Decimal('50') + Decimal('100'))
+        record = EmployeePerformanceRecord.objects.get(
+            employee=a, kpi=self.kpi_tasks, date=date(2024, 8, 31))
+        self.assertEqual(record.actual_value, Decimal('75'))
+        self.assertFalse(record.target_met)
+
+    def test_sin_salario_devuelve_none_sin_escribir(self):
+        sin_salario = self._employee(salary=False)
+        lote = calculate_salaries(2024, 8, [sin_salario])
+        self.assertIsNone(lote[sin_salario.pk])
+        self.assertFalse(EmployeePerformanceRecord.objects.filter(employee=sin_salario).exists())
+
+    def test_por_defecto_solo_activos_del_mes(self):
+        activo = self._employee()
+        baja = self._employee()
+        baja.end_date = date(2024, 7, 31)
+        baja.save()
+        self.assertEqual(set(calculate_salaries(2024, 8)), {activo.pk})
+
+    def test_consultas_constantes_con_mas_empleados(self):
+        pocos = [self._employee() for _ in range(2)]
+        compiled_rules()  # la tabla de reglas se compila una vez, fuera de la medición
+        with CaptureQueriesContext(connection) as ctx_pocos:
+            calculate_salaries(2024, 9, pocos)
+
+        muchos = pocos + [self._employee() for _ in range(8)]
+        with CaptureQueriesContext(connection) as ctx_muchos:
+            calculate_salaries(2024, 10, muchos)
+
+        self.assertEqual(len(ctx_pocos.captured_queries), len(ctx_muchos.captured_queries))
+
+
+class SimulacionTest(TestCase):
+    """Simulación sin efectos, commit explícito y escenarios what-if."""
+
+    def setUp(self):
+        self.instance = DolibarrInstance.objects.create(
+            name='ERP', professional_id='RUC-SIM', api_secret='secret')
+        self.kpi = KPI.objects.create(
+            name='Calidad', measurement_type='count_lt', target_value=Decimal('3'))
+        BonusRule.objects.create(kpi=self.kpi, bonus_amount=Decimal('30'))
+        profile = JobProfile.objects.create(name='Soporte')
+        profile.kpis.add(self.kpi)
+        self.employee = Employee.objects.create(
+            name='Sim', email='sim@example.com', hire_date=date(2023, 1, 1),
+            profile=profile, commission_percentage=Decimal('10'))
+        Salary.objects.create(employee=self.employee, base_amount=Decimal('1600'),
+                              effective_date=date(2023, 1, 1))
+        ManualKpiEntry.objects.create(employee=self.employee, kpi=self.kpi,
+                                      date=date(2024, 8, 10), value=2)
+        SalesRecord.objects.create(
+            employee=self.employee, dolibarr_instance=self.instance, dolibarr_id=1,
+            dolibarr_ref='FA-1', status='invoiced', amount_untaxed=Decimal('1000'),
+            date=date(2024, 8, 2), payment_date=date(2024, 8, 20))
+
+    def test_simular_no_escribe(self):
+        resultado = calculate_salaries(2024, 8, [self.employee])[self.employee.pk]
+        self.assertEqual(resultado['performance_bonus'], Decimal('30'))
+        self.assertEqual(resultado['commission_amount'], Decimal('100.00'))
+        self.assertFalse(EmployeePerformanceRecord.objects.exists())
+        self.assertFalse(CommissionBalance.objects.exists())
+
+    def test_commit_escribe_registros_y_saldo(self):
+        calculate_salaries(2024, 8, [self.employee], commit=True)
+        self.assertTrue(EmployeePerformanceRecord.objects.filter(
+            employee=self.employee, kpi=self.kpi, target_met=True).exists())
+        balance = CommissionBalance.objects.get(employee=self.employee)
+        self.assertEqual((balance.last_computed_year, balance.last_computed_month), (2024, 8))
+
+    def test_what_if_comisiones_y_metas(self):
+        actual, escenario = what_if(
+            2024, 8, commission_percentages={self.employee.pk: '5'},
+            kpi_targets={self.kpi.pk: '1'}, employees=[self.employee])
+        self.assertEqual(actual[self.employee.pk]['total_salary']
+                         - escenario[self.employee.pk]['total_salary'], Decimal('80.00'))
+        self.assertEqual(escenario[self.employee.pk]['commission_amount'], Decimal('50.00'))
+        self.assertEqual(escenario[self.employee.pk]['performance_bonus'], Decimal('0.00'))
+        self.employee.refresh_from_db()
+        self.assertEqual(self.employee.commission_percentage, Decimal('10'))
+        self.assertEqual(compiled_rules().kpis[self.kpi.pk].kpi.target_value, Decimal('3'))
+        self.assertFalse(EmployeePerformanceRecord.objects.exists())
+
+    def test_api_what_if(self):
+        url = reverse('payroll_what_if_api')
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_user('normal', password='x'))
+        self.assertEqual(cliente.post(url, {}, format='json').status_code, 403)
+
+        cliente.force_authenticate(User.objects.create_superuser('admin', password='x'))
+        respuesta = cliente.post(url, {
+            'year': 2024, 'month': 8,
+            'commission_percentages': {str(self.employee.pk): '5'},
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        fila = respuesta.data['employees'][0]
+        self.assertEqual(fila['current']['commission_amount'], '100.00')
+        self.assertEqual(fila['scenario']['commission_amount'], '50.00')
+        self.assertEqual(respuesta.data['totals']['difference'], '-50.00')
+        self.assertFalse(CommissionBalance.objects.exists())
+
+        respuesta = cliente.post(url, {'kpi_targets': {'x': 'y'}}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_completar_tarea_no_escribe_nomina(self):
+        board = TaskBoard.objects.create(employee=self.employee, name='Tablero')
+        pendiente = TaskList.objects.create(board=board, name='Pendiente', order=1)
+        TaskList.objects.create(board=board, name='Hecho', order=3)
+        task = Task.objects.create(list=pendiente, assigned_to=self.employee, title='T', order=1)
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_superuser('admin', password='x'))
+        antes = cached_salary(self.employee, 2024, 8)
+
+        for accion in ('mark_as_complete', 'mark_as_unfulfilled'):
+            respuesta = cliente.post(f'/api/tasks/{task.pk}/{accion}/')
+            self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(EmployeePerformanceRecord.objects.exists())
+        self.assertFalse(CommissionBalance.objects.exists())
+        self.assertIsNot(cached_salary(self.employee, 2024, 8), antes)
+
+    def test_comisiones_desde_el_libro_tambien_al_cerrar(self):
+        # .update() no pasa por las señales: el libro conserva los 1000
+        SalesRecord.objects.update(amount_untaxed=Decimal('5000'))
+        cierre = calculate_salaries(2024, 8, [self.employee], commit=True)[self.employee.pk]
+        self.assertEqual(cierre['commission_amount'], Decimal('100.00'))
+        self.assertEqual(self.employee.calculate_commissions(2024, 8)['commission_amount'],
+                         cierre['commission_amount'])
+
+
+class SalaryCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.employee = Employee.objects.create(
+            name='Cache', email='cache@example.com', hire_date=date(2023, 1, 1))
+        Salary.objects.create(employee=self.employee, base_amount=Decimal('1600'),
+                              effective_date=date(2023, 1, 1))
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 8, 5), hours_worked=80)
+
+    def test_acierto_con_una_consulta(self):
+        primero = cached_salary(self.employee, 2024, 8)
+        with CaptureQueriesContext(connection) as ctx:
+            segundo = cached_salary(self.employee, 2024, 8)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(segundo, primero)
+        self.assertEqual(salary_cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_insumos_del_empleado_invalidan(self):
+        self.assertEqual(cached_salary(self.employee, 2024, 8)['work_pay'], Decimal('800'))
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 8, 6), hours_worked=80)
+        self.assertEqual(cached_salary(self.employee, 2024, 8)['work_pay'], Decimal('1600'))
+
+    def test_parametros_globales_invalidan(self):
+        cached_salary(self.employee, 2024, 8)
+        settings = CompanySettings.load()
+        settings.base_hours = Decimal('80')
+        settings.save()
+        self.assertEqual(cached_salary(self.employee, 2024, 8)['work_pay'], Decimal('1600'))
+        self.assertEqual(salary_cache_stats()['misses'], 2)
+
+    def test_feriado_cambia_horas_base_diarias(self):
+        settings = CompanySettings.load()
+        settings.calculation_basis = 'daily'
+        settings.base_hours = Decimal('8')
+        settings.save()
+        # Agosto 2024: 22 días hábiles -> 176 horas base
+        self.assertEqual(cached_salary(self.employee, 2024, 8)['work_days_in_month'], 22)
+        Feriado.objects.create(fecha=date(2024, 8, 9), nombre='Feriado de prueba')
+        desglose = cached_salary(self.employee, 2024, 8)
+        self.assertEqual(desglose['work_days_in_month'], 21)
+        self.assertEqual(desglose['monthly_hours'], Decimal('168'))
+
+    def test_otro_empleado_no_invalida(self):
+        cached_salary(self.employee, 2024, 8)
+        otro = Employee.objects.create(
+            name='Otro', email='otro@example.com', hire_date=date(2023, 1, 1))
+        WorkLog.objects.create(employee=otro, date=date(2024, 8, 5), hours_worked=8)
+        cached_salary(self.employee, 2024, 8)
+        self.assertEqual(salary_cache_stats()['hits'], 1)
+
+    def test_api_estadisticas(self):
+        cached_salary(self.employee, 2024, 8)
+        cliente = APIClient()
+        cliente.force_authenticate(User.objects.create_superuser('admin', password='x'))
+        respuesta = cliente.get(reverse('salary_cache_stats_api'))
+        self.assertEqual(respuesta.data['misses'], 1)
+
+
+class CierreMesPorLotesTest(TestCase):
+    """nomina.generar_recibos_mes: lotes, upsert masivo y progreso."""
+
+    def setUp(self):
+        self.employees = []
+        for i in range(5):
+            employee = Employee.objects.create(
+                name=f'Cierre {i}', email=f'cierre{i}@example.com', hire_date=date(2023, 1, 1))
+            Salary.objects.create(employee=employee, base_amount=Decimal('1600'),
+                                  effective_date=date(2023, 1, 1))
+            WorkLog.objects.create(employee=employee, date=date(2023, 1, 2), hours_worked=80)
+            self.employees.append(employee)
+        self.sin_salario = Employee.objects.create(
+            name='Cierre sin salario', email='sin@example.com', hire_date=date(2023, 1, 1))
+
+    def test_lotes_con_progreso(self):
+        avances = []
+        generados, omitidos = generar_recibos_mes(
+            2023, 1, tam_lote=2, progreso=lambda hechos, total: avances.append((hechos, total)))
+
+        self.assertEqual([r.employee for r in generados], self.employees)
+        self.assertTrue(all(r.pk for r in generados))
+        self.assertEqual(omitidos, [self.sin_salario])
+        self.assertEqual(avances, [(2, 6), (4, 6), (6, 6)])
+        self.assertEqual(generados[0].total, Decimal('800.00'))
+
+    def test_cierre_en_segundo_plano(self):
+        admin = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(admin)
+        with mock.patch('employees.nomina.threading.Thread') as hilo, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('nomina_cierre'), {'year': 2023, 'month': 1})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ReciboNomina.objects.exists())  # la petición no cierra
+        cierre = CierreNomina.objects.get()
+        self.assertEqual(hilo.call_args.kwargs['args'], (cierre.pk,))
+
+        # Mientras corre no se lanza otro cierre ni el envío a Dolibarr
+        with mock.patch('employees.nomina.threading.Thread') as hilo:
+            self.client.post(reverse('nomina_cierre'), {'year': 2023, 'month': 1})
+            self.client.post(reverse('nomina_enviar_dolibarr'), {'year': 2023, 'month': 1})
+        hilo.assert_not_called()
+        self.assertEqual(CierreNomina.objects.count(), 1)
+        self.assertFalse(EnvioDolibarr.objects.exists())
+
+        ejecutar_cierre_mes(cierre.pk)
+        estado = self.client.get(reverse('nomina_cierre_estado', args=[cierre.pk])).json()
+        self.assertEqual((estado['estado'], estado['activo']), ('TERMINADO', False))
+        self.assertEqual((estado['hechos'], estado['total'], estado['generados'], estado['omitidos']),
+                         (6, 6, 5, 1))
+        self.assertIn('Cierre sin salario', estado['detalle'])
+        self.assertEqual(ReciboNomina.objects.filter(generado_por=admin).count(), 5)
+
+    def test_regenerar_actualiza_snapshot(self):
+        generar_recibos_mes(2023, 1)
+        WorkLog.objects.create(employee=self.employees[0], date=date(2023, 1, 3), hours_worked=80)
+        generados, _ = generar_recibos_mes(2023, 1, tam_lote=3)
+        self.assertEqual(ReciboNomina.objects.filter(year=2023, month=1).count(), 5)
+        self.assertEqual(generados[0].total, Decimal('1600.00'))
+
+    def test_comando_generar_recibos(self):
+        salida = StringIO()
+        call_command('generar_recibos', year=2023, month=1, lote=5, stdout=salida)
+        self.assertIn('5/6 empleados procesados', salida.getvalue())
+        self.assertIn('5 recibos generados', salida.getvalue())
+        self.assertIn('Omitido (sin salario configurado): Cierre sin salario', salida.getvalue())
+
+
+    def test_workers_en_sqlite_cierra_en_linea(self):
+        generados, omitidos = generar_recibos_mes(2023, 1, workers=3, tam_lote=2)
+        self.assertEqual([r.employee for r in generados], self.employees)
+        self.assertEqual(omitidos, [self.sin_salario])
+
+
+class IpacTest(TestCase):
+    def setUp(self):
+        self.kpi_ipac = KPI.objects.create(
+            name='IPAC', measurement_type='composite_ipac', target_value=Decimal('1'))
+        self.kpi_errors = KPI.objects.create(
+            name='Calidad', measurement_type='count_lt', target_value=Decimal('3'))
+        self.profile = JobProfile.objects.create(name='Operaciones')
+        self.profile.kpis.add(self.kpi_ipac)
+
+    def _employee(self, n, completed, on_time, errors=0):
+        employee = Employee.objects.create(
+            name=f'Ipac {n}', email=f'ipac{n}@example.com', hire_date=date(2023, 1, 1),
+            profile=self.profile)
+        board = TaskBoard.objects.create(employee=employee, name='Board')
+        hecho = TaskList.objects.create(board=board, name='Hecho', order=1)
+        for i in range(completed):
+            due = datetime(2024, 5, 20, 12) if i < on_time else datetime(2024, 5, 1, 12)
+            task = Task.objects.create(
+                list=hecho, assigned_to=employee, title=f'T{i}', order=i,
+                due_date=timezone.make_aware(due),
+                completed_at=timezone.make_aware(datetime(2024, 5, 10, 12)))
+            # 2 horas de ejecución por tarea
+            Task.objects.filter(pk=task.pk).update(
+                created_at=timezone.make_aware(datetime(2024, 5, 10, 10)))
+        if errors:
+            ManualKpiEntry.objects.create(employee=employee, kpi=self.kpi_errors,
+                                          date=date(2024, 5, 3), value=errors)
+        return employee
+
+    def test_una_consulta_por_empleado(self):
+        employee = self._employee(1, completed=4, on_time=2, errors=1)
+        with CaptureQueriesContext(connection) as ctx:
+            ipac = employee.calculate_ipac(2024, 5)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        # 4 tareas * 50% a tiempo * (1 - 1/4) / 2h
+        self.assertEqual(ipac, Decimal('0.75'))
+
+    def test_lote_en_una_consulta(self):
+        a = self._employee(1, completed=4, on_time=2, errors=1)
+        b = self._employee(2, completed=2, on_time=2)
+        sin_tareas = self._employee(3, completed=0, on_time=0)
+        with CaptureQueriesContext(connection) as ctx:
+            scores = ipac_scores(2024, 5, [a.pk, b.pk, sin_tareas.pk])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(scores, {a.pk: Decimal('0.75'), b.pk: Decimal('1.00'),
+                                  sin_tareas.pk: Decimal('0.00')})
+
+    def test_ranking_ordenado(self):
+        a = self._employee(1, completed=4, on_time=2, errors=1)
+        b = self._employee(2, completed=2, on_time=2)
+        ranking = ipac_ranking(2024, 5, self.kpi_ipac)
+        self.assertEqual([r['employee'] for r in ranking], [b, a])
+        self.assertEqual(ranking[0]['actual_value'], Decimal('1.00'))
+
+
+class CompiledRulesTest(TestCase):
+    def setUp(self):
+        self.kpi = KPI.objects.create(
+            name='Ventas', measurement_type='count_gt', target_value=Decimal('10'))
+        self.kpi_lt = KPI.objects.create(
+            name='Errores', measurement_type='count_lt', target_value=Decimal('3'))
+        BonusRule.objects.create(kpi=self.kpi, bonus_amount=Decimal('50'))
+        BonusRule.objects.create(kpi=self.kpi_lt, bonus_amount=Decimal('20'))
+        for threshold, amount in (('20', '80'), ('15', '60'), ('30', '70')):
+            KPIBonusTier.objects.create(kpi=self.kpi, threshold=Decimal(threshold),
+                                        bonus_amount=Decimal(amount))
+        for threshold, amount in (('0', '40'), ('1', '30')):
+            KPIBonusTier.objects.create(kpi=self.kpi_lt, threshold=Decimal(threshold),
+                                        bonus_amount=Decimal(amount))
+        self.profile = JobProfile.objects.create(name='Comercial')
+        self.profile.kpis.add(self.kpi, self.kpi_lt)
+
+    def test_escalones_por_bisect(self):
+        rules = compiled_rules()
+        ventas = rules.kpis[self.kpi.pk]
+        self.assertEqual(ventas.evaluate(5), (False, Decimal('0.00')))
+        self.assertEqual(ventas.evaluate(10), (True, Decimal('50')))
+        self.assertEqual(ventas.evaluate(15), (True, Decimal('60')))
+        # el escalón de 30 paga menos que el de 20: se queda el mejor alcanzado
+        self.assertEqual(ventas.evaluate(35), (True, Decimal('80')))
+
+        errores = rules.kpis[self.kpi_lt.pk]
+        self.assertEqual(errores.evaluate(0), (True, Decimal('40')))
+        self.assertEqual(errores.evaluate(1), (True, Decimal('30')))
+        self.assertEqual(errores.evaluate(2), (True, Decimal('20')))
+        self.assertEqual(errores.evaluate(3), (False, Decimal('0.00')))
+
+    def test_tabla_reutilizada_hasta_que_cambian_las_reglas(self):
+        primera = compiled_rules()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIs(compiled_rules(), primera)
+        self.assertEqual(len(ctx.captured_queries), 1)  # solo el token de versión
+
+        BonusRule.objects.filter(kpi=self.kpi).update(bonus_amount=Decimal('55'))
+        KPIBonusTier.objects.create(kpi=self.kpi, threshold=Decimal('12'),
+                                    bonus_amount=Decimal('58'))
+        nueva = compiled_rules()
+        self.assertIsNot(nueva, primera)
+        self.assertEqual(nueva.kpis[self.kpi.pk].evaluate(12), (True, Decimal('58')))
+
+    def test_perfil_compilado_una_vez(self):
+        self.profile.kpis.remove(self.kpi_lt)
+        rules = compiled_rules()
+        perfil = rules.for_profile(self.profile.pk)
+        self.assertEqual([c.kpi for c in perfil], [self.kpi])
+        self.assertIs(perfil[0], rules.kpis[self.kpi.pk])
+        self.assertEqual(rules.for_profile(None), ())
@@ -0,0 +1,240 @@
+"""Tests del resumen mensual incremental (EmployeeMonthSummary)."""
+import hashlib
+import hmac
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .api_views import DolibarrWebhookView
+from .models import (
+    KPI, BonusRule, DolibarrInstance, Employee, EmployeeMonthSummary, JobProfile,
+    ManualKpiEntry, ProductCreationLog, Salary, SalesRecord, Task, TaskBoard, TaskList, WorkLog,
+)
+from .payroll import PayrollBatch, cached_salary
+
+
+class EmployeeMonthSummaryTest(TestCase):
+    def setUp(self):
+        self.employee = Employee.objects.create(
+            name='Resumen', email='resumen@example.com', hire_date=date(2023, 1, 1),
+            commission_percentage=Decimal('10'))
+        Salary.objects.create(employee=self.employee, base_amount=Decimal('1600'),
+                              effective_date=date(2023, 1, 1))
+        self.instance = DolibarrInstance.objects.create(
+            name='ERP', professional_id='RUC-1', api_secret='secret')
+        board = TaskBoard.objects.create(employee=self.employee, name='Board')
+        self.hecho = TaskList.objects.create(board=board, name='Hecho', order=1)
+
+    def _summary(self, year, month):
+        return EmployeeMonthSummary.objects.get(employee=self.employee, year=year, month=month)
+
+    def _invoice(self, dolibarr_id, amount, invoice_date, payment_date=None):
+        return SalesRecord.objects.create(
+            employee=self.employee, dolibarr_instance=self.instance, dolibarr_id=dolibarr_id,
+            dolibarr_ref=f'FA-{dolibarr_id}', status='invoiced', amount_untaxed=Decimal(amount),
+            date=invoice_date, payment_date=payment_date)
+
+    def test_worklog_crear_mover_y_borrar(self):
+        log = WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 4),
+                                     hours_worked=8, overtime_hours=2)
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 5), hours_worked=6)
+        self.assertEqual(self._summary(2024, 3).hours_worked, Decimal('14'))
+        self.assertEqual(self._summary(2024, 3).overtime_hours, Decimal('2'))
+
+        log.date = date(2024, 4, 1)
+        log.save()
+        self.assertEqual(self._summary(2024, 3).hours_worked, Decimal('6'))
+        self.assertEqual(self._summary(2024, 4).hours_worked, Decimal('8'))
+
+        log.delete()
+        self.assertEqual(self._summary(2024, 4).hours_worked, Decimal('0'))
+
+    def test_pago_por_webhook_mueve_provisional_a_confirmado(self):
+        invoice = self._invoice(1, '500', date(2024, 3, 10))
+        self.assertEqual(self._summary(2024, 3).provisional_invoiced, Decimal('500'))
+
+        DolibarrWebhookView().process_payment(
+            {'object': {'invoice_ids': [invoice.dolibarr_id], 'date_payment': '2024-04-02'}},
+            self.instance)
+
+        self.assertEqual(self._summary(2024, 3).provisional_count, 0)
+        abril = self._summary(2024, 4)
+        self.assertEqual(abril.confirmed_invoiced, Decimal('500'))
+        self.assertEqual(abril.confirmed_count, 1)
+
+    def test_tareas_y_errores_para_ipac(self):
+        kpi = KPI.objects.create(name='Calidad', measurement_type='count_lt',
+                                 target_value=Decimal('3'))
+        ManualKpiEntry.objects.create(employee=self.employee, kpi=kpi,
+                                      date=date(2024, 3, 8), value=2)
+        task = Task.objects.create(
+            list=self.hecho, assigned_to=self.employee, title='T', order=1,
+            due_date=timezone.make_aware(datetime(2024, 3, 20, 12)))
+        self.assertEqual(self._summary(2024, 3).manual_errors, Decimal('2'))
+        self.assertFalse(EmployeeMonthSummary.objects.filter(
+            employee=self.employee, tasks_completed__gt=0).exists())
+
+        task.completed_at = timezone.make_aware(datetime(2024, 3, 15, 12))
+        task.save()
+        resumen = self._summary(2024, 3)
+        self.assertEqual(resumen.tasks_completed, 1)
+        self.assertEqual(resumen.tasks_completed_on_time, 1)
+
+    def test_salario_desde_resumen_igual_al_calculo_en_vivo(self):
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 4),
+                               hours_worked=80, overtime_hours=4)
+        self._invoice(1, '1000', date(2024, 2, 10), payment_date=date(2024, 3, 3))
+        self._invoice(2, '300', date(2024, 1, 10))
+        self._invoice(3, '200', date(2024, 3, 12))
+
+        en_vivo = PayrollBatch(2024, 3, [self.employee]).salaries()[self.employee.pk]
+        resumen = PayrollBatch(2024, 3, [self.employee],
+                               from_summaries=True).salaries()[self.employee.pk]
+        for clave in ('work_pay', 'overtime_pay', 'commission_amount', 'total_salary',
+                      'confirmed_invoiced', 'provisional_invoiced', 'provisional_count'):
+            self.assertEqual(resumen[clave], en_vivo[clave], clave)
+        self.assertEqual(resumen['provisional_count'], 2)
+
+    def _perfil_con_kpis(self):
+        """Un KPI de cada tipo con su regla de bono, en el perfil del empleado."""
+        perfil = JobProfile.objects.create(name='Completo')
+        kpis = {
+            'percentage': KPI.objects.create(name='Cumplidas', measurement_type='percentage',
+                                             target_value=Decimal('50')),
+            'count_lt': KPI.objects.create(name='Errores', measurement_type='count_lt',
+                                           target_value=Decimal('3')),
+            'count_gt': KPI.objects.create(name='Cerradas', measurement_type='count_gt',
+                                           target_value=Decimal('1')),
+            'productos': KPI.objects.create(name='Productos', measurement_type='count_gt',
+                                            internal_code='PRODUCT_CREATION',
+                                            target_value=Decimal('1')),
+        }
+        for kpi in kpis.values():
+            BonusRule.objects.create(kpi=kpi, bonus_amount=Decimal('25'), description='-')
+        perfil.kpis.set(kpis.values())
+        self.employee.profile = perfil
+        self.employee.save()
+        return kpis
+
+    def _datos_de_bonos(self, kpis):
+        pendiente = TaskList.objects.create(board=self.hecho.board, name='Pendiente', order=0)
+        marzo = timezone.make_aware(datetime(2024, 3, 20, 12))
+        for lista, completada in ((self.hecho, marzo), (self.hecho, marzo), (pendiente, None)):
+            Task.objects.create(list=lista, assigned_to=self.employee, title='T', order=1,
+                                kpi=kpis['percentage'], due_date=marzo, completed_at=completada)
+        Task.objects.create(list=self.hecho, assigned_to=self.employee, title='C', order=2,
+                            kpi=kpis['count_gt'], completed_at=marzo)
+        ManualKpiEntry.objects.create(employee=self.employee, kpi=kpis['count_lt'],
+                                      date=date(2024, 3, 8), value=2)
+        for n, duplicado in ((1, False), (2, False), (3, True)):
+            ProductCreationLog.objects.create(
+                employee=self.employee, dolibarr_instance=self.instance, dolibarr_product_id=n,
+                product_ref=f'SKU-{n}', created_at=marzo, is_suspect_duplicate=duplicado)
+
+    def test_contadores_por_kpi_desde_resumen_iguales_al_calculo_en_vivo(self):
+        kpis = self._perfil_con_kpis()
+        self._datos_de_bonos(kpis)
+
+        resumen = self._summary(2024, 3)
+        self.assertEqual(resumen.products_created, 2)
+        self.assertEqual(resumen.kpi_stats[str(kpis['percentage'].pk)],
+                         {'due': 3, 'done': 2, 'completed': 2, 'manual': '0'})
+
+        en_vivo = PayrollBatch(2024, 3, [self.employee])
+        desde_resumen = PayrollBatch(2024, 3, [self.employee], from_summaries=True)
+        for kpi in kpis.values():
+            self.assertEqual(desde_resumen.kpi_value(self.employee, kpi),
+                             en_vivo.kpi_value(self.employee, kpi), kpi.name)
+        self.assertEqual(desde_resumen.salaries()[self.employee.pk]['performance_bonus'],
+                         en_vivo.salaries()[self.employee.pk]['performance_bonus'])
+
+    def test_salario_en_cache_al_fallar_lee_solo_el_resumen(self):
+        kpis = self._perfil_con_kpis()
+        self._datos_de_bonos(kpis)
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 4), hours_worked=80)
+
+        with CaptureQueriesContext(connection) as consultas:
+            salario = cached_salary(self.employee, 2024, 3)
+        fuentes = ('employees_task"', 'employees_manualkpientry', 'employees_productcreationlog',
+                   'employees_worklog', 'employees_salesrecord')
+        self.assertFalse([q['sql'] for q in consultas
+                          if any(tabla in q['sql'] for tabla in fuentes)])
+        self.assertEqual(salario['performance_bonus'], Decimal('100'))
+
+    def test_renombrar_lista_hecho_recalcula_el_resumen(self):
+        kpis = self._perfil_con_kpis()
+        self._datos_de_bonos(kpis)
+        self.hecho.name = 'Terminado'
+        self.hecho.save()
+        stats = self._summary(2024, 3).kpi_stats[str(kpis['percentage'].pk)]
+        self.assertEqual(stats['done'], 0)
+
+    def test_cambiar_tipo_de_kpi_recalcula_errores(self):
+        kpi = KPI.objects.create(name='Reclamos', measurement_type='count_gt',
+                                 target_value=Decimal('3'))
+        ManualKpiEntry.objects.create(employee=self.employee, kpi=kpi,
+                                      date=date(2024, 3, 8), value=2)
+        self.assertEqual(self._summary(2024, 3).manual_errors, Decimal('0'))
+
+        kpi.measurement_type = 'count_lt'
+        kpi.save()
+        self.assertEqual(self._summary(2024, 3).manual_errors, Decimal('2'))
+
+    def test_comisiones_desde_el_libro(self):
+        self._invoice(1, '1000', date(2024, 2, 10), payment_date=date(2024, 3, 3))
+        self._invoice(2, '300', date(2023, 6, 10))  # provisional de hace meses
+        SalesRecord.objects.create(
+            employee=self.employee, dolibarr_instance=self.instance, dolibarr_id=3,
+            dolibarr_ref='AV-3', status='credit_note', amount_untaxed=Decimal('-200'),
+            date=date(2024, 3, 5))
+
+        with CaptureQueriesContext(connection) as consultas:
+            result = self.employee.calculate_commissions(2024, 3)
+        self.assertFalse([q for q in consultas if 'employees_salesrecord' in q['sql']])
+        self.assertEqual(
+            (result['confirmed_invoiced'], result['provisional_invoiced'],
+             result['provisional_count'], result['credit_notes_amount'], result['commission_amount']),
+            (Decimal('1000'), Decimal('300'), 1, Decimal('200'), Decimal('80.00')))
+
+    def test_webhook_fallido_no_deja_el_libro_a_medias(self):
+        invoice = self._invoice(1, '500', date(2024, 3, 10))
+        body = json.dumps({'trigger_code': 'PAYMENT_CUSTOMER_CREATE',
+                           'object': {'invoice_ids': [invoice.dolibarr_id],
+                                      'date_payment': '2024-04-02'}}).encode()
+        firma = hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+        with mock.patch('employees.api_views.invalidate_salary_cache', side_effect=RuntimeError):
+            response = APIClient().post('/api/webhook/dolibarr/', data=body,
+                                        content_type='application/json',
+                                        HTTP_X_DOLIBARR_PROFESSIONAL_ID='RUC-1',
+                                        HTTP_X_DOLIBARR_SIGNATURE=firma)
+        self.assertEqual(response.status_code, 500)
+        invoice.refresh_from_db()
+        self.assertIsNone(invoice.payment_date)
+        self.assertEqual(self._summary(2024, 3).provisional_invoiced, Decimal('500'))
+        self.assertFalse(EmployeeMonthSummary.objects.filter(year=2024, month=4).exists())
+
+    def test_reconstruir_resumenes(self):
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 4), hours_worked=8)
+        self._invoice(1, '100', date(2024, 2, 10), payment_date=date(2024, 3, 3))
+        EmployeeMonthSummary.objects.all().delete()
+
+        salida = StringIO()
+        call_command('reconstruir_resumenes', stdout=salida)
+        self.assertIn('2 resúmenes reconstruidos en 2 mes(es)', salida.getvalue())
+        self.assertEqual(self._summary(2024, 3).hours_worked, Decimal('8'))
+        self.assertEqual(self._summary(2024, 3).confirmed_invoiced, Decimal('100'))
+
+    def test_borrar_empleado_no_recalcula_resumenes(self):
+        WorkLog.objects.create(employee=self.employee, date=date(2024, 3, 4), hours_worked=8)
+        self.employee.delete()
+        self.assertFalse(EmployeeMonthSummary.objects.exists())
@@ -0,0 +1,173 @@
+"""Tests de sincronizar_dolibarr contra un servidor HTTP local que imita la API REST."""
+import json
+import re
+import threading
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+
+from . import dolibarr_api
+from .models import CursorDolibarr, DolibarrInstance, DolibarrUserIdentity, Employee, SalesRecord
+from .sincronizacion import sincronizar_instancia
+
+
+def _ts(dia, hora=12):
+    return int(datetime(2024, 3, dia, hora, tzinfo=dt_timezone.utc).timestamp())
+
+
+class StubDolibarr(ThreadingHTTPServer):
+    """API de Dolibarr mínima: listados paginados por t.tms con sqlfilters y
+    pagos por factura. `pedidos` guarda las rutas consultadas."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.datos = {'proposals': [], 'orders': [], 'invoices': []}
+        self.pagos = {}
+        self.pedidos = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        ruta = url.path.removeprefix('/api/index.php/')
+        self.server.pedidos.append((ruta, query))
+        if self.headers.get('DOLAPIKEY') != 'KEY':
+            return self._responder(401, {'error': 'unauthorized'})
+
+        pagos = re.fullmatch(r'invoices/(\d+)/payments', ruta)
+        if pagos:
+            return self._responder(200, self.server.pagos.get(int(pagos.group(1)), []))
+
+        objetos = sorted(self.server.datos.get(ruta, []), key=lambda o: o['date_modification'])
+        filtro = re.search(r"t\.tms:>=:'([^']+)'", query.get('sqlfilters', ''))
+        if filtro:
+            desde = datetime.fromisoformat(filtro.group(1)).replace(tzinfo=dt_timezone.utc).timestamp()
+            objetos = [o for o in objetos if o['date_modification'] >= desde]
+        limite, pagina = int(query['limit']), int(query['page'])
+        objetos = objetos[pagina * limite:(pagina + 1) * limite]
+        if not objetos:
+            return self._responder(404, {'error': {'code': 404, 'message': 'Not found'}})
+        self._responder(200, objetos)
+
+
+class SincronizarDolibarrTest(TestCase):
+    def setUp(self):
+        self.stub = StubDolibarr()
+        threading.Thread(target=self.stub.serve_forever, daemon=True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+
+        self.instance = DolibarrInstance.objects.create(
+            name='ERP', professional_id='PROF1', api_secret='s',
+            api_base_url=self.stub.url, api_key='KEY')
+        self.ana = Employee.objects.create(name='Ana', email='ana@example.com',
+                                           hire_date=date(2023, 1, 1))
+        DolibarrUserIdentity.objects.create(employee=self.ana, dolibarr_instance=self.instance,
+                                            dolibarr_user_id=5)
+        self.stub.datos['proposals'] = [
+            {'id': 10, 'ref': 'PR-10', 'statut': 2, 'total_ht': '1000.00', 'fk_user_author': 5,
+             'date_validation': _ts(1), 'date_modification': _ts(1)},
+            {'id': 11, 'ref': 'PR-11', 'statut': 0, 'total_ht': '50.00', 'fk_user_author': 5,
+             'date_validation': None, 'date_modification': _ts(2)},  # borrador
+        ]
+        self.stub.datos['invoices'] = [
+            {'id': 20, 'ref': 'FA-20', 'statut': 2, 'paye': 1, 'type': 0, 'total_ht': '1000.00',
+             'fk_user_author': 5, 'date_validation': _ts(5), 'date_modification': _ts(9),
+             'linkedObjectsIds': {'propal': {'3': 10}}},
+            {'id': 21, 'ref': 'FA-21', 'statut': 1, 'paye': 0, 'type': 0, 'total_ht': '300.00',
+             'fk_user_author': 5, 'date_validation': _ts(6), 'date_modification': _ts(6)},
+        ]
+        self.stub.pagos[20] = [{'amount': '600', 'date': '2024-03-10 09:00:00'},
+                               {'amount': '600', 'date': '2024-03-12 17:00:00'}]
+
+    def _ventas(self):
+        return sorted(SalesRecord.objects.values_list(
+            'dolibarr_id', 'status', 'amount_untaxed', 'date', 'payment_date', 'origin_proforma_id'))
+
+    def test_primera_sincronizacion_aplica_reglas_del_webhook(self):
+        resultado = sincronizar_instancia(self.instance)
+
+        self.assertEqual(self._ventas(), [
+            (10, 'proforma', Decimal('1000.00'), date(2024, 3, 1), None, None),
+            (20, 'invoiced', Decimal('1000.00'), date(2024, 3, 5), date(2024, 3, 12), 10),
+        ])  # FA-21 sin presupuesto ni pedido: rechazada como en el webhook
+        self.assertEqual(resultado['invoices']['leidos'], 2)
+        self.assertEqual(resultado['invoices']['pagos'], 1)
+        cursor = CursorDolibarr.objects.get(dolibarr_instance=self.instance, recurso='invoices')
+        self.assertEqual(cursor.modificado_hasta.timestamp(), _ts(9))
+
+    def test_pagos_se_piden_fuera_de_la_transaccion(self):
+        bloques = len(connection.atomic_blocks)  # los del TestCase
+        en_transaccion = []
+        original = dolibarr_api.pagos_factura
+
+        def pagos_factura(*args):
+            en_transaccion.append(len(connection.atomic_blocks) > bloques)
+            return original(*args)
+
+        with mock.patch.object(dolibarr_api, 'pagos_factura', pagos_factura):
+            resultado = sincronizar_instancia(self.instance)
+        self.assertEqual(en_transaccion, [False])
+        self.assertEqual(resultado['invoices']['pagos'], 1)
+
+    def test_incremental_solo_aplica_cambios(self):
+        sincronizar_instancia(self.instance)
+        self.stub.pedidos.clear()
+
+        resultado = sincronizar_instancia(self.instance)
+        self.assertEqual(sum(r['aplicados'] for r in resultado.values()), 0)
+        filtros = {ruta: q.get('sqlfilters') for ruta, q in self.stub.pedidos}
+        self.assertEqual(filtros['invoices'], "(t.tms:>=:'2024-03-09 11:55:00')")
+        self.assertNotIn('invoices/20/payments', filtros)  # ya pagada localmente
+
+        self.stub.datos['proposals'][0].update(total_ht='1250.00', date_modification=_ts(20))
+        resultado = sincronizar_instancia(self.instance)
+        # relee el borrador (dentro del solapamiento) pero solo aplica el cambio
+        self.assertEqual(resultado['proposals'], {'leidos': 2, 'aplicados': 1, 'errores': 0, 'pagos': 0})
+        self.assertEqual(SalesRecord.objects.get(status='proforma').amount_untaxed, Decimal('1250.00'))
+
+    def test_pagina_y_nota_de_credito(self):
+        self.stub.datos['invoices'].append(
+            {'id': 22, 'ref': 'AV-22', 'statut': 1, 'paye': 0, 'type': 2, 'total_ht': '200.00',
+             'fk_user_author': 99, 'fk_facture_source': 20, 'date_validation': _ts(15),
+             'date_modification': _ts(15)})
+        with mock.patch.object(dolibarr_api, 'TAM_PAGINA', 2):
+            sincronizar_instancia(self.instance)
+        paginas = [(q['page'], q['limit']) for ruta, q in self.stub.pedidos if ruta == 'invoices']
+        self.assertEqual(paginas, [('0', '2'), ('1', '2')])
+        nota = SalesRecord.objects.get(status='credit_note')
+        self.assertEqual((nota.employee, nota.amount_untaxed), (self.ana, Decimal('-200.00')))
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('sincronizar_dolibarr', stdout=salida)
+        self.assertIn('ERP: proposals 2 leídos/1 aplicados', salida.getvalue())
+        self.assertIn('1 pagos', salida.getvalue())
+
+        self.instance.api_key = 'OTRA'
+        self.instance.save()
+        with self.assertRaises(CommandError):
+            call_command('sincronizar_dolibarr', stdout=StringIO())
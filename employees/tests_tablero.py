@@ -0,0 +1,222 @@
+"""Tests del tablero de tareas: documento plano, número fijo de consultas y
+sincronización incremental (API de cambios y stream SSE)."""
+import json
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from . import cambios_tablero
+from .models import Checklist, ChecklistItem, Comment, Employee, Task, TaskBoard, TaskList, TaskTombstone
+
+
+class TableroPlanoTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tablero', password='x')
+        self.employee = Employee.objects.create(user=self.user, name='Tablero', email='t@example.com',
+                                                hire_date=date(2023, 1, 1))
+        self.board = TaskBoard.objects.create(employee=self.employee, name='Board')
+        self.listas = [TaskList.objects.create(board=self.board, name=n, order=i)
+                       for i, n in enumerate(['Pendiente', 'Hecho'])]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _tareas(self, n):
+        for i in range(n):
+            task = Task.objects.create(list=self.listas[i % 2], assigned_to=self.employee,
+                                       title=f'Tarea {i}', order=i)
+            checklist = Checklist.objects.create(task=task, title=f'Lista {i}')
+            ChecklistItem.objects.create(checklist=checklist, text='a')
+            ChecklistItem.objects.create(checklist=checklist, text='b', is_completed=True)
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(consultas), response.json()
+
+    def test_documento_normalizado(self):
+        self._tareas(3)
+        Task.objects.create(list=self.listas[0], assigned_to=self.employee, title='Plantilla',
+                            order=9, is_recurring=True, recurrence_frequency='daily')
+
+        _, doc = self._consultas(f'/api/boards/{self.board.pk}/flat/')
+        pendiente, hecho = self.listas
+        self.assertEqual(doc['board'], {'id': self.board.pk, 'name': 'Board',
+                                        'employee': self.employee.pk,
+                                        'lists': [pendiente.pk, hecho.pk]})
+        self.assertEqual(len(doc['lists'][str(pendiente.pk)]['tasks']), 2)  # sin la plantilla
+        tarea = doc['tasks'][str(doc['lists'][str(hecho.pk)]['tasks'][0])]
+        self.assertEqual((tarea['title'], tarea['list'], tarea['assigned_to']),
+                         ('Tarea 1', hecho.pk, self.employee.pk))
+        checklist = doc['checklists'][str(tarea['checklists'][0])]
+        self.assertEqual((checklist['task'], [i['text'] for i in checklist['items']]),
+                         (tarea['id'], ['a', 'b']))
+
+    def test_consultas_constantes(self):
+        for url in (f'/api/boards/{self.board.pk}/flat/', f'/api/boards/{self.board.pk}/'):
+            with self.subTest(url=url):
+                Task.objects.all().delete()
+                self._tareas(2)
+                pocas, _ = self._consultas(url)
+                self._tareas(30)
+                muchas, doc = self._consultas(url)
+                self.assertEqual(muchas, pocas)
+        self.assertEqual(len(doc['lists'][0]['tasks']) + len(doc['lists'][1]['tasks']), 32)
+
+
+class SincronizacionTableroTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('delta', password='x')
+        self.employee = Employee.objects.create(user=self.user, name='Delta', email='d@example.com',
+                                                hire_date=date(2023, 1, 1))
+        otro = User.objects.create_user('otro', password='x')
+        self.otro = Employee.objects.create(user=otro, name='Otro', email='o@example.com',
+                                            hire_date=date(2023, 1, 1))
+        board = TaskBoard.objects.create(employee=self.employee, name='Board')
+        self.lista = TaskList.objects.create(board=board, name='Pendiente', order=1)
+        self.tareas = [Task.objects.create(list=self.lista, assigned_to=self.employee,
+                                           title=f'Tarea {i}', order=i) for i in range(3)]
+        self.ajena = Task.objects.create(list=self.lista, assigned_to=self.otro, title='Ajena', order=9)
+        self.checklist = Checklist.objects.create(task=self.tareas[0], title='Lista')
+        self.item = ChecklistItem.objects.create(checklist=self.checklist, text='a')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _cursor_pasado(self, segundos=60):
+        """Cursor de hace un rato, más atrás que el solapamiento."""
+        return str(int((timezone.now() - timedelta(seconds=segundos)).timestamp() * 1_000_000))
+
+    def _envejecer(self):
+        antes = timezone.now() - timedelta(minutes=10)
+        Task.objects.update(updated_at=antes)
+        Checklist.objects.update(updated_at=antes)
+        ChecklistItem.objects.update(updated_at=antes)
+
+    def _cambios(self, since):
+        response = self.client.get('/api/tasks/changes/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_solo_lo_cambiado_desde_el_cursor(self):
+        self._envejecer()
+        since = self._cursor_pasado()
+        tarea = self.tareas[1]
+        tarea.status = 'completed'
+        tarea.save()
+        self.item.is_completed = True
+        self.item.save()
+        Comment.objects.create(task=self.tareas[2], user=self.user, text='hola')
+        self.ajena.save()
+
+        delta = self._cambios(since)
+        self.assertFalse(delta['reset'])
+        self.assertEqual([(t['id'], t['status']) for t in delta['tasks']], [(tarea.pk, 'completed')])
+        self.assertEqual([(c['id'], c['items'][0]['is_completed']) for c in delta['checklists']],
+                         [(self.checklist.pk, True)])
+        self.assertEqual([c['text'] for c in delta['comments']], ['hola'])
+
+        # Con el cursor nuevo no vuelve nada (fuera del solapamiento)
+        self._envejecer()
+        Comment.objects.update(updated_at=timezone.now() - timedelta(minutes=10))
+        siguiente = self._cambios(delta['cursor'])
+        self.assertEqual((siguiente['tasks'], siguiente['checklists'], siguiente['comments']), ([], [], []))
+
+    def test_borrados_con_lapida_y_cascada_sin(self):
+        since = self._cursor_pasado()
+        borrada = self.tareas[0].pk
+        ChecklistItem.objects.create(checklist=self.checklist, text='b').delete()
+        self.tareas[0].delete()   # arrastra su checklist e ítem: sin lápida propia
+        self.ajena.delete()       # de otro empleado: no se ve
+
+        self.assertEqual(TaskTombstone.objects.count(), 3)
+        delta = self._cambios(since)
+        self.assertEqual(delta['deleted']['tasks'], [borrada])
+        self.assertEqual(len(delta['deleted']['items']), 1)
+        self.assertEqual(delta['deleted']['checklists'], [])
+
+    def test_cursor_vencido_o_invalido(self):
+        vencido = self._cursor_pasado(segundos=40 * 86400)
+        self.assertTrue(self._cambios(vencido)['reset'])
+        response = self.client.get('/api/tasks/changes/', {'since': 'ayer'})
+        self.assertEqual(response.status_code, 400)
+
+        TaskTombstone.objects.create(kind='task', object_id=1,
+                                     deleted_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(cambios_tablero.purgar_borrados(), 1)
+
+    def test_consultas_constantes(self):
+        since = self._cursor_pasado()
+        with CaptureQueriesContext(connection) as pocas:
+            self._cambios(since)
+        for i in range(20):
+            tarea = Task.objects.create(list=self.lista, assigned_to=self.employee,
+                                        title=f'Nueva {i}', order=10 + i)
+            Checklist.objects.create(task=tarea, title='x')
+            Comment.objects.create(task=tarea, user=self.user, text='x')
+        with CaptureQueriesContext(connection) as muchas:
+            delta = self._cambios(since)
+        self.assertEqual(len(delta['tasks']), 23)
+        self.assertEqual(len(muchas), len(pocas))
+
+
+@override_settings(TABLERO_SSE_ACTIVO=True, TABLERO_SSE_SEGUNDOS=0)
+class TableroEventosTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sse', password='x')
+        self.employee = Employee.objects.create(user=self.user, name='SSE', email='s@example.com',
+                                                hire_date=date(2023, 1, 1))
+        self.board = TaskBoard.objects.create(employee=self.employee, name='Board')
+        self.pendiente = TaskList.objects.create(board=self.board, name='Pendiente', order=1)
+        self.hecho = TaskList.objects.create(board=self.board, name='Hecho', order=2)
+        self.tarea = Task.objects.create(list=self.pendiente, assigned_to=self.employee,
+                                         title='Vieja', order=1)
+        Task.objects.update(created_at=timezone.now() - timedelta(days=1),
+                            updated_at=timezone.now() - timedelta(days=1))
+        self.tarea.refresh_from_db()
+        self.url = f'/board/{self.board.pk}/events/'
+        self.client.force_login(self.user)
+
+    def _eventos(self, **headers):
+        response = self.client.get(self.url, {'since': cambios_tablero.cursor_actual()}, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        bloques = b''.join(response.streaming_content).decode().strip().split('\n\n')
+        return [dict(linea.split(': ', 1) for linea in bloque.split('\n')) for bloque in bloques]
+
+    def test_movidas_completadas_y_nuevas(self):
+        self.tarea.list = self.hecho
+        self.tarea.status = 'completed'
+        self.tarea.completed_at = timezone.now()
+        self.tarea.save()
+        nueva = Task.objects.create(list=self.pendiente, assigned_to=self.employee, title='Nueva', order=2)
+        borrada = Task.objects.create(list=self.pendiente, assigned_to=self.employee, title='X', order=3)
+        borrada_id = borrada.pk
+        borrada.delete()
+
+        eventos = self._eventos()
+        self.assertEqual(eventos[0], {'retry': '2000'})
+        recibidos = [(e['event'], json.loads(e['data'])['id']) for e in eventos if 'event' in e]
+        self.assertEqual(recibidos, [('task.completed', self.tarea.pk), ('task.created', nueva.pk),
+                                     ('task.deleted', borrada_id)])
+        self.assertEqual(json.loads(eventos[1]['data'])['list'], self.hecho.pk)
+        self.assertIn('id', eventos[-1])  # cursor para reconectar
+
+    def test_reanuda_desde_last_event_id(self):
+        viejo = str(int((timezone.now() - timedelta(days=40)).timestamp() * 1_000_000))
+        eventos = self._eventos(last_event_id=viejo)
+        self.assertEqual([e.get('event') for e in eventos], [None, 'reset'])
+
+    def test_solo_el_dueno_o_superusuario(self):
+        self.assertContains(self.client.get('/board/'), self.url)
+        otro = User.objects.create_user('otro-sse', password='x')
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(TABLERO_SSE_ACTIVO=False)
+    def test_apagado_sondea(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertContains(self.client.get('/board/'), 'if (false && window.EventSource)')
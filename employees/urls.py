@@ -10,6 +10,7 @@ urlpatterns = [
     path('employees/<int:employee_id>/salary/', views.employee_salary, name='employee_salary'),
     path('employees/<int:employee_id>/terminate/', views.terminate_employee, name='terminate_employee'),
     path('board/', views.task_board, name='task_board'),
+    path('board/<int:board_id>/events/', views.task_board_events, name='task_board_events'),
     path('dashboard/', views.strategic_dashboard, name='strategic_dashboard'),
     path('reports/', views.performance_report, name='performance_report'),
     path('ranking/', views.employee_ranking, name='employee_ranking'),
@@ -21,7 +22,9 @@ urlpatterns = [
     path('mis-recibos/', views.mis_recibos, name='mis_recibos'),
     path('recibos/<int:employee_id>/<int:year>/<int:month>/pdf/', views.recibo_pdf, name='recibo_pdf'),
     path('nomina/', views.nomina_cierre, name='nomina_cierre'),
+    path('nomina/cierre/<int:cierre_id>/', views.nomina_cierre_estado, name='nomina_cierre_estado'),
     path('nomina/enviar-dolibarr/', views.nomina_enviar_dolibarr, name='nomina_enviar_dolibarr'),
+    path('nomina/enviar-dolibarr/<int:envio_id>/', views.nomina_envio_estado, name='nomina_envio_estado'),
     path('nomina/planilla/', views.nomina_planilla, name='nomina_planilla'),
     path('post-login/', views.post_login, name='post_login'),
     path('login/', auth_views.LoginView.as_view(template_name='employees/login.html'), name='login'),
@@ -1,7 +1,9 @@
 import csv
-from django.http import HttpResponse
-from django.shortcuts import render, redirect
-from .models import Employee, WorkLog, TaskBoard, EmployeePerformanceRecord, CompanySettings, KPI, BonusRule
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from .models import Employee, WorkLog, Task, TaskBoard, EmployeePerformanceRecord, CompanySettings, KPI, BonusRule
+from . import cambios_tablero
+from .payroll import cached_salary, ipac_ranking
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from datetime import date, timedelta
@@ -9,6 +11,8 @@ from decimal import Decimal
 from django.contrib import messages
 import calendar
 from django.db.models import Max, Sum, Q
+from django.conf import settings
+from django.utils import timezone
 
 def index(request):
     """Renders the home page."""
@@ -41,8 +45,10 @@ def employee_list(request):
 
 def _build_salary_context(employee, year, month):
     """Builds the salary breakdown + 'striking' metrics context shared by
-    employee_salary and mi_panel."""
-    salary = employee.calculate_salary(year, month)
+    employee_salary and mi_panel. The breakdown is a side-effect-free
+    simulation read from the monthly summaries and served from the versioned
+    salary cache (payroll.cached_salary)."""
+    salary = cached_salary(employee, year, month)
 
     potential_bonus = Decimal('0.00')
     lost_bonus = Decimal('0.00')
@@ -123,6 +129,8 @@ def task_board(request):
     board = None
     all_employees = None
     selected_employee_id = None
+    # Delta sync starts from here: the page then polls /api/tasks/changes/
+    sync_cursor = cambios_tablero.cursor_actual()
 
     def _ensure_board_and_lists(employee):
         """Helper function to get/create board and default lists."""
@@ -194,9 +202,40 @@ def task_board(request):
         'status_filter': status_filter,
         'all_employees': all_employees,
         'selected_employee_id': selected_employee_id,
+        'sync_cursor': sync_cursor,
+        'sse_enabled': getattr(settings, 'TABLERO_SSE_ACTIVO', True),
+        'status_labels': {value: str(label) for value, label in Task.STATUS_CHOICES},
     }
     return render(request, 'employees/task_board.html', context)
 
+@login_required
+def task_board_events(request, board_id):
+    """
+    Server-sent events with the board's task changes (see
+    cambios_tablero.flujo). Resumes from Last-Event-ID or `?since=`.
+    Only the board's employee and superusers may listen. Each open stream
+    holds a worker thread (scripts/gunicorn.conf.py); servers still on sync
+    workers turn it off with TABLERO_SSE_ACTIVO = False.
+    """
+    if not getattr(settings, 'TABLERO_SSE_ACTIVO', True):
+        raise Http404("Board event stream is disabled.")
+    board = get_object_or_404(TaskBoard, pk=board_id)
+    if not request.user.is_superuser and getattr(request.user, 'employee', None) != board.employee:
+        raise PermissionDenied
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        desde = cambios_tablero.leer_cursor(since) if since else timezone.now()
+    except (ValueError, OverflowError, OSError):
+        return HttpResponseBadRequest("Invalid since cursor.")
+
+    tareas = Task.objects.filter(list__board=board, is_recurring=False)
+    response = StreamingHttpResponse(
+        cambios_tablero.flujo(tareas, [board.employee_id], desde),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
+
 @login_required
 def performance_report(request):
     """
@@ -281,7 +320,6 @@ def company_settings(request):
 
 from django.db.models import Avg, Sum, Count, F
 from django.db.models.functions import Coalesce
-from .models import Task
 import json
 
 @login_required
@@ -315,23 +353,17 @@ def strategic_dashboard(request):
         on_time_count = tasks_with_due_date.filter(completed_at__isnull=False, completed_at__date__lte=F('due_date')).count()
         kpis['on_time_percentage'] = (on_time_count / total_due) * 100 if total_due > 0 else 100
 
-    # Calculate average IPAC score and total bonus from performance records
+    # Average IPAC computed live for the period (one grouped query), so it
+    # does not depend on salaries having been calculated
     ipac_kpi = KPI.objects.filter(measurement_type='composite_ipac').first()
-    if ipac_kpi:
-        ipac_records = EmployeePerformanceRecord.objects.filter(kpi=ipac_kpi, date__year=year, date__month=month)
-        kpis['avg_ipac'] = ipac_records.aggregate(avg_val=Avg('actual_value'))['avg_val'] or 0
+    ipac_rows = ipac_ranking(year, month, ipac_kpi) if ipac_kpi else []
+    if ipac_rows:
+        kpis['avg_ipac'] = sum(r['actual_value'] for r in ipac_rows) / len(ipac_rows)
 
     kpis['total_bonus'] = EmployeePerformanceRecord.objects.filter(date__year=year, date__month=month).aggregate(total=Sum('bonus_awarded'))['total'] or 0
 
     # --- 2. Employee Ranking ---
-    ranking_records = None
-    if ipac_kpi:
-        ranking_records = EmployeePerformanceRecord.objects.filter(
-            Q(employee__end_date__isnull=True) | Q(employee__end_date__gte=date.today()),
-            kpi=ipac_kpi,
-            date__year=year,
-            date__month=month,
-        ).select_related('employee').order_by('-actual_value')[:5] # Top 5 employees
+    ranking_records = ipac_rows[:5]  # Top 5 employees
 
     # --- 3. Warning KPIs ---
     warning_kpis = KPI.objects.filter(is_warning_kpi=True)
@@ -397,7 +429,14 @@ def employee_ranking(request):
 
             latest_date = latest_date_info.get('max_date')
 
-            if latest_date:
+            if selected_kpi.measurement_type == 'composite_ipac':
+                # IPAC is cheap to compute live: rank the latest recorded
+                # period (or last month) straight from tasks and errors
+                if not latest_date:
+                    latest_date = date.today().replace(day=1) - timedelta(days=1)
+                period = latest_date.strftime('%B %Y')
+                ranking_records = ipac_ranking(latest_date.year, latest_date.month, selected_kpi)
+            elif latest_date:
                 period = latest_date.strftime('%B %Y')
                 records_query = EmployeePerformanceRecord.objects.filter(
                     Q(employee__end_date__isnull=True) | Q(employee__end_date__gte=date.today()),
@@ -602,9 +641,10 @@ def mi_panel(request):
 
 @login_required
 def nomina_cierre(request):
-    """Pantalla de cierre de mes (superuser): genera los recibos del período."""
-    from .nomina import generar_recibos_mes
-    from .models import ReciboNomina
+    """Pantalla de cierre de mes (superuser). El POST lanza en segundo plano la
+    generación de los recibos del período; la pantalla muestra el avance."""
+    from .nomina import iniciar_cierre_mes
+    from .models import CierreNomina, EnvioDolibarr, ReciboNomina
 
     if not request.user.is_superuser:
         raise PermissionDenied
@@ -614,23 +654,26 @@ def nomina_cierre(request):
     month = int(request.POST.get('month') or request.GET.get('month') or today.month)
 
     if request.method == 'POST':
-        generados, omitidos = generar_recibos_mes(year, month, generado_por=request.user)
-        messages.success(request, f"{len(generados)} recibos generados para {month:02d}/{year}.")
-        if omitidos:
-            nombres = ', '.join(e.name for e in omitidos)
-            messages.warning(request, f"Sin salario configurado (omitidos): {nombres}")
+        _cierre, nuevo = iniciar_cierre_mes(year, month, usuario=request.user)
+        if nuevo:
+            messages.info(request, f"Cierre de {month:02d}/{year} iniciado; el avance se muestra abajo.")
+        else:
+            messages.warning(request, "Ya hay un cierre en curso para este período.")
         return redirect(f"{request.path}?year={year}&month={month}")
 
     recibos = ReciboNomina.objects.filter(year=year, month=month).select_related('employee')
-    context = {'year': year, 'month': month, 'recibos': recibos}
+    cierre = CierreNomina.objects.filter(year=year, month=month).first()
+    envio = EnvioDolibarr.objects.filter(year=year, month=month).first()
+    context = {'year': year, 'month': month, 'recibos': recibos, 'cierre': cierre, 'envio': envio}
     return render(request, 'employees/nomina.html', context)
 
 
 @login_required
 def nomina_enviar_dolibarr(request):
-    """Envía los recibos del período a Dolibarr como salarios (superuser, POST)."""
+    """Lanza en segundo plano el envío de los recibos del período a Dolibarr
+    como salarios (superuser, POST). La pantalla de nómina muestra el avance."""
     from django.urls import reverse
-    from .nomina import enviar_recibos_dolibarr
+    from .nomina import cierre_activo, iniciar_envio_dolibarr
 
     if not request.user.is_superuser:
         raise PermissionDenied
@@ -640,21 +683,59 @@ def nomina_enviar_dolibarr(request):
     today = date.today()
     year = int(request.POST.get('year') or today.year)
     month = int(request.POST.get('month') or today.month)
-    resultado = enviar_recibos_dolibarr(year, month)
-
-    if resultado['enviados']:
-        messages.success(request, f"{len(resultado['enviados'])} recibos enviados a Dolibarr.")
-    if resultado['ya_sincronizados']:
-        messages.info(request, f"{len(resultado['ya_sincronizados'])} ya estaban sincronizados.")
-    if resultado['sin_mapeo']:
-        nombres = ', '.join(e.name for e in resultado['sin_mapeo'])
-        messages.warning(request, f"Sin identidad Dolibarr (omitidos): {nombres}")
-    if resultado['con_error']:
-        nombres = ', '.join(r.employee.name for r, _ in resultado['con_error'])
-        messages.error(request, f"Error al enviar (ver detalle en la tabla): {nombres}")
+    if cierre_activo(year, month):
+        # Enviaría los recibos de un cierre a medio generar
+        messages.warning(request, "Espera a que termine el cierre del período antes de enviarlo.")
+        return redirect(f"{reverse('nomina_cierre')}?year={year}&month={month}")
+    _envio, nuevo = iniciar_envio_dolibarr(year, month, usuario=request.user)
+
+    if nuevo:
+        messages.info(request, "Envío a Dolibarr iniciado; el avance se muestra abajo.")
+    else:
+        messages.warning(request, "Ya hay un envío a Dolibarr en curso para este período.")
     return redirect(f"{reverse('nomina_cierre')}?year={year}&month={month}")
 
 
+@login_required
+def nomina_cierre_estado(request, cierre_id):
+    """Avance de un CierreNomina en JSON, para el sondeo de la pantalla de nómina."""
+    from .models import CierreNomina
+
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    cierre = get_object_or_404(CierreNomina, pk=cierre_id)
+    return JsonResponse({
+        'estado': cierre.estado,
+        'activo': cierre.activo,
+        'hechos': cierre.hechos,
+        'total': cierre.total,
+        'generados': cierre.generados,
+        'omitidos': cierre.omitidos,
+        'detalle': cierre.detalle,
+    })
+
+
+@login_required
+def nomina_envio_estado(request, envio_id):
+    """Avance de un EnvioDolibarr en JSON, para el sondeo de la pantalla de nómina."""
+    from .models import EnvioDolibarr
+
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    envio = get_object_or_404(EnvioDolibarr, pk=envio_id)
+    return JsonResponse({
+        'estado': envio.estado,
+        'activo': envio.activo,
+        'hechos': envio.hechos,
+        'total': envio.total,
+        'enviados': envio.enviados,
+        'ya_sincronizados': envio.ya_sincronizados,
+        'sin_mapeo': envio.sin_mapeo,
+        'con_error': envio.con_error,
+        'detalle': envio.detalle,
+    })
+
+
 @login_required
 def nomina_planilla(request):
     """Descarga la planilla de nómina XLSX del período (superuser)."""
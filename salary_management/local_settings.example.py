@@ -48,3 +48,28 @@ DEFAULT_FROM_EMAIL = "Salarios <notificaciones@example.com>"
 
 # URL pública del sistema (para links en emails enviados desde cron)
 SITE_BASE_URL = "https://salarios.example.com"
+
+# Hilos del cierre de mes desde /nomina/ (cada hilo usa una conexión a PostgreSQL)
+NOMINA_CIERRE_WORKERS = 4
+
+# Caché compartida entre workers de gunicorn (desgloses de salario y sus
+# contadores de aciertos en /api/payroll/cache-stats/). Sin esto cada worker
+# usa su propia caché en memoria.
+# CACHES = {
+#     "default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": "redis://127.0.0.1:6379/1",
+#     }
+# }
+# Con esa caché compartida, el límite del webhook de Dolibarr cuenta ahí
+# (un incr por petición) en vez de hacer un UPDATE en la base.
+# WEBHOOK_BUCKET_CACHE = "default"
+
+# Webhook de Dolibarr en modo ingesta: responde 202 tras guardar el evento y
+# el worker `procesar_webhooks --continuo` lo aplica (ver scripts/crontab.example).
+DOLIBARR_WEBHOOK_ASYNC = True
+
+# Tablero en vivo por SSE (activo por defecto). Requiere gunicorn con
+# scripts/gunicorn.conf.py (workers gthread); mientras el servidor siga con
+# workers sync, apagarlo: cada pestaña abierta bloquearía un worker entero.
+# TABLERO_SSE_ACTIVO = False
@@ -151,6 +151,70 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # commands (no request available there). Override in local_settings.py.
 SITE_BASE_URL = 'http://localhost:8000'
 
+# Hilos del cierre de mes lanzado desde /nomina/ (CierreNomina, corre en
+# segundo plano). Con SQLite se ignora y cierra en un hilo, porque la base
+# serializa las escrituras; con PostgreSQL cada hilo usa su conexión.
+NOMINA_CIERRE_WORKERS = 4
+
+# Recibos enviados a la vez a Dolibarr (nomina.enviar_recibos_dolibarr). Son
+# hilos que solo esperan HTTP, así que no dependen del motor de base de datos.
+DOLIBARR_PUSH_WORKERS = 8
+
+# Vigencia (segundos) de los desgloses de salario en caché (payroll.cached_salary).
+# La invalidación es por versión; el timeout solo limpia entradas huérfanas.
+SALARY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Días por delante de hoy hasta los que `materializar_recurrentes` crea las
+# instancias de las tareas recurrentes (0: solo las que vencen hasta hoy).
+TAREAS_RECURRENTES_HORIZONTE_DIAS = 0
+
+# Días que se guardan los borrados del tablero (TaskTombstone) para
+# /api/tasks/changes/; un cursor más viejo recibe `reset` y recarga todo.
+TABLERO_BORRADOS_DIAS = 30
+
+# Stream SSE del tablero (/board/<id>/events/). Cada conexión abierta ocupa
+# un hilo mientras dura: requiere gunicorn con workers gthread
+# (scripts/gunicorn.conf.py, ver docs/DEPLOY_CHECKLIST.md); con workers sync
+# dos pestañas bastan para bloquear el sitio, así que un servidor que aún no
+# migró debe poner False en local_settings.py. Apagado, el tablero sondea
+# /api/tasks/changes/ cada 30 s. Cada conexión consulta la base cada
+# TABLERO_SSE_INTERVALO segundos y se cierra a los TABLERO_SSE_SEGUNDOS; el
+# navegador reconecta solo.
+TABLERO_SSE_ACTIVO = True
+TABLERO_SSE_SEGUNDOS = 25
+TABLERO_SSE_INTERVALO = 2
+
+# Webhook de Dolibarr: con True solo verifica la firma, guarda el WebhookLog
+# como 'queued' y responde 202; `procesar_webhooks` aplica los eventos.
+# Con False (default) se procesan dentro de la petición, como siempre.
+DOLIBARR_WEBHOOK_ASYNC = False
+
+# Segundos que cada worker reutiliza las instancias e identidades de Dolibarr
+# resueltas por el webhook (identidades.py) si la caché no es compartida.
+DOLIBARR_LOOKUP_CACHE_TTL = 60
+
+# Intentos de un webhook encolado antes de quedar en 'dead' (cola_webhooks.py).
+WEBHOOK_MAX_INTENTOS = 5
+
+# Límite del webhook por instancia, compartido entre workers (limite_webhooks.py):
+# cubeta de CAPACIDAD tokens (ráfaga máxima) que se rellena a TASA por segundo.
+WEBHOOK_BUCKET_CAPACIDAD = 60
+WEBHOOK_BUCKET_TASA = 5.0  # 300/min
+# Alias de CACHES compartido entre workers (Redis/Memcached) para contar en la
+# caché con un incr atómico en vez de un UPDATE por petición; None usa la base.
+WEBHOOK_BUCKET_CACHE = None
+
+# Horas que un evento de webhook ya aplicado se reconoce como reenvío sin
+# tocar las ventas (idempotencia_webhooks.py); cada reenvío renueva el plazo.
+WEBHOOK_IDEMPOTENCIA_HORAS = 24
+
+# Retención de WebhookLog (archivar_webhooks): a los procesados se les borran
+# los headers pasados COMPACTAR días y los que superan RETENCION días se mueven
+# a archivos .jsonl.gz en WEBHOOK_ARCHIVE_DIR (índice: WebhookArchive).
+WEBHOOK_LOG_COMPACTAR_DIAS = 7
+WEBHOOK_LOG_RETENCION_DIAS = 90
+WEBHOOK_ARCHIVE_DIR = BASE_DIR / 'archivo' / 'webhooks'
+
 # DRF: without an explicit default, permission falls back to AllowAny and
 # every router endpoint (worklogs, tasks...) is world-readable/writable.
 # The Dolibarr webhook keeps its own explicit AllowAny + HMAC validation.
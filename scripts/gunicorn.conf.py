@@ -0,0 +1,27 @@
+# ==============================================================================
+# gunicorn.conf.py - Configuración de gunicorn para la aplicación Django
+#
+# Uso (ExecStart de gunicorn.service, ver docs/DEPLOY_CHECKLIST.md):
+#   venv/bin/gunicorn -c scripts/gunicorn.conf.py --bind <el de nginx> \
+#       salary_management.wsgi:application
+# Las opciones de la línea de comandos ganan sobre este archivo: quitar del
+# ExecStart --workers, --worker-class, --threads y --timeout si los tenía.
+#
+# Workers con hilos (gthread): el tablero de tareas mantiene abierto un stream
+# SSE por pestaña (/board/<id>/events/, TABLERO_SSE_ACTIVO) que ocupa un hilo
+# mientras dura, no un worker entero. Con workers sync dos pestañas bastaban
+# para bloquear el sitio. `threads` debe superar las pestañas abiertas a la
+# vez más las peticiones normales; cada hilo abre su propia conexión a
+# PostgreSQL (revisar max_connections: workers * threads).
+#
+# caldav.service NO usa este archivo (sigue con su propio ExecStart).
+# ==============================================================================
+
+worker_class = 'gthread'
+workers = 2
+threads = 32
+
+# Cada stream SSE se corta a los TABLERO_SSE_SEGUNDOS (25 s) y el navegador
+# reconecta, así que ninguna petición se acerca a este límite.
+timeout = 120
+graceful_timeout = 30